@@ -12,6 +12,19 @@ Design goals:
 - Easy to replace with real Cortex later
 """
 
+import numpy as np
+
+
+def forecast_explanation(avg_daily_demand: float, lead_time_days: int, horizon_days: int = 7) -> str:
+    """Human-readable explanation for one forecast (built at render time)."""
+    return (
+        f"Forecast uses recent average demand ({avg_daily_demand:.1f}/day) "
+        f"projected over {horizon_days} days. "
+        f"Lead time considered: {lead_time_days} days. "
+        "Confidence band reflects demand variability."
+    )
+
+
 def cortex_demand_forecast(
     avg_daily_demand: float,
     lead_time_days: int,
@@ -34,12 +47,7 @@ def cortex_demand_forecast(
     lower_bound = forecast_units * 0.8
     upper_bound = forecast_units * 1.2
 
-    explanation = (
-        f"Forecast uses recent average demand ({avg_daily_demand:.1f}/day) "
-        f"projected over {horizon_days} days. "
-        f"Lead time considered: {lead_time_days} days. "
-        "Confidence band reflects demand variability."
-    )
+    explanation = forecast_explanation(avg_daily_demand, lead_time_days, horizon_days)
 
     return {
         "forecast_units": round(forecast_units, 1),
@@ -47,3 +55,21 @@ def cortex_demand_forecast(
         "upper_bound": round(upper_bound, 1),
         "explanation": explanation
     }
+
+
+def cortex_demand_forecast_batch(avg_daily_demand, horizon_days: int = 7) -> dict:
+    """
+    Same model as cortex_demand_forecast over whole arrays.
+
+    Returns arrays (no per-row dicts or explanation strings):
+    - forecast_units
+    - lower_bound
+    - upper_bound
+    """
+    forecast_units = np.asarray(avg_daily_demand, dtype="float64") * horizon_days
+
+    return {
+        "forecast_units": np.round(forecast_units, 1),
+        "lower_bound": np.round(forecast_units * 0.8, 1),
+        "upper_bound": np.round(forecast_units * 1.2, 1)
+    }
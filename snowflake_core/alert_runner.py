@@ -0,0 +1,234 @@
+# alert_runner.py
+"""
+Scheduled alert runner, independent of browser sessions.
+
+    python alert_runner.py                 # every 5 minutes, forever
+    python alert_runner.py --once          # single scan (cron / Snowflake Task)
+    python alert_runner.py --smtp-host localhost --smtp-port 1025
+
+Each run:
+1. loads STOCK_HEALTH_DT (Snowflake or the local engine) or the offline
+   snapshot
+2. evaluates every stored subscription with the alert engine, each
+   against its tenant's rows (tenancy.py directory)
+3. claims each digest in the run ledger, then delivers it through a
+   bounded pool of senders with jittered exponential-backoff retries
+4. commits the new alert state with compare-and-set
+
+Runs are aligned to wall-clock multiples of the interval plus a small
+offset, so they land just after the 5-minute STOCK_HEALTH_DT refresh.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from alerts import DEFAULT_OUTBOX_DIR, AlertEngine, FileSender, SmtpSender
+from connection import session_from_env
+from local_engine import open_local_engine
+from pipeline import enrich_stock_frame
+from query import stock_health_sql
+from snapshot import DEFAULT_SNAPSHOT_DIR, load_snapshot
+from status import load_policy
+from subscriptions import DEFAULT_SQLITE_PATH, open_subscription_store
+from tenancy import load_directory
+
+
+log = logging.getLogger("carestock.alerts")
+
+DEFAULT_INTERVAL_SECONDS = 300   # STOCK_HEALTH_DT TARGET_LAG
+DEFAULT_OFFSET_SECONDS = 30
+
+
+@dataclass
+class RunReport:
+    sent: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+    in_flight: list = field(default_factory=list)   # claimed by a runner that has not finished
+    state_committed: bool = False
+
+
+def digest_key(digest, state_version: int) -> str:
+    """
+    Ledger key: same alerts from the same base state -> same key.
+
+    Two overlapping runners read the same state version and build the
+    same digests, so only the first claim wins.
+    """
+    rows = sorted(
+        f"{r.LEVEL}|{r.LOCATION}|{r.ITEM}"
+        for r in digest.rows[["LEVEL", "LOCATION", "ITEM"]].itertuples(index=False)
+    )
+    payload = json.dumps([
+        state_version,
+        digest.recipient_group,
+        digest.channel,
+        digest.tenant_id,
+        list(digest.levels),
+        list(digest.addresses),
+        rows
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def send_with_retry(sender, digest, retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+    """Exponential backoff with full jitter between attempts."""
+    for attempt in range(retries + 1):
+        try:
+            return sender.send(digest)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def run_once(store, sender, df, runner_id: str = None, max_concurrency: int = 4,
+             retries: int = 3, directory=None) -> RunReport:
+    """
+    Evaluate stored subscriptions against `df` (enriched, whole network)
+    and deliver; `directory` limits each subscription to its tenant.
+    """
+    runner_id = runner_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    report = RunReport()
+
+    version, state = store.load_state()
+    engine = AlertEngine(state)
+    digests, current = engine.evaluate(df, store.load_subscriptions(), directory)
+
+    def deliver(digest):
+        key = digest_key(digest, version)
+        if not store.claim(key, runner_id):
+            # SENT is done; CLAIMED is another runner's send, or a crashed
+            # one whose lease has not expired yet
+            return ("in_flight" if store.ledger_status(key) == "CLAIMED" else "skipped"), digest
+        try:
+            send_with_retry(sender, digest, retries=retries)
+        except Exception:
+            log.exception("delivery failed for %s via %s", digest.recipient_group, digest.channel)
+            store.finish(key, "FAILED")
+            return "failed", digest
+        store.finish(key, "SENT")
+        return "sent", digest
+
+    if digests:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            for outcome, digest in pool.map(deliver, digests):
+                getattr(report, outcome).append(digest)
+
+    # Failed and in-flight digests keep the old state, so the next run
+    # rebuilds them under the same ledger keys: sent ones are skipped,
+    # failed ones and expired claims retried
+    if not report.failed and not report.in_flight:
+        report.state_committed = store.commit_state(version, current)
+
+    return report
+
+
+def load_frame(session=None, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, policy=None, engine=None):
+    """
+    Enriched network frame, classified under `policy` (default: the
+    CARESTOCK_STATUS_POLICY file, as in the app). Sources in order:
+    Snowflake, the local engine (local_engine.py), the offline snapshot.
+    """
+    policy = policy or load_policy()
+    if session is not None:
+        raw = session.sql(stock_health_sql(policy)).to_pandas()
+    elif engine is not None:
+        # Fold pending writes in first, like the app's refresh probe
+        engine.refresh()
+        raw = engine.query(stock_health_sql(policy))
+    else:
+        snap = load_snapshot(snapshot_dir)
+        if snap is None:
+            return None
+        raw = snap[0]
+    return enrich_stock_frame(raw, policy)
+
+
+def seconds_until_next_run(interval: int, offset: int, now: float = None) -> float:
+    now = time.time() if now is None else now
+    next_run = (now - offset) // interval * interval + interval + offset
+    return max(0.0, next_run - now)
+
+
+def serve(store, sender, session=None, interval: int = DEFAULT_INTERVAL_SECONDS,
+          offset: int = DEFAULT_OFFSET_SECONDS, once: bool = False, tenants_path: str = None,
+          engine=None, **run_kwargs):
+    runner_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    while True:
+        try:
+            df = load_frame(session, engine=engine)
+            if df is None:
+                log.warning("no data source (no session, local engine or offline snapshot)")
+            else:
+                # Reloaded every run, like the app's 10-minute cache
+                directory = load_directory(session, tenants_path)
+                report = run_once(store, sender, df, runner_id=runner_id, directory=directory, **run_kwargs)
+                log.info(
+                    "run done: sent=%d skipped=%d failed=%d in_flight=%d state_committed=%s",
+                    len(report.sent), len(report.skipped), len(report.failed), len(report.in_flight),
+                    report.state_committed
+                )
+        except Exception:
+            log.exception("alert run failed")
+
+        if once:
+            return
+        time.sleep(seconds_until_next_run(interval, offset))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CareStock Watch scheduled alert runner")
+    parser.add_argument("--once", action="store_true", help="run a single scan and exit")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_SECONDS)
+    parser.add_argument("--offset", type=int, default=DEFAULT_OFFSET_SECONDS)
+    parser.add_argument("--concurrency", type=int, default=4, help="max parallel senders")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--sqlite", default=os.getenv("CARESTOCK_SQLITE", DEFAULT_SQLITE_PATH))
+    parser.add_argument("--outbox", default=os.getenv("CARESTOCK_OUTBOX_DIR", DEFAULT_OUTBOX_DIR))
+    parser.add_argument("--local-db", default=os.getenv("CARESTOCK_LOCAL_DB"),
+                        help="local engine file to scan when running without Snowflake")
+    parser.add_argument("--tenants", default=os.getenv("CARESTOCK_TENANTS_PATH"),
+                        help="tenant directory JSON when running without Snowflake")
+    parser.add_argument("--smtp-host")
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    session = session_from_env()
+    engine = (
+        open_local_engine(args.local_db, policy=load_policy())
+        if session is None and args.local_db else None
+    )
+    store = open_subscription_store(session, args.sqlite)
+    sender = (
+        SmtpSender(args.smtp_host, args.smtp_port) if args.smtp_host
+        else FileSender(args.outbox)
+    )
+
+    serve(
+        store,
+        sender,
+        session=session,
+        interval=args.interval,
+        offset=args.offset,
+        once=args.once,
+        tenants_path=args.tenants,
+        engine=engine,
+        max_concurrency=args.concurrency,
+        retries=args.retries
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+# alerts.py
+"""
+Alert evaluation engine.
+
+Turns Settings preferences (levels, recipient groups, channels) into
+batched, deduplicated notifications:
+
+1. One pass over the enriched snapshot builds a mask per alert level
+   (Critical / Warning / Overstock)
+2. Each level is diffed against the keys alerted last run, so only
+   state transitions into a level notify
+3. Subscriptions are grouped by (tenant, recipient group, levels,
+   channel) and each group gets one digest, whatever the number of
+   subscribers, holding only rows at the tenant's locations
+
+Cost is one vectorized pass over the rows plus O(subscriptions) grouping,
+so 100k rows x 1k subscriptions is a single scan, not 1k scans.
+
+Delivery is pluggable: FileSender writes messages to an outbox
+directory, SmtpSender talks to any SMTP server (including a local debug
+server such as `python -m aiosmtpd -n -l localhost:1025`).
+"""
+
+import os
+import smtplib
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+import pandas as pd
+
+from tenancy import ALL_TENANT, scope_frame
+
+
+ALERT_LEVELS = ["Critical", "Warning", "Overstock"]
+
+DEFAULT_OUTBOX_DIR = os.path.join(tempfile.gettempdir(), "carestock_outbox")
+
+DIGEST_COLUMNS = ["LEVEL", "LOCATION", "ITEM", "CLOSING_STOCK", "DAYS_TO_STOCKOUT"]
+
+
+@dataclass
+class Subscription:
+    subscription_id: str
+    levels: list
+    recipients: list
+    email: str = ""
+    phone: str = ""
+    email_alert: bool = False
+    sms_alert: bool = False
+    tenant_id: str = None   # tenant of the subscriber when it was saved
+
+    def channels(self):
+        """(channel, address) pairs this subscription delivers to."""
+        out = []
+        if self.email_alert and self.email.strip():
+            out.append(("email", self.email.strip()))
+        if self.sms_alert and self.phone.strip():
+            out.append(("sms", self.phone.strip()))
+        return out
+
+
+@dataclass
+class Digest:
+    recipient_group: str
+    channel: str
+    levels: tuple
+    addresses: list
+    rows: pd.DataFrame = field(repr=False)
+    tenant_id: str = None
+
+    @property
+    def subject(self):
+        counts = self.rows["LEVEL"].value_counts()
+        parts = [f"{counts[level]} {level}" for level in self.levels if counts.get(level, 0)]
+        return f"CareStock Watch: {', '.join(parts)}"
+
+    def body(self, max_rows=50):
+        lines = [
+            f"New inventory alerts for {self.recipient_group}",
+            ""
+        ]
+        for level in self.levels:
+            level_rows = self.rows[self.rows["LEVEL"] == level]
+            if level_rows.empty:
+                continue
+            lines.append(f"{level} ({len(level_rows)})")
+            for r in level_rows.head(max_rows).itertuples(index=False):
+                lines.append(
+                    f"  - {r.LOCATION} → {r.ITEM}: stock {int(r.CLOSING_STOCK)}, "
+                    f"{float(r.DAYS_TO_STOCKOUT):.1f} days to stock-out"
+                )
+            if len(level_rows) > max_rows:
+                lines.append(f"  … and {len(level_rows) - max_rows} more")
+            lines.append("")
+        return "\n".join(lines)
+
+
+# =================================================
+# EVALUATION
+# =================================================
+def row_keys(df: pd.DataFrame) -> pd.Index:
+    """Stable LOCATION×ITEM key per row."""
+    return pd.Index(df["LOCATION"].astype(str) + "|" + df["ITEM"].astype(str))
+
+
+def level_masks(df: pd.DataFrame) -> dict:
+    status = df["STOCK_STATUS"]
+    return {
+        "Critical": (status == "Critical").to_numpy(),
+        "Warning": (status == "Warning").to_numpy(),
+        "Overstock": df["OVERSTOCK_RISK"].to_numpy(dtype=bool)
+    }
+
+
+class AlertEngine:
+    """
+    Evaluates subscriptions against snapshots, remembering what was sent.
+
+    state: level -> set of LOCATION|ITEM keys currently in that level.
+    It is only advanced by commit(), so a failed delivery re-alerts.
+    """
+
+    def __init__(self, state=None):
+        self.state = {level: set(keys) for level, keys in (state or {}).items()}
+
+    def new_alert_rows(self, df: pd.DataFrame):
+        """
+        Rows that entered each level since the last commit.
+
+        Returns (rows, current_state). rows carries a LEVEL column.
+        """
+        keys = row_keys(df)
+        current = {}
+        parts = []
+
+        for level, mask in level_masks(df).items():
+            level_keys = keys[mask]
+            current[level] = set(level_keys)
+
+            previous = self.state.get(level, set())
+            fresh = mask.copy()
+            fresh[mask] = ~level_keys.isin(previous)
+            if fresh.any():
+                part = df.loc[fresh, DIGEST_COLUMNS[1:]].copy()
+                part.insert(0, "LEVEL", level)
+                parts.append(part)
+
+        rows = (
+            pd.concat(parts, ignore_index=True) if parts
+            else pd.DataFrame(columns=DIGEST_COLUMNS)
+        )
+        for col in ("LOCATION", "ITEM"):
+            rows[col] = rows[col].astype(str)
+        return rows, current
+
+    def evaluate(self, df: pd.DataFrame, subscriptions, directory=None):
+        """
+        Build digests for the rows that newly entered a level.
+
+        df is the whole network (the state is shared); each subscription
+        only sees rows of its tenant in `directory` (tenancy.py). Without
+        a directory the deployment is single-tenant and sees every row.
+
+        Returns (digests, current_state); pass current_state to commit()
+        once delivery succeeded.
+        """
+        rows, current = self.new_alert_rows(df)
+        if rows.empty:
+            return [], current
+
+        # (tenant, group, levels, channel) -> addresses; one pass over subscriptions
+        groups = defaultdict(set)
+        for sub in subscriptions:
+            levels = tuple(level for level in ALERT_LEVELS if level in sub.levels)
+            if not levels:
+                continue
+            for channel, address in sub.channels():
+                for group in sub.recipients:
+                    groups[(sub.tenant_id or "", group, levels, channel)].add(address)
+
+        by_level = {level: part for level, part in rows.groupby("LEVEL", sort=False)}
+        level_rows = {}
+        digests = []
+        for (tenant_id, group, levels, channel), addresses in sorted(groups.items()):
+            if (tenant_id, levels) not in level_rows:
+                parts = [by_level[level] for level in levels if level in by_level]
+                selected = pd.concat(parts, ignore_index=True) if parts else None
+                if selected is not None:
+                    # Unknown or missing tenant: NO_ACCESS, no rows
+                    tenant = ALL_TENANT if directory is None else directory.tenant(tenant_id)
+                    selected = scope_frame(selected, tenant).reset_index(drop=True)
+                level_rows[(tenant_id, levels)] = selected
+            selected = level_rows[(tenant_id, levels)]
+            if selected is None or selected.empty:
+                continue
+            digests.append(Digest(group, channel, levels, sorted(addresses), selected, tenant_id or None))
+
+        return digests, current
+
+    def commit(self, current_state):
+        self.state = current_state
+
+    def run(self, df, subscriptions, sender, directory=None):
+        """Evaluate, deliver every digest, then advance the state."""
+        digests, current = self.evaluate(df, subscriptions, directory)
+        for digest in digests:
+            sender.send(digest)
+        self.commit(current)
+        return digests
+
+
+# =================================================
+# SENDERS
+# =================================================
+def _email_message(digest, from_addr):
+    msg = EmailMessage()
+    msg["Subject"] = digest.subject
+    msg["From"] = from_addr
+    msg["To"] = ", ".join(digest.addresses)
+    msg.set_content(digest.body())
+    return msg
+
+
+class FileSender:
+    """Local stand-in: writes each digest to the outbox directory."""
+
+    def __init__(self, outbox_dir=DEFAULT_OUTBOX_DIR, from_addr="alerts@carestock.local"):
+        self.outbox_dir = outbox_dir
+        self.from_addr = from_addr
+        os.makedirs(outbox_dir, exist_ok=True)
+
+    def send(self, digest):
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        group = "".join(c if c.isalnum() else "_" for c in digest.recipient_group)
+        if digest.channel == "email":
+            path = os.path.join(self.outbox_dir, f"{stamp}_{group}.eml")
+            payload = bytes(_email_message(digest, self.from_addr))
+        else:
+            path = os.path.join(self.outbox_dir, f"{stamp}_{group}.{digest.channel}.txt")
+            payload = (
+                f"To: {', '.join(digest.addresses)}\n{digest.subject}\n\n{digest.body(max_rows=5)}"
+            ).encode("utf-8")
+        with open(path, "wb") as fh:
+            fh.write(payload)
+        return path
+
+
+class SmtpSender:
+    """Sends email digests over SMTP; other channels are skipped."""
+
+    def __init__(self, host="localhost", port=1025, from_addr="alerts@carestock.local",
+                 username=None, password=None, use_tls=False):
+        self.host = host
+        self.port = port
+        self.from_addr = from_addr
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+
+    def send(self, digest):
+        if digest.channel != "email":
+            return None
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(_email_message(digest, self.from_addr))
+        return digest.addresses
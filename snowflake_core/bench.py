@@ -0,0 +1,268 @@
+# bench.py
+"""
+Benchmark harness for the data paths behind the app.
+
+Run from this directory:
+
+    python bench.py            # all benchmarks
+    python bench.py memory     # one benchmark by name
+
+Each benchmark prints one line per measurement so results can be
+compared across commits.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from incremental_agg import IncrementalAggregates, full_recompute
+from ingestion import FakeSink, MicroBatcher
+from local_engine import LocalEngine, synthetic_daily_stock
+from pipeline import LIFE_SAVING_ITEMS, enrich_stock_frame
+from query import STOCK_HEALTH_SQL
+from simulation import stockout_probability
+from status import StatusPolicy, classify, days_of_stock, reclassify
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def synthetic_stock_health(n: int, n_locations: int = 1000, n_items: int = 500, seed: int = 7) -> pd.DataFrame:
+    """STOCK_HEALTH_DT-shaped frame with realistic string cardinality."""
+    rng = np.random.default_rng(seed)
+    items = LIFE_SAVING_ITEMS + [f"Item {i:04d}" for i in range(n_items - len(LIFE_SAVING_ITEMS))]
+    locations = [f"Facility {i:05d}" for i in range(n_locations)]
+
+    stock = rng.poisson(80, n)
+    demand = np.maximum(0.1, np.round(rng.exponential(2.5, n), 2))
+    days = np.round(stock / np.maximum(demand, 1), 1)
+
+    return pd.DataFrame({
+        "LOCATION": np.asarray(locations, dtype=object)[rng.integers(0, n_locations, n)],
+        "ITEM": np.asarray(items, dtype=object)[rng.integers(0, len(items), n)],
+        "CLOSING_STOCK": stock,
+        "AVG_DAILY_DEMAND": demand,
+        "DAYS_TO_STOCKOUT": days,
+        "STOCK_STATUS": np.asarray(classify(days_of_stock(stock, demand)), dtype=object),
+        "LEAD_TIME_DAYS": rng.integers(1, 31, n)
+    })
+
+
+def _legacy_enrich(df: pd.DataFrame) -> pd.DataFrame:
+    """Object-dtype enrichment as the app did it before the compact schema."""
+    out = df.copy()
+    out["AI_FORECAST"] = [
+        {
+            "forecast_units": round(d * 7, 1),
+            "lower_bound": round(d * 7 * 0.8, 1),
+            "upper_bound": round(d * 7 * 1.2, 1),
+            "explanation": (
+                f"Forecast uses recent average demand ({d:.1f}/day) "
+                f"projected over 7 days. "
+                f"Lead time considered: {l} days. "
+                "Confidence band reflects demand variability."
+            )
+        }
+        for d, l in zip(out["AVG_DAILY_DEMAND"], out["LEAD_TIME_DAYS"])
+    ]
+    out["FORECAST_7D"] = out["AI_FORECAST"].apply(lambda x: x["forecast_units"])
+    out["FORECAST_LOW"] = out["AI_FORECAST"].apply(lambda x: x["lower_bound"])
+    out["FORECAST_HIGH"] = out["AI_FORECAST"].apply(lambda x: x["upper_bound"])
+    out["AI_EXPLANATION"] = out["AI_FORECAST"].apply(lambda x: x["explanation"])
+    out["DAYS_OF_COVER"] = out["CLOSING_STOCK"] / out["LEAD_TIME_DAYS"].replace(0, 1)
+    out["STATUS_BADGE"] = out["STOCK_STATUS"].map({
+        "Critical": "🔴 Critical", "Warning": "🟡 Warning", "Healthy": "🟢 Healthy"
+    })
+    out["ITEM_PRIORITY"] = out["ITEM"].apply(
+        lambda x: "🔴 Life-saving" if x in LIFE_SAVING_ITEMS else "🟢 Essential"
+    )
+    out["OVERSTOCK_RISK"] = out["DAYS_OF_COVER"] > 90
+    out["OVERSTOCK_BADGE"] = out["OVERSTOCK_RISK"].apply(lambda x: "🟣 Overstock risk" if x else "")
+    demand = out["AVG_DAILY_DEMAND"]
+    out["EOQ"] = np.round(np.sqrt(2 * demand * 365 * 500 / 50), 1)
+    out["SAFETY_STOCK"] = np.round(1.65 * demand * 0.3 * np.sqrt(out["LEAD_TIME_DAYS"]), 1)
+    out["REORDER_POINT"] = np.round(demand * out["LEAD_TIME_DAYS"] + out["SAFETY_STOCK"], 1)
+    out["REORDER_RECOMMENDATION"] = np.where(
+        out["CLOSING_STOCK"] <= out["REORDER_POINT"], "🔴 Order now", "🟢 Stock sufficient"
+    ).astype(object)
+    return out
+
+
+def _deep_bytes(df: pd.DataFrame) -> int:
+    total = int(df.memory_usage(deep=True).sum())
+    if "AI_FORECAST" in df.columns:
+        # memory_usage only counts the dict objects, not their contents
+        total += int(sum(sys.getsizeof(v["explanation"]) for v in df["AI_FORECAST"]))
+    return total
+
+
+@benchmark("memory")
+def bench_memory(n: int = 100_000):
+    raw = synthetic_stock_health(n)
+
+    t0 = time.perf_counter()
+    legacy = _legacy_enrich(raw)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    compact = enrich_stock_frame(raw)
+    t_compact = time.perf_counter() - t0
+
+    legacy_mb = _deep_bytes(legacy) / 1e6
+    compact_mb = _deep_bytes(compact) / 1e6
+
+    print(f"memory  rows={n:,}  legacy={legacy_mb:8.1f} MB  ({t_legacy:.2f}s)")
+    print(f"memory  rows={n:,}  compact={compact_mb:7.1f} MB  ({t_compact:.2f}s)")
+    print(f"memory  reduction={legacy_mb / compact_mb:.1f}x")
+
+
+@benchmark("simulation")
+def bench_simulation(n: int = 10_000, n_scenarios: int = 1000, workers: int = 1):
+    raw = synthetic_stock_health(n)
+
+    t0 = time.perf_counter()
+    prob = stockout_probability(
+        raw["CLOSING_STOCK"], raw["AVG_DAILY_DEMAND"], raw["LEAD_TIME_DAYS"],
+        n_scenarios=n_scenarios, seed=0, workers=workers
+    )
+    elapsed = time.perf_counter() - t0
+
+    print(f"simulation  series={n:,}  scenarios={n_scenarios:,}  workers={workers}  {elapsed:.2f}s")
+    print(f"simulation  mean P(stock-out)={prob.mean():.3f}  share>50%={(prob > 0.5).mean():.3f}")
+
+
+@benchmark("ingestion")
+def bench_ingestion(n: int = 1_000_000, producers: int = 4, request_size: int = 500,
+                    max_batch: int = 10_000, target_eps: int = 100_000):
+    """Events/s from concurrent producers through MicroBatcher into FakeSink."""
+    rng = np.random.default_rng(0)
+    locations = [f"LOC_{i:04d}" for i in range(200)]
+    items = [f"ITEM_{i:03d}" for i in range(100)]
+    events = list(zip(
+        ["2025-01-01"] * n,
+        [locations[i] for i in rng.integers(0, len(locations), n)],
+        [items[i] for i in rng.integers(0, len(items), n)],
+        rng.integers(0, 50, n).astype(float).tolist(),
+        rng.integers(0, 50, n).astype(float).tolist()
+    ))
+    requests = [events[i:i + request_size] for i in range(0, n, request_size)]
+
+    sink = FakeSink()
+    batcher = MicroBatcher(sink, max_batch=max_batch, max_delay=0.5).start()
+
+    def produce(part):
+        for req in part:
+            batcher.submit_many(req)
+
+    threads = [threading.Thread(target=produce, args=(requests[i::producers],)) for i in range(producers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.stop()
+    elapsed = time.perf_counter() - t0
+
+    eps = n / elapsed
+    written = sink.totals()["RECEIVED"].sum()
+    print(f"ingestion  events={n:,}  producers={producers}  batches={batcher.stats['batches']}  {elapsed:.2f}s")
+    print(f"ingestion  {eps:,.0f} events/s  target={target_eps:,}  {'ok' if eps >= target_eps else 'BELOW TARGET'}")
+    print(f"ingestion  received sum matches={bool(written == sum(e[3] for e in events))}")
+
+
+@benchmark("local_engine")
+def bench_local_engine(n_locations: int = 500, n_items: int = 100, days: int = 40, backend: str = None):
+    """Load history, refresh STOCK_HEALTH_DT and run the app's loader query offline."""
+    history = synthetic_daily_stock(n_locations, n_items, days, seed=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = LocalEngine(os.path.join(tmp, "bench.db"), backend)
+
+        t0 = time.perf_counter()
+        engine.append_daily_stock(history)
+        t_load = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        series = engine.refresh()
+        t_full = time.perf_counter() - t0
+
+        # One day of movements for 1% of series
+        touched = history.drop_duplicates(["LOCATION", "ITEM"]).sample(frac=0.01, random_state=0)
+        moves = touched.assign(DATE=history["DATE"].max(), RECEIVED=10, ISSUED=5)
+        engine.apply_movements(moves)
+        t0 = time.perf_counter()
+        changed = engine.refresh()
+        t_incr = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        health = engine.query(STOCK_HEALTH_SQL)
+        t_query = time.perf_counter() - t0
+        engine.close()
+
+    print(f"local_engine  backend={engine.backend}  rows={len(history):,}  load={t_load:.2f}s")
+    print(f"local_engine  refresh  all={series:,} series {t_full:.2f}s  changed={changed:,} series {t_incr:.3f}s")
+    print(f"local_engine  STOCK_HEALTH_SQL  rows={len(health):,}  {t_query:.3f}s")
+
+
+@benchmark("incremental")
+def bench_incremental(n_locations: int = 500, n_items: int = 100, days: int = 60, window_days: int = 7):
+    """One new day folded into running state vs recomputing STOCK_HEALTH_DT over all history."""
+    history = synthetic_daily_stock(n_locations, n_items, days, seed=0)
+    last_day = history["DATE"].max()
+    older, newest = history[history["DATE"] < last_day], history[history["DATE"] == last_day]
+
+    store = IncrementalAggregates(window_days=window_days)
+    store.update(older)
+
+    t0 = time.perf_counter()
+    store.update(newest)
+    health = store.health()
+    t_incr = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    full_recompute(history)
+    t_full = time.perf_counter() - t0
+
+    mismatches = store.verify(history)
+    print(f"incremental  history={len(history):,} rows  new day={len(newest):,} rows  series={len(health):,}")
+    print(f"incremental  update+derive={t_incr:.3f}s  full recompute={t_full:.3f}s  ({t_full / t_incr:.1f}x)")
+    print(f"incremental  verify mismatches={len(mismatches)}")
+
+
+@benchmark("status")
+def bench_status(n: int = 1_000_000):
+    """Reclassify every row of an enriched frame, default and per-class thresholds."""
+    df = enrich_stock_frame(synthetic_stock_health(n))
+    policy = StatusPolicy.from_dict({
+        "classes": {"life_saving": {"critical_days": 5, "warning_days": 10, "items": LIFE_SAVING_ITEMS}}
+    })
+    for label, p in (("default", None), ("per-class", policy)):
+        t0 = time.perf_counter()
+        reclassify(df, policy=p)
+        elapsed = time.perf_counter() - t0
+        counts = df["STOCK_STATUS"].value_counts()
+        print(f"status  rows={n:,}  {label:9s}  {elapsed * 1000:.1f} ms  "
+              f"critical={counts['Critical']:,}  warning={counts['Warning']:,}")
+
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise SystemExit(f"unknown benchmark {name!r}; choose from {sorted(BENCHMARKS)}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
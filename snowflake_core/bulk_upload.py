@@ -0,0 +1,312 @@
+# bulk_upload.py
+"""
+Bulk DAILY_STOCK upload from CSV / Excel files.
+
+Facilities without an integration send spreadsheets. A file is read in
+chunks (pandas chunksize for CSV, openpyxl read-only rows for Excel),
+so a 500k-row file never sits in memory whole. Each chunk is validated
+with column-wise checks:
+
+- DATE parses, LOCATION and ITEM are known (and within the tenant scope)
+- stock quantities are numeric, whole and non-negative
+- DATE x LOCATION x ITEM appears once in the file (hashed keys carried
+  across chunks)
+
+Failures become one report row per (file row, check). Valid rows are
+written to Parquet part files as they pass; loading them is one PUT of
+the files to a stage, a single COPY INTO a temporary table and one
+INSERT of the rows DAILY_STOCK does not have yet, never per-row inserts
+(offline, one bulk append per part file into the local engine). Keys
+already in DAILY_STOCK are skipped rather than appended again, so
+re-sending a file, or retrying a failed load, cannot double a day's
+ISSUED in AVG(ISSUED).
+"""
+
+import os
+import shutil
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+    pq = None
+
+try:
+    import openpyxl
+except Exception:
+    openpyxl = None
+
+
+# File types the uploader may offer in this environment
+UPLOAD_TYPES = ["csv"] + (["xlsx"] if openpyxl is not None else [])
+
+DEFAULT_CHUNK_ROWS = 50_000
+MAX_REPORTED_ERRORS = 10_000
+UPLOAD_STAGE = "CARESTOCK_UPLOAD_STAGE"
+
+KEY = ["DATE", "LOCATION", "ITEM"]
+QUANTITY_COLUMNS = ["OPENING_STOCK", "RECEIVED", "ISSUED", "CLOSING_STOCK", "LEAD_TIME_DAYS"]
+UPLOAD_COLUMNS = KEY + QUANTITY_COLUMNS
+REQUIRED_COLUMNS = KEY + ["CLOSING_STOCK"]
+ERROR_COLUMNS = ["ROW", "COLUMN", "VALUE", "ERROR"]
+
+# Fixed part-file schema: every part loads into DAILY_STOCK the same way
+PART_SCHEMA = None if pa is None else pa.schema(
+    [("DATE", pa.date32()), ("LOCATION", pa.string()), ("ITEM", pa.string())]
+    + [(col, pa.int64()) for col in QUANTITY_COLUMNS]
+)
+
+
+@dataclass
+class UploadResult:
+    upload_id: str
+    staging_dir: str
+    rows_read: int = 0
+    rows_valid: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+    part_files: list = field(default_factory=list)
+
+    @property
+    def rows_rejected(self) -> int:
+        return self.rows_read - self.rows_valid
+
+    def error_frame(self) -> pd.DataFrame:
+        if not self.errors:
+            return pd.DataFrame(columns=ERROR_COLUMNS)
+        return pd.concat(self.errors, ignore_index=True).sort_values("ROW", kind="stable", ignore_index=True)
+
+    def cleanup(self):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+
+# =================================================
+# READING
+# =================================================
+def _excel_chunks(source, chunk_rows: int):
+    if openpyxl is None:
+        raise ImportError("openpyxl is required for Excel uploads")
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(h) if h is not None else "" for h in next(rows, [])]
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) == chunk_rows:
+                yield pd.DataFrame(batch, columns=header, dtype="object")
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header, dtype="object")
+    finally:
+        workbook.close()
+
+
+def iter_file_chunks(source, filename: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """DataFrame chunks of raw (string/object) cells from a CSV or Excel file."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        yield from _excel_chunks(source, chunk_rows)
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_rows, dtype=str, keep_default_na=False)
+
+
+def normalize_columns(chunk: pd.DataFrame) -> pd.DataFrame:
+    return chunk.rename(columns=lambda c: str(c).strip().upper().replace(" ", "_"))
+
+
+# =================================================
+# VALIDATION
+# =================================================
+def parse_dates(values: pd.Series) -> pd.Series:
+    """ISO dates in one vectorized pass; only the leftovers get the slow parser."""
+    if not pd.api.types.is_object_dtype(values) and not pd.api.types.is_string_dtype(values):
+        return pd.to_datetime(values, errors="coerce")
+    dates = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    retry = dates.isna() & values.notna() & (values.astype(str).str.strip() != "")
+    if retry.any():
+        dates[retry] = pd.to_datetime(values[retry], errors="coerce", format="mixed", dayfirst=True)
+    return dates
+
+
+def _errors(rows: np.ndarray, mask: np.ndarray, column: str, values, message: str) -> pd.DataFrame:
+    return pd.DataFrame({
+        "ROW": rows[mask],
+        "COLUMN": column,
+        "VALUE": np.asarray(values, dtype=object)[mask],
+        "ERROR": message
+    })
+
+
+def validate_chunk(chunk: pd.DataFrame, known_locations, known_items, seen_keys: np.ndarray,
+                   first_row: int):
+    """
+    (clean, errors, seen_keys) for one normalized chunk.
+
+    first_row: file row number of the chunk's first data row.
+    clean holds typed rows that passed every check.
+    """
+    rows = np.arange(first_row, first_row + len(chunk))
+    problems = []
+    bad = np.zeros(len(chunk), dtype=bool)
+
+    def check(mask, column, values, message):
+        nonlocal bad
+        if mask.any():
+            problems.append(_errors(rows, mask, column, values, message))
+            bad |= mask
+
+    raw = {c: chunk[c] if c in chunk.columns else pd.Series("", index=chunk.index) for c in UPLOAD_COLUMNS}
+    blank = {c: raw[c].isna().to_numpy() | (raw[c].astype(str).str.strip() == "").to_numpy() for c in UPLOAD_COLUMNS}
+
+    dates = parse_dates(raw["DATE"])
+    check(dates.isna().to_numpy(), "DATE", raw["DATE"], "missing or invalid date")
+
+    location = raw["LOCATION"].astype(str).str.strip()
+    item = raw["ITEM"].astype(str).str.strip()
+    check(blank["LOCATION"], "LOCATION", location, "missing location")
+    check(~blank["LOCATION"] & ~location.isin(known_locations).to_numpy(), "LOCATION", location, "unknown location")
+    check(blank["ITEM"], "ITEM", item, "missing item")
+    check(~blank["ITEM"] & ~item.isin(known_items).to_numpy(), "ITEM", item, "unknown item")
+
+    quantities = {}
+    for col in QUANTITY_COLUMNS:
+        values = pd.to_numeric(raw[col], errors="coerce")
+        numeric = values.to_numpy(dtype="float64")
+        required = col in REQUIRED_COLUMNS
+        check(blank[col] & required, col, raw[col], "missing value")
+        check(~blank[col] & np.isnan(numeric), col, raw[col], "not a number")
+        check(numeric < 0, col, raw[col], "negative quantity")
+        check(~np.isnan(numeric) & (numeric != np.round(numeric)), col, raw[col], "not a whole number")
+        quantities[col] = values
+
+    # Duplicate DATE x LOCATION x ITEM, within the chunk and against earlier chunks
+    keys = pd.util.hash_pandas_object(
+        pd.DataFrame({"DATE": dates, "LOCATION": location, "ITEM": item}), index=False
+    ).to_numpy()
+    dup = pd.Series(keys).duplicated().to_numpy() | np.isin(keys, seen_keys)
+    check(dup, "DATE", raw["DATE"].astype(str) + " / " + location + " / " + item, "duplicate row for date, location and item")
+    # Only first occurrences claim a key; later copies are reported above
+    seen_keys = np.union1d(seen_keys, keys[~dup])
+
+    ok = ~bad
+    clean = pd.DataFrame({
+        "DATE": dates[ok].dt.date.to_numpy(),
+        "LOCATION": location[ok].to_numpy(),
+        "ITEM": item[ok].to_numpy(),
+        **{col: quantities[col][ok].astype("Int64").array for col in QUANTITY_COLUMNS}
+    })
+    errors = pd.concat(problems, ignore_index=True) if problems else None
+    return clean, errors, seen_keys
+
+
+def validate_file(source, filename: str, known_locations, known_items,
+                  chunk_rows: int = DEFAULT_CHUNK_ROWS, staging_dir: str = None) -> UploadResult:
+    """
+    Validate a file chunk by chunk and stage valid rows as Parquet parts.
+
+    Raises ValueError when required columns are missing.
+    """
+    if pq is None:
+        raise ImportError("pyarrow is required for bulk uploads")
+
+    upload_id = uuid.uuid4().hex[:12]
+    staging_dir = staging_dir or tempfile.mkdtemp(prefix=f"carestock_upload_{upload_id}_")
+    result = UploadResult(upload_id, staging_dir)
+
+    known_locations = pd.Index(pd.unique(pd.Series(list(known_locations), dtype=object)))
+    known_items = pd.Index(pd.unique(pd.Series(list(known_items), dtype=object)))
+    seen = np.empty(0, dtype=np.uint64)
+    reported = 0
+    # Data rows start on line 2 (line 1 is the header)
+    first_row = 2
+
+    for part, chunk in enumerate(iter_file_chunks(source, filename, chunk_rows)):
+        chunk = normalize_columns(chunk)
+        missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+        if missing:
+            result.cleanup()
+            raise ValueError(f"missing required columns: {', '.join(missing)}")
+
+        clean, errors, seen = validate_chunk(chunk, known_locations, known_items, seen, first_row)
+        result.rows_read += len(chunk)
+        result.rows_valid += len(clean)
+        first_row += len(chunk)
+
+        if errors is not None:
+            result.error_count += len(errors)
+            if reported < MAX_REPORTED_ERRORS:
+                result.errors.append(errors.head(MAX_REPORTED_ERRORS - reported))
+                reported += min(len(errors), MAX_REPORTED_ERRORS - reported)
+
+        if len(clean):
+            path = os.path.join(staging_dir, f"part-{part:05d}.parquet")
+            pq.write_table(pa.Table.from_pandas(clean, schema=PART_SCHEMA, preserve_index=False), path)
+            result.part_files.append(path)
+
+    return result
+
+
+# =================================================
+# LOADING
+# =================================================
+def copy_into_daily_stock(session, result: UploadResult) -> int:
+    """
+    PUT the staged parts, COPY them into a temporary table and insert
+    the rows whose key DAILY_STOCK does not hold yet; returns rows loaded.
+    """
+    if not result.part_files:
+        return 0
+    session.sql(f"CREATE TEMPORARY STAGE IF NOT EXISTS {UPLOAD_STAGE} FILE_FORMAT = (TYPE = PARQUET)").collect()
+
+    target = f"@{UPLOAD_STAGE}/{result.upload_id}"
+    session.file.put(os.path.join(result.staging_dir, "part-*.parquet"), target, auto_compress=False, overwrite=True)
+
+    batch = f"CARESTOCK_UPLOAD_{result.upload_id.upper()}"
+    columns = ", ".join(UPLOAD_COLUMNS)
+    session.sql(
+        f"CREATE TEMPORARY TABLE {batch} (DATE DATE, LOCATION STRING, ITEM STRING, "
+        + ", ".join(f"{c} NUMBER" for c in QUANTITY_COLUMNS) + ")"
+    ).collect()
+    try:
+        session.sql(
+            f"""
+            COPY INTO {batch} ({columns})
+            FROM {target}
+            FILE_FORMAT = (TYPE = PARQUET)
+            MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+            PURGE = TRUE
+            """
+        ).collect()
+        inserted = session.sql(
+            f"""
+            INSERT INTO DAILY_STOCK ({columns})
+            SELECT {', '.join(f'b.{c}' for c in UPLOAD_COLUMNS)}
+            FROM {batch} b
+            WHERE NOT EXISTS (
+                SELECT 1 FROM DAILY_STOCK t
+                WHERE t.DATE = b.DATE AND t.LOCATION = b.LOCATION AND t.ITEM = b.ITEM
+            )
+            """
+        ).collect()
+    finally:
+        session.sql(f"DROP TABLE IF EXISTS {batch}").collect()
+    return int(inserted[0][0])
+
+
+def load_into_engine(engine, result: UploadResult) -> int:
+    """
+    Append the staged parts to a LocalEngine's DAILY_STOCK one part file
+    at a time (memory stays at one chunk), skipping keys it already
+    holds; returns rows loaded.
+    """
+    loaded = 0
+    for path in result.part_files:
+        loaded += engine.append_daily_stock(pq.read_table(path).to_pandas(), skip_existing=True)
+    return loaded
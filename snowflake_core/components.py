@@ -0,0 +1,115 @@
+# components.py
+"""
+Reusable Streamlit components backed by the query layer.
+
+Only the visible page of rows is materialized with display columns and
+sent over the websocket; ranking and paging happen in query.py.
+"""
+
+import math
+
+import numpy as np
+import streamlit as st
+
+from pipeline import status_badge, with_display_columns
+from query import page_of, ranked_positions, search_mask
+
+
+def paginated_table(df, mask, columns, key, page_size=25, sort_by="RISK_SCORE", ascending=False):
+    """
+    Render one page of `df[mask]` ranked by `sort_by`.
+
+    Returns the total number of matching rows.
+    """
+    total = int(mask.sum())
+    pages = max(1, math.ceil(total / page_size))
+
+    nav1, nav2 = st.columns([1, 5])
+    with nav1:
+        page = st.number_input(
+            "Page",
+            min_value=1,
+            max_value=pages,
+            value=1,
+            step=1,
+            key=f"{key}_page"
+        )
+    with nav2:
+        first = (page - 1) * page_size + 1 if total else 0
+        last = min(page * page_size, total)
+        st.markdown(
+            f"""
+            <div style="margin-top:34px; color:#64748B; font-size:13px;">
+            Showing {first}–{last} of {total} · ranked by risk
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+
+    view, _ = page_of(df, page, page_size, mask, sort_by, ascending)
+    st.dataframe(
+        with_display_columns(view)[columns],
+        width='stretch'
+    )
+    return total
+
+
+def searchable_item_picker(df, mask, key, batch_size=50, sort_by="RISK_SCORE", ascending=False,
+                           priority_index=None):
+    """
+    Searchable, incrementally loaded picker over `df[mask]`.
+
+    Shows the `batch_size` most urgent matches; "Load more" extends the
+    list by another batch. When a RiskPriorityIndex is given, order comes
+    from the index instead of ranking the frame. Returns the selected
+    index label (or None).
+    """
+    limit_key = f"{key}_limit"
+    if limit_key not in st.session_state:
+        st.session_state[limit_key] = batch_size
+
+    search = st.text_input(
+        "Search location or item",
+        placeholder="e.g. Insulin or District Hospital",
+        key=f"{key}_search"
+    )
+
+    # A new search starts again from the first batch
+    if st.session_state.get(f"{key}_last_search") != search:
+        st.session_state[f"{key}_last_search"] = search
+        st.session_state[limit_key] = batch_size
+
+    matches = mask & search_mask(df, search)
+    total = int(matches.sum())
+    if total == 0:
+        st.info("No matching items.")
+        return None
+
+    limit = st.session_state[limit_key]
+    if priority_index is not None:
+        allowed = set(df.index[np.asarray(matches, dtype=bool)].tolist())
+        loaded = df.loc[priority_index.top(limit, allowed=allowed)]
+    else:
+        loaded = df.iloc[ranked_positions(df, matches, sort_by, ascending, limit=limit)]
+
+    selected = st.selectbox(
+        "Select item",
+        loaded.index,
+        format_func=lambda i: (
+            f"{loaded.loc[i,'LOCATION']} → "
+            f"{loaded.loc[i,'ITEM']} "
+            f"({status_badge(loaded.loc[i,'STOCK_STATUS'])})"
+        ),
+        key=f"{key}_select"
+    )
+
+    if len(loaded) < total:
+        c1, c2 = st.columns([1, 5])
+        with c1:
+            if st.button("Load more", key=f"{key}_more"):
+                st.session_state[limit_key] += batch_size
+                st.rerun()
+        with c2:
+            st.caption(f"{len(loaded)} of {total} matching items loaded")
+
+    return selected
@@ -0,0 +1,46 @@
+# connection.py
+"""
+Snowflake session helpers shared by the app and background jobs
+(alert runner, ingestion, refresh polling).
+"""
+
+import os
+
+try:
+    from snowflake.snowpark.session import Session
+except Exception:
+    Session = None
+
+
+SNOWFLAKE_ENV = {
+    "account": "SNOWFLAKE_ACCOUNT",
+    "user": "SNOWFLAKE_USER",
+    "password": "SNOWFLAKE_PASSWORD",
+    "role": "SNOWFLAKE_ROLE",
+    "warehouse": "SNOWFLAKE_WAREHOUSE",
+    "database": "SNOWFLAKE_DATABASE",
+    "schema": "SNOWFLAKE_SCHEMA",
+    "private_key": "SNOWFLAKE_PRIVATE_KEY"
+}
+
+
+def snowflake_config_from_env() -> dict:
+    cfg = {}
+    for k, env in SNOWFLAKE_ENV.items():
+        v = os.getenv(env)
+        if v:
+            cfg[k] = v
+    return cfg
+
+
+def session_from_env():
+    """
+    Build a Snowpark session from SNOWFLAKE_* environment variables.
+
+    Returns None when nothing is configured or Snowpark is missing;
+    raises if a configured session cannot be created.
+    """
+    cfg = snowflake_config_from_env()
+    if not cfg or Session is None:
+        return None
+    return Session.builder.configs(cfg).create()
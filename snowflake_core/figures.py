@@ -0,0 +1,152 @@
+# figures.py
+"""
+Figure cache and a downsampled LOCATION x ITEM heatmap.
+
+Plotly figures are rebuilt on every rerun unless cached, and building
+them (px.* validation, serialization) costs more than the data behind
+them. FigureCache keeps built figures keyed by the data version, the
+filter set and the figure's own parameters, so a rerun that changes
+nothing redraws from memory.
+
+A dense heatmap of every location x every item does not survive large
+networks (2k x 3k = 6M cells). heat_grid() keeps the grid under a cell
+budget:
+
+- "top": the riskiest locations and items keep their own row/column;
+  the rest fold into one "Other" row and column
+- "cluster": locations and items are ranked by risk and cut into
+  equal-size bands, each band one row/column
+
+Cells are the mean of the metric over the rows that fall in them (NaN
+where there is no data), aggregated from a sparse pivot
+(sparse_pivot.py); the full grid is never materialized. Each returned
+row label maps back to its locations so the page can drill into a row.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from sparse_pivot import SparsePivot, key_codes
+
+
+DEFAULT_CELL_BUDGET = 10_000
+DEFAULT_MAX_FIGURES = 64
+HEAT_MODES = ["top", "cluster"]
+
+
+class FigureCache:
+    """Thread-safe LRU of built figures, shared by all sessions."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_FIGURES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        """Figure for `key`; `build()` runs only on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        figure = build()
+
+        with self._lock:
+            self._entries[key] = figure
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _grid_shape(n_rows: int, n_cols: int, budget: int):
+    """Rows and columns that keep the grid's aspect ratio within `budget` cells."""
+    if n_rows * n_cols <= budget:
+        return n_rows, n_cols
+    rows = int(np.clip(round(np.sqrt(budget * n_rows / n_cols)), 1, n_rows))
+    cols = int(np.clip(budget // rows, 1, n_cols))
+    return rows, cols
+
+
+def _buckets(labels: np.ndarray, risk: np.ndarray, n_buckets: int, mode: str, noun: str):
+    """
+    Bucket code per label (labels ranked by descending risk) and the
+    bucket labels with their members.
+    """
+    order = np.argsort(-risk, kind="stable")
+    codes = np.empty(len(labels), dtype=np.int64)
+
+    if n_buckets >= len(labels):
+        codes[order] = np.arange(len(labels))
+        names = [str(labels[i]) for i in order]
+        return codes, names, [[labels[i]] for i in order]
+
+    if mode == "top":
+        keep = n_buckets - 1
+        codes[order] = np.minimum(np.arange(len(labels)), keep)
+        names = [str(labels[i]) for i in order[:keep]]
+        names.append(f"Other {noun} ({len(labels) - keep})")
+        members = [[labels[i]] for i in order[:keep]] + [list(labels[order[keep:]])]
+        return codes, names, members
+
+    # cluster: equal-size bands of the risk ranking
+    band = np.arange(len(labels)) * n_buckets // len(labels)
+    codes[order] = band
+    edges = np.flatnonzero(np.r_[True, band[1:] != band[:-1]])
+    sizes = np.diff(np.r_[edges, len(labels)])
+    names = [f"{labels[order[e]]} +{s - 1}" if s > 1 else str(labels[order[e]]) for e, s in zip(edges, sizes)]
+    members = [list(labels[order[e:e + s]]) for e, s in zip(edges, sizes)]
+    return codes, names, members
+
+
+def heat_grid(df: pd.DataFrame, value_col: str, risk_col: str = "RISK_SCORE",
+              cell_budget: int = DEFAULT_CELL_BUDGET, mode: str = "top"):
+    """
+    (grid, row_members): mean `value_col` per LOCATION x ITEM cell, with
+    at most `cell_budget` cells.
+
+    Rows and columns are ordered by total `risk_col`, riskiest first.
+    row_members maps each grid row label to the locations in it.
+    """
+    if mode not in HEAT_MODES:
+        raise ValueError(f"mode must be one of {HEAT_MODES}")
+    if df.empty:
+        return pd.DataFrame(), {}
+
+    loc_codes, loc_labels = key_codes(df["LOCATION"])
+    item_codes, item_labels = key_codes(df["ITEM"])
+    pivot = SparsePivot.from_codes(loc_codes, item_codes, df[value_col].to_numpy(), loc_labels, item_labels)
+
+    risk = df[risk_col].to_numpy(dtype="float64") if risk_col in df.columns else np.ones(len(df))
+    risk = np.nan_to_num(risk)
+    keyed = (loc_codes >= 0) & (item_codes >= 0)
+    loc_risk = np.bincount(loc_codes[keyed], weights=risk[keyed], minlength=len(loc_labels))
+    item_risk = np.bincount(item_codes[keyed], weights=risk[keyed], minlength=len(item_labels))
+
+    n_rows, n_cols = _grid_shape(len(loc_labels), len(item_labels), cell_budget)
+    row_of, row_names, row_members = _buckets(loc_labels, loc_risk, n_rows, mode, "locations")
+    col_of, col_names, _ = _buckets(item_labels, item_risk, n_cols, mode, "items")
+
+    if n_rows == len(loc_labels) and n_cols == len(item_labels):
+        # Fits the budget: densify the window itself, riskiest first
+        means = pivot.window(np.argsort(row_of), np.argsort(col_of)).to_numpy()
+    else:
+        means = pivot.bucketed(row_of, col_of, len(row_names), len(col_names))
+
+    grid = pd.DataFrame(
+        means,
+        index=pd.Index(row_names, name="LOCATION"),
+        columns=pd.Index(col_names, name="ITEM")
+    )
+    return grid, dict(zip(row_names, row_members))
@@ -0,0 +1,210 @@
+# hierarchy.py
+"""
+Location hierarchy (facility -> district -> state) and an aggregate cube.
+
+LOCATION_HIERARCHY maps every LOCATION to a DISTRICT and a STATE;
+locations missing from it roll up under "Unassigned".
+
+The cube keeps, for every node at every level, additive measures only:
+row and status counts, at-risk / overstock / reorder counts, and the sum
+and sum of squares of DAYS_OF_COVER (mean and spread derive from them).
+Because every measure is a sum, a change to leaf rows is applied as a
+delta (new contribution - old contribution) to the affected nodes of
+each level. refresh() recomputes per-row contributions in one
+vectorized pass; when the frame has the same rows as last time (a new
+data version) only the rows whose contribution changed are grouped and
+applied, and only a changed row set (filters, renames) goes through the
+keyed outer join. Pages read small per-level frames.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from query import AT_RISK_STATUSES
+from status import CRITICAL, HEALTHY, STATUS_LEVELS, WARNING
+
+
+LEVELS = ["STATE", "DISTRICT", "LOCATION"]
+LEVEL_LABELS = {"STATE": "State", "DISTRICT": "District", "LOCATION": "Facility"}
+UNASSIGNED = "Unassigned"
+KEY = ["LOCATION", "ITEM"]
+
+MEASURES = [
+    "ROWS",
+    "CRITICAL",
+    "WARNING",
+    "HEALTHY",
+    "AT_RISK",
+    "LIFE_SAVING_AT_RISK",
+    "OVERSTOCK",
+    "REORDER_NOW",
+    "CLOSING_STOCK",
+    "COVER_SUM",
+    "COVER_SQ"
+]
+
+HIERARCHY_SQL = "SELECT LOCATION, DISTRICT, STATE FROM LOCATION_HIERARCHY"
+
+
+def load_hierarchy(session=None, path: str = None):
+    """LOCATION, DISTRICT, STATE from Snowflake or a local CSV; None if absent."""
+    try:
+        if session is not None:
+            return session.sql(HIERARCHY_SQL).to_pandas()
+        if path and os.path.exists(path):
+            return pd.read_csv(path, usecols=["LOCATION", "DISTRICT", "STATE"])
+    except Exception:
+        pass
+    return None
+
+
+def measure_values(df: pd.DataFrame) -> np.ndarray:
+    """Per-row contribution to every cube measure (rows x MEASURES, float64)."""
+    # Category codes: compares small ints instead of strings
+    status = pd.Categorical(df["STOCK_STATUS"], categories=STATUS_LEVELS).codes
+    at_risk = np.isin(status, [STATUS_LEVELS.index(s) for s in AT_RISK_STATUSES])
+    cover = df["DAYS_OF_COVER"].to_numpy(dtype="float64")
+
+    return np.column_stack([
+        np.ones(len(df)),
+        status == CRITICAL,
+        status == WARNING,
+        status == HEALTHY,
+        at_risk,
+        at_risk & df["IS_LIFE_SAVING"].to_numpy(dtype=bool),
+        df["OVERSTOCK_RISK"].to_numpy(dtype=bool),
+        df["REORDER_NOW"].to_numpy(dtype=bool),
+        df["CLOSING_STOCK"].to_numpy(dtype="float64"),
+        cover,
+        cover * cover
+    ]).astype("float64")
+
+
+def _leaf_frame(keys, values: np.ndarray) -> pd.DataFrame:
+    measures = pd.DataFrame(
+        values, columns=MEASURES,
+        index=pd.MultiIndex.from_arrays(list(keys), names=KEY)
+    )
+    if not measures.index.is_unique:
+        measures = measures.groupby(level=KEY).sum()
+    return measures
+
+
+def _same_keys(a, b) -> bool:
+    if len(a) != len(b):
+        return False
+    if isinstance(a.dtype, pd.CategoricalDtype) and isinstance(b.dtype, pd.CategoricalDtype):
+        if a.cat.categories.equals(b.cat.categories):
+            return np.array_equal(a.cat.codes.to_numpy(), b.cat.codes.to_numpy())
+    return np.array_equal(a.astype("object").to_numpy(), b.astype("object").to_numpy())
+
+
+def row_measures(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-row contribution to every cube measure, keyed by LOCATION, ITEM."""
+    return _leaf_frame([df[k] for k in KEY], measure_values(df))
+
+
+class AggregateCube:
+    def __init__(self, hierarchy: pd.DataFrame = None):
+        mapping = pd.DataFrame(columns=["LOCATION", "DISTRICT", "STATE"]) if hierarchy is None else hierarchy
+        mapping = mapping.astype("object").drop_duplicates("LOCATION", keep="last")
+        self._parents = mapping.set_index("LOCATION")[["DISTRICT", "STATE"]]
+        # Keys (LOCATION, ITEM Series) and measure rows of the last refresh
+        self._keys = [pd.Series([], dtype=object), pd.Series([], dtype=object)]
+        self._values = np.zeros((0, len(MEASURES)))
+        self._leaf = None   # keyed form of the above, built on demand
+        self.levels = {
+            level: pd.DataFrame(columns=MEASURES, dtype="float64").rename_axis(level)
+            for level in LEVELS
+        }
+
+    def _nodes(self, locations: pd.Index) -> dict:
+        parents = self._parents.reindex(locations)
+        return {
+            "LOCATION": locations.to_numpy(),
+            "DISTRICT": parents["DISTRICT"].fillna(UNASSIGNED).to_numpy(),
+            "STATE": parents["STATE"].fillna(UNASSIGNED).to_numpy()
+        }
+
+    def apply_delta(self, delta: pd.DataFrame):
+        """Add per-row measure deltas (indexed by LOCATION, ITEM) to every level."""
+        if delta.empty:
+            return
+        nodes = self._nodes(delta.index.get_level_values("LOCATION"))
+        for level in LEVELS:
+            change = delta.groupby(nodes[level]).sum()
+            current = self.levels[level]
+            merged = current.add(change, fill_value=0).astype("float64")
+            merged = merged[merged["ROWS"] > 0.5]
+            self.levels[level] = merged.rename_axis(level)
+
+    def refresh(self, df: pd.DataFrame) -> int:
+        """
+        Bring the cube in line with `df`; returns the number of leaf rows
+        whose contribution changed (added, removed or updated).
+        """
+        new_keys = [df[k] for k in KEY]
+        new_values = measure_values(df)
+
+        if all(_same_keys(old, new) for old, new in zip(self._keys, new_keys)):
+            # Same rows in the same order: diff positionally, key only the changes
+            changed = (new_values != self._values).any(axis=1)
+            if changed.any():
+                rows = np.flatnonzero(changed)
+                self.apply_delta(_leaf_frame(
+                    [k.iloc[rows].to_numpy() for k in new_keys],
+                    new_values[changed] - self._values[changed]
+                ))
+            count = int(changed.sum())
+            new_leaf = None
+        else:
+            new_leaf = _leaf_frame(new_keys, new_values)
+            old_leaf = self._leaf if self._leaf is not None else _leaf_frame(self._keys, self._values)
+            keys = old_leaf.index.union(new_leaf.index)
+            diff = new_leaf.reindex(keys, fill_value=0.0) - old_leaf.reindex(keys, fill_value=0.0)
+            changed = diff.to_numpy().any(axis=1)
+            self.apply_delta(diff[changed])
+            count = int(changed.sum())
+
+        self._keys, self._values, self._leaf = new_keys, new_values, new_leaf
+        return count
+
+    def view(self, level: str, state: str = None, district: str = None) -> pd.DataFrame:
+        """
+        Nodes of one level with derived ratios, optionally inside a parent.
+
+        Filters read the hierarchy mapping, not raw rows.
+        """
+        frame = self.levels[level]
+        if level != "STATE" and (state or district):
+            if level == "DISTRICT":
+                parents = self._district_states().reindex(frame.index).fillna(UNASSIGNED)
+                frame = frame[parents.to_numpy() == state] if state else frame
+            else:
+                nodes = self._nodes(frame.index)
+                mask = np.ones(len(frame), dtype=bool)
+                if state:
+                    mask &= nodes["STATE"] == state
+                if district:
+                    mask &= nodes["DISTRICT"] == district
+                frame = frame[mask]
+
+        out = frame.copy()
+        rows = out["ROWS"].clip(lower=1)
+        out["AT_RISK_SHARE"] = out["AT_RISK"] / rows
+        out["MEAN_COVER"] = out["COVER_SUM"] / rows
+        out["STD_COVER"] = np.sqrt((out["COVER_SQ"] / rows - out["MEAN_COVER"] ** 2).clip(lower=0))
+        return out.reset_index()
+
+    def _district_states(self) -> pd.Series:
+        pairs = self._parents.dropna(subset=["DISTRICT"]).drop_duplicates("DISTRICT")
+        return pairs.set_index("DISTRICT")["STATE"]
+
+    def children(self, level: str, state: str = None) -> list:
+        """Node names for parent pickers."""
+        return sorted(self.view(level, state=state)[level].astype(str))
+
+    def totals(self) -> pd.Series:
+        return self.levels["STATE"][MEASURES].sum()
@@ -0,0 +1,250 @@
+# history.py
+"""
+Snapshot history with delta-encoded daily storage ("time travel").
+
+Layout of the history directory:
+
+    index.json                    recorded dates and their file kind
+    2025-01-01.full.arrow         keyframe: every row (first day, then
+                                  every `keyframe_every` days)
+    2025-01-02.delta.arrow        only rows that changed vs the day before
+
+A delta row carries an OP code and both images of the row:
+- A (added):   after values
+- D (removed): before values
+- U (changed): before and after values
+
+With both images a reconstruction cursor can step forward *or* backward
+one day at a time, so scrubbing the date slider costs the number of
+changed rows between two dates, not the size of the network. A cold
+start loads the nearest keyframe and rolls forward from there.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from datetime import date
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_ARROW = True
+except Exception:
+    _HAS_ARROW = False
+
+from pipeline import BASE_DTYPES, compact_stock_frame
+
+
+DEFAULT_HISTORY_DIR = os.path.join(tempfile.gettempdir(), "carestock_history")
+
+KEY = ["LOCATION", "ITEM"]
+VALUE_COLUMNS = [c for c in BASE_DTYPES if c not in KEY]
+BEFORE = "BEFORE_"
+
+
+def _read(path):
+    return pd.read_feather(path) if _HAS_ARROW else pd.read_pickle(path)
+
+
+def _write(frame, path):
+    tmp = f"{path}.tmp"
+    frame = frame.reset_index(drop=True)
+    if _HAS_ARROW:
+        frame.to_feather(tmp)
+    else:
+        frame.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def _keyed(frame: pd.DataFrame) -> pd.DataFrame:
+    """Base columns indexed by (LOCATION, ITEM), one row per key."""
+    out = frame[[c for c in KEY + VALUE_COLUMNS if c in frame.columns]].copy()
+    for col in KEY + ["STOCK_STATUS"]:
+        out[col] = out[col].astype("object")
+    return out.drop_duplicates(KEY, keep="last").set_index(KEY).sort_index()
+
+
+def encode_delta(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """Delta rows between two keyed frames (see module docstring)."""
+    joined = previous.join(current, how="outer", lsuffix="_OLD", rsuffix="_NEW")
+
+    in_prev = joined.index.isin(previous.index)
+    in_curr = joined.index.isin(current.index)
+
+    changed = pd.Series(False, index=joined.index)
+    for col in VALUE_COLUMNS:
+        old = joined[f"{col}_OLD"]
+        new = joined[f"{col}_NEW"]
+        changed |= ~((old == new) | (old.isna() & new.isna()))
+
+    op = pd.Series("", index=joined.index, dtype=object)
+    op[in_prev & in_curr & changed.to_numpy()] = "U"
+    op[~in_prev & in_curr] = "A"
+    op[in_prev & ~in_curr] = "D"
+    keep = (op != "").to_numpy()
+
+    delta = pd.DataFrame(index=joined.index[keep])
+    delta["OP"] = op[keep]
+    for col in VALUE_COLUMNS:
+        delta[col] = joined.loc[keep, f"{col}_NEW"].astype("object")
+        delta[f"{BEFORE}{col}"] = joined.loc[keep, f"{col}_OLD"].astype("object")
+    return delta.reset_index()
+
+
+def _apply(frame: pd.DataFrame, delta: pd.DataFrame, forward: bool) -> pd.DataFrame:
+    """Apply one delta to a keyed frame, forward or backward in time."""
+    if delta.empty:
+        return frame
+
+    drop_op, values_prefix = ("D", "") if forward else ("A", BEFORE)
+    keyed = delta.set_index(KEY)
+
+    drop = keyed.index[keyed["OP"] == drop_op]
+    upsert = keyed[(keyed["OP"] != drop_op)]
+    values = upsert[[f"{values_prefix}{c}" for c in VALUE_COLUMNS]].copy()
+    values.columns = VALUE_COLUMNS
+    for col in VALUE_COLUMNS:
+        values[col] = values[col].astype(frame[col].dtype)
+
+    if len(drop):
+        frame = frame.drop(drop, errors="ignore")
+
+    existing = values.index.isin(frame.index)
+    if existing.any():
+        # In-place update touches only the changed rows
+        rows = frame.index.get_indexer(values.index[existing])
+        for col in VALUE_COLUMNS:
+            frame.iloc[rows, frame.columns.get_loc(col)] = values[col].to_numpy()[existing]
+    if (~existing).any():
+        frame = pd.concat([frame, values[~existing]]).sort_index()
+    return frame
+
+
+class HistoryStore:
+    def __init__(self, root: str = DEFAULT_HISTORY_DIR, keyframe_every: int = 30):
+        self.root = root
+        self.keyframe_every = keyframe_every
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._cursor_date = None
+        self._cursor = None
+
+    # -------------------------------------------------
+    # Index
+    # -------------------------------------------------
+    def _index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except Exception:
+            return {}
+
+    def _save_index(self, index: dict):
+        tmp = f"{self._index_path()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(index, fh, sort_keys=True)
+        os.replace(tmp, self._index_path())
+
+    def _path(self, day: str, kind: str):
+        return os.path.join(self.root, f"{day}.{kind}.arrow")
+
+    def dates(self):
+        return sorted(self._load_index())
+
+    # -------------------------------------------------
+    # Recording
+    # -------------------------------------------------
+    def record(self, frame: pd.DataFrame, day=None) -> bool:
+        """
+        Store `frame` as the snapshot for `day` (default today).
+
+        Returns False when the day is already recorded. Days must be
+        recorded in increasing order.
+        """
+        day = str(day or date.today())
+        with self._lock:
+            index = self._load_index()
+            if day in index:
+                return False
+
+            current = _keyed(compact_stock_frame(frame))
+            days = sorted(index)
+            if days and day < days[-1]:
+                raise ValueError(f"history is append-only; {day} is before {days[-1]}")
+
+            since_keyframe = 0
+            for d in reversed(days):
+                if index[d] == "full":
+                    break
+                since_keyframe += 1
+
+            if not days or since_keyframe + 1 >= self.keyframe_every:
+                _write(current.reset_index(), self._path(day, "full"))
+                index[day] = "full"
+            else:
+                previous = self._reconstruct_keyed(days[-1], index)
+                _write(encode_delta(previous, current), self._path(day, "delta"))
+                index[day] = "delta"
+
+            self._save_index(index)
+            self._cursor_date, self._cursor = day, current
+            return True
+
+    # -------------------------------------------------
+    # Reconstruction
+    # -------------------------------------------------
+    def _reconstruct_keyed(self, day: str, index: dict) -> pd.DataFrame:
+        days = sorted(index)
+        target = days.index(day)
+
+        start = None
+        if self._cursor_date in index:
+            start = days.index(self._cursor_date)
+        # Nearest keyframe at or before the target
+        key_pos = max((i for i in range(target + 1) if index[days[i]] == "full"), default=None)
+
+        # Prefer the cursor when it is closer (in days) than the keyframe
+        if start is None or (key_pos is not None and abs(target - start) > target - key_pos):
+            frame = _keyed(_read(self._path(days[key_pos], "full")))
+            start = key_pos
+        else:
+            frame = self._cursor
+
+        if target > start:
+            for i in range(start + 1, target + 1):
+                if index[days[i]] == "full":
+                    frame = _keyed(_read(self._path(days[i], "full")))
+                else:
+                    frame = _apply(frame, _read(self._path(days[i], "delta")), forward=True)
+        elif target < start:
+            for i in range(start, target, -1):
+                if index[days[i]] == "delta":
+                    frame = _apply(frame, _read(self._path(days[i], "delta")), forward=False)
+                else:
+                    # Keyframes carry no before-images; restart from the
+                    # keyframe at or before the target
+                    key_pos = max(j for j in range(target + 1) if index[days[j]] == "full")
+                    self._cursor_date, self._cursor = None, None
+                    frame = _keyed(_read(self._path(days[key_pos], "full")))
+                    for j in range(key_pos + 1, target + 1):
+                        frame = _apply(frame, _read(self._path(days[j], "delta")), forward=True)
+                    break
+
+        self._cursor_date, self._cursor = day, frame
+        return frame
+
+    def reconstruct(self, day) -> pd.DataFrame:
+        """STOCK_HEALTH_DT-shaped frame as it was on `day`."""
+        day = str(day)
+        with self._lock:
+            index = self._load_index()
+            if day not in index:
+                raise KeyError(f"no snapshot recorded for {day}")
+            frame = self._reconstruct_keyed(day, index)
+            # The cursor is mutated in place by later steps: hand out a copy
+            return compact_stock_frame(frame.reset_index())
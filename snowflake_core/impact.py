@@ -0,0 +1,352 @@
+# impact.py
+"""
+Impact metrics from real history: ACTION_LOG joined to status transitions.
+
+An at-risk *episode* starts when a LOCATION x ITEM enters Critical or
+Warning and ends when it is back to Healthy. Episodes are classified on
+close:
+
+- stock-out prevented: the episode resolved after at least one logged
+  action
+- emergency order avoided: resolved through logged actions before
+  reaching Critical, none of them an "Emergency delivery"
+- self-resolved: resolved with no logged action
+
+Expired units are lot quantities whose expiry date passed while still
+on hand (lots.py).
+
+The aggregate is incremental. IMPACT_STATE holds one JSON document with
+watermarks (last transition / action timestamp and expiry date seen),
+the open episodes and running totals, network-wide and per LOCATION. A
+refresh reads only events after the watermarks and commits with
+compare-and-set, so the Impact page cost does not grow with history.
+The aggregate is shared by every tenant; summary() sums the locations a
+page may show.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import date, datetime, timezone
+
+import pandas as pd
+
+from query import AT_RISK_STATUSES
+from subscriptions import DEFAULT_SQLITE_PATH
+
+
+EMERGENCY_ACTION = "Emergency delivery"
+
+ACTION_COLUMNS = ["ACTION_TIMESTAMP", "LOCATION", "ITEM", "ACTION_TYPE", "NOTES", "USER_NAME"]
+
+TOTALS = [
+    "episodes_opened",
+    "episodes_resolved",
+    "stockouts_prevented",
+    "emergency_orders_avoided",
+    "emergency_deliveries",
+    "self_resolved",
+    "actions_logged",
+    "resolution_days",
+    "expired_units"
+]
+
+
+def _now():
+    # Naive UTC, the clock of TRANSITION_TS; microseconds keep action
+    # timestamps distinct for the watermark
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(sep=" ", timespec="microseconds")
+
+
+def _ts(value) -> str:
+    # Fixed width, like the stored strings: isoformat would drop a zero
+    # fraction and make the watermark sort before its own event
+    return pd.Timestamp(value).isoformat(sep=" ", timespec="microseconds")
+
+
+def empty_state() -> dict:
+    return {
+        "transitions_watermark": None,
+        "actions_watermark": None,
+        "expiry_watermark": None,
+        "open_episodes": {},
+        "totals": {name: 0 for name in TOTALS},
+        "by_location": {}
+    }
+
+
+def _add(state: dict, location, name: str, amount=1):
+    """Add to a network total and to the same total of `location`."""
+    state["totals"][name] += amount
+    per = state["by_location"].setdefault(str(location), {})
+    per[name] = per.get(name, 0) + amount
+
+
+# =================================================
+# AGGREGATION
+# =================================================
+def advance(state: dict, transitions, actions: pd.DataFrame) -> dict:
+    """
+    Fold new transitions and actions into `state` (in place) in time order.
+
+    transitions: iterable of transitions.Transition
+    actions: ACTION_LOG rows after the actions watermark
+    """
+    episodes = state["open_episodes"]
+
+    events = [
+        (_ts(t.TRANSITION_TS), 1, "T", t.LOCATION, t.ITEM, t.OLD_STATUS, t.NEW_STATUS)
+        for t in transitions
+    ]
+    # Actions sort before a transition with the same timestamp: they are its cause
+    events += [
+        (_ts(a.ACTION_TIMESTAMP), 0, "A", a.LOCATION, a.ITEM, a.ACTION_TYPE, None)
+        for a in actions.itertuples(index=False)
+    ]
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    for ts, _, kind, location, item, first, second in events:
+        key = f"{location}|{item}"
+        episode = episodes.get(key)
+
+        if kind == "A":
+            _add(state, location, "actions_logged")
+            state["actions_watermark"] = ts
+            if first == EMERGENCY_ACTION:
+                _add(state, location, "emergency_deliveries")
+            if episode is not None:
+                episode["actions"] += 1
+                episode["emergency"] = episode["emergency"] or first == EMERGENCY_ACTION
+            continue
+
+        state["transitions_watermark"] = ts
+        new_status = second
+        if new_status in AT_RISK_STATUSES:
+            if episode is None:
+                _add(state, location, "episodes_opened")
+                episodes[key] = {
+                    "location": str(location),
+                    "start": ts,
+                    "critical": new_status == "Critical",
+                    "actions": 0,
+                    "emergency": False
+                }
+            elif new_status == "Critical":
+                episode["critical"] = True
+        elif episode is not None:
+            del episodes[key]
+            if new_status is None:
+                # Series removed from the table: not a resolution
+                continue
+            _add(state, location, "episodes_resolved")
+            _add(state, location, "resolution_days",
+                 (pd.Timestamp(ts) - pd.Timestamp(episode["start"])).total_seconds() / 86400)
+            if episode["actions"]:
+                _add(state, location, "stockouts_prevented")
+            else:
+                _add(state, location, "self_resolved")
+            if episode["actions"] and not episode["critical"] and not episode["emergency"]:
+                _add(state, location, "emergency_orders_avoided")
+
+    return state
+
+
+def record_expired(state: dict, lots: pd.DataFrame, as_of=None) -> dict:
+    """Add units of lots that expired since the expiry watermark."""
+    as_of = pd.Timestamp(as_of or date.today()).normalize()
+    since = state.get("expiry_watermark")
+    if lots is not None and len(lots):
+        expiry = pd.to_datetime(lots["EXPIRY_DATE"])
+        mask = expiry <= as_of
+        if since is not None:
+            mask &= expiry > pd.Timestamp(since)
+        expired = lots.loc[mask].groupby("LOCATION", observed=True)["QUANTITY"].sum()
+        for location, units in expired.items():
+            if units:
+                _add(state, location, "expired_units", int(units))
+    state["expiry_watermark"] = str(as_of.date())
+    return state
+
+
+def summary(state: dict, locations=None) -> dict:
+    """
+    Page-ready numbers; O(1) in the amount of history. With `locations`,
+    only the totals of those locations (a tenant's, or a filtered view).
+    """
+    if locations is None:
+        totals = dict(state["totals"])
+        open_episodes = len(state["open_episodes"])
+    else:
+        locations = {str(loc) for loc in locations}
+        totals = {name: 0 for name in TOTALS}
+        for location in locations & state["by_location"].keys():
+            for name, value in state["by_location"][location].items():
+                totals[name] += value
+        open_episodes = sum(e["location"] in locations for e in state["open_episodes"].values())
+    resolved = totals["episodes_resolved"]
+    totals["open_episodes"] = open_episodes
+    totals["mean_resolution_days"] = totals["resolution_days"] / resolved if resolved else None
+    return totals
+
+
+def refresh_impact(store, transition_store=None, lots=None, as_of=None, attempts: int = 3) -> dict:
+    """Advance the stored aggregate by everything after its watermarks."""
+    for _ in range(attempts):
+        version, state = store.load()
+        if "by_location" not in state:
+            # Aggregate from before the per-location totals: rebuild it once
+            state = empty_state()
+        transitions = (
+            transition_store.read(since=state["transitions_watermark"])
+            if transition_store is not None else []
+        )
+        advance(state, transitions, store.read_actions(since=state["actions_watermark"]))
+        record_expired(state, lots, as_of)
+        if store.commit(version, state):
+            return state
+    # Another process kept winning; its state is at least as fresh
+    return store.load()[1]
+
+
+# =================================================
+# SQLITE (LOCAL)
+# =================================================
+SQLITE_DDL = """
+CREATE TABLE IF NOT EXISTS ACTION_LOG (
+    ACTION_TIMESTAMP TEXT,
+    LOCATION TEXT,
+    ITEM TEXT,
+    ACTION_TYPE TEXT,
+    NOTES TEXT,
+    USER_NAME TEXT
+);
+CREATE INDEX IF NOT EXISTS ACTION_LOG_TS ON ACTION_LOG (ACTION_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS IMPACT_STATE (
+    STATE_KEY TEXT PRIMARY KEY,
+    STATE_VERSION INTEGER,
+    STATE_JSON TEXT
+);
+"""
+
+
+class SqliteImpactStore:
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.executescript(SQLITE_DDL)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO IMPACT_STATE VALUES ('impact', 0, ?)",
+            [json.dumps(empty_state())]
+        )
+
+    def log_action(self, location, item, action_type, notes="", user_name="", ts=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ACTION_LOG VALUES (?, ?, ?, ?, ?, ?)",
+                [ts or _now(), str(location), str(item), action_type, notes, user_name]
+            )
+
+    def read_actions(self, since=None) -> pd.DataFrame:
+        query = f"SELECT {', '.join(ACTION_COLUMNS)} FROM ACTION_LOG"
+        params = []
+        if since is not None:
+            query += " WHERE ACTION_TIMESTAMP > ?"
+            params.append(str(since))
+        with self._lock:
+            return pd.read_sql_query(query + " ORDER BY ACTION_TIMESTAMP", self._conn, params=params)
+
+    def load(self):
+        """Return (state_version, state)."""
+        with self._lock:
+            version, payload = self._conn.execute(
+                "SELECT STATE_VERSION, STATE_JSON FROM IMPACT_STATE WHERE STATE_KEY = 'impact'"
+            ).fetchone()
+        return int(version), json.loads(payload)
+
+    def commit(self, expected_version: int, state: dict) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE IMPACT_STATE SET STATE_VERSION = ?, STATE_JSON = ? "
+                "WHERE STATE_KEY = 'impact' AND STATE_VERSION = ?",
+                [expected_version + 1, json.dumps(state), expected_version]
+            )
+            return cur.rowcount == 1
+
+
+# =================================================
+# SNOWFLAKE
+# =================================================
+SNOWFLAKE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS ACTION_LOG (
+        ACTION_TIMESTAMP TIMESTAMP_NTZ,
+        LOCATION STRING,
+        ITEM STRING,
+        ACTION_TYPE STRING,
+        NOTES STRING,
+        USER_NAME STRING
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS IMPACT_STATE (STATE_KEY STRING, STATE_VERSION NUMBER, STATE_JSON STRING)"
+]
+
+
+class SnowflakeImpactStore:
+    """Same interface as SqliteImpactStore."""
+
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        for ddl in SNOWFLAKE_DDL:
+            session.sql(ddl).collect()
+        self._sql(
+            """
+            MERGE INTO IMPACT_STATE t
+            USING (SELECT 'impact' AS STATE_KEY) s ON t.STATE_KEY = s.STATE_KEY
+            WHEN NOT MATCHED THEN INSERT (STATE_KEY, STATE_VERSION, STATE_JSON) VALUES ('impact', 0, ?)
+            """,
+            [json.dumps(empty_state())]
+        )
+
+    def _sql(self, query, params=None):
+        return self.session.sql(query, params=params).collect()
+
+    def log_action(self, location, item, action_type, notes="", user_name="", ts=None):
+        # Stamped by the warehouse in UTC (SYSDATE), like TRANSITION_TS:
+        # CURRENT_TIMESTAMP would follow the session time zone
+        with self._lock:
+            self._sql(
+                "INSERT INTO ACTION_LOG SELECT COALESCE(TRY_TO_TIMESTAMP_NTZ(?), SYSDATE()), ?, ?, ?, ?, ?",
+                [ts, str(location), str(item), action_type, notes, user_name]
+            )
+
+    def read_actions(self, since=None) -> pd.DataFrame:
+        query = f"SELECT {', '.join(ACTION_COLUMNS)} FROM ACTION_LOG"
+        params = None
+        if since is not None:
+            query += " WHERE ACTION_TIMESTAMP > ?"
+            params = [str(since)]
+        frame = self.session.sql(query + " ORDER BY ACTION_TIMESTAMP", params=params).to_pandas()
+        return frame.reindex(columns=ACTION_COLUMNS)
+
+    def load(self):
+        with self._lock:
+            version, payload = self._sql(
+                "SELECT STATE_VERSION, STATE_JSON FROM IMPACT_STATE WHERE STATE_KEY = 'impact'"
+            )[0]
+        return int(version), json.loads(payload)
+
+    def commit(self, expected_version: int, state: dict) -> bool:
+        with self._lock:
+            updated = self._sql(
+                "UPDATE IMPACT_STATE SET STATE_VERSION = ?, STATE_JSON = ? "
+                "WHERE STATE_KEY = 'impact' AND STATE_VERSION = ?",
+                [expected_version + 1, json.dumps(state), expected_version]
+            )[0][0]
+        return int(updated) == 1
+
+
+def open_impact_store(session=None, sqlite_path: str = DEFAULT_SQLITE_PATH):
+    if session is not None:
+        return SnowflakeImpactStore(session)
+    return SqliteImpactStore(sqlite_path)
@@ -0,0 +1,260 @@
+# incremental_agg.py
+"""
+Incrementally maintained STOCK_HEALTH_DT aggregates.
+
+STOCK_HEALTH_DT is AVG(ISSUED), MAX(CLOSING_STOCK) and MAX(LEAD_TIME_DAYS)
+per LOCATION x ITEM over all of DAILY_STOCK, plus a status CASE on top.
+Every one of those is decomposable: a running SUM and COUNT of ISSUED
+and running MAXes per key are enough, and new rows only touch their own
+keys. partials() reduces new rows to that state, merge_partials()
+combines it, health_from_state() derives the dynamic table's columns.
+Cost per update is O(new rows), never a rescan of the history.
+
+IncrementalAggregates keeps that state in NumPy arrays (offline mode,
+tests, benchmarks) and can also keep the last `window_days` days per key
+in ring buffers for rolling averages. LocalEngine keeps the same state in
+a table (STOCK_HEALTH_STATE) so every process sharing a database sees it.
+
+verify() compares the maintained values against a full recompute.
+"""
+
+import numpy as np
+import pandas as pd
+
+from status import classify
+
+
+KEY = ["LOCATION", "ITEM"]
+STATE_COLUMNS = ["SUM_ISSUED", "N_DAYS", "MAX_CLOSING", "MAX_LEAD"]
+HEALTH_COLUMNS = [
+    "LOCATION", "ITEM", "AVG_DAILY_DEMAND", "CLOSING_STOCK", "LEAD_TIME_DAYS", "STOCK_STATUS", "DAYS_TO_STOCKOUT"
+]
+NUMERIC_HEALTH_COLUMNS = ["AVG_DAILY_DEMAND", "CLOSING_STOCK", "LEAD_TIME_DAYS", "DAYS_TO_STOCKOUT"]
+
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+# =================================================
+# STATE ALGEBRA
+# =================================================
+def partials(rows: pd.DataFrame) -> pd.DataFrame:
+    """Per-key state of `rows` (DAILY_STOCK columns)."""
+    grouped = rows.groupby(KEY, sort=False, observed=True)
+    out = grouped.agg(
+        SUM_ISSUED=("ISSUED", "sum"),
+        N_DAYS=("ISSUED", "count"),
+        MAX_CLOSING=("CLOSING_STOCK", "max"),
+        MAX_LEAD=("LEAD_TIME_DAYS", "max")
+    )
+    return out.reset_index()
+
+
+def merge_partials(state: pd.DataFrame, update: pd.DataFrame) -> pd.DataFrame:
+    """Combine two per-key states (sums add, maxes take the larger)."""
+    both = pd.concat([state, update], ignore_index=True)
+    return both.groupby(KEY, sort=False, observed=True).agg(
+        SUM_ISSUED=("SUM_ISSUED", "sum"),
+        N_DAYS=("N_DAYS", "sum"),
+        MAX_CLOSING=("MAX_CLOSING", "max"),
+        MAX_LEAD=("MAX_LEAD", "max")
+    ).reset_index()
+
+
+def health_from_state(state: pd.DataFrame, policy=None) -> pd.DataFrame:
+    """STOCK_HEALTH_DT columns, with the dynamic table's exact expressions."""
+    n = state["N_DAYS"].to_numpy(dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg = np.where(n > 0, state["SUM_ISSUED"].to_numpy(dtype="float64") / n, np.nan)
+        closing = state["MAX_CLOSING"].to_numpy(dtype="float64")
+        # CLOSING / NULLIF(AVG, 0) for the status, CLOSING / NULLIF(AVG, 1) for days
+        cover = closing / np.where(avg == 0, np.nan, avg)
+        days = closing / np.where(avg == 1, np.nan, avg)
+    status = np.asarray(classify(cover, state["ITEM"], policy), dtype=object)
+    return pd.DataFrame({
+        "LOCATION": state["LOCATION"].to_numpy(),
+        "ITEM": state["ITEM"].to_numpy(),
+        "AVG_DAILY_DEMAND": avg,
+        "CLOSING_STOCK": closing,
+        "LEAD_TIME_DAYS": state["MAX_LEAD"].to_numpy(dtype="float64"),
+        "STOCK_STATUS": status,
+        "DAYS_TO_STOCKOUT": days
+    })
+
+
+def full_recompute(history: pd.DataFrame, policy=None) -> pd.DataFrame:
+    """Reference result: STOCK_HEALTH_DT over the whole history."""
+    return health_from_state(partials(history), policy)
+
+
+def compare_health(actual: pd.DataFrame, expected: pd.DataFrame, rtol: float = 1e-9) -> pd.DataFrame:
+    """
+    Keys whose values differ between two STOCK_HEALTH_DT frames (or that
+    only one side has). Empty means they agree.
+    """
+    merged = actual.merge(expected, on=KEY, how="outer", suffixes=("", "_EXPECTED"), indicator=True)
+    bad = (merged["_merge"] != "both").to_numpy()
+    for col in NUMERIC_HEALTH_COLUMNS:
+        a = pd.to_numeric(merged[col], errors="coerce").to_numpy(dtype="float64")
+        e = pd.to_numeric(merged[f"{col}_EXPECTED"], errors="coerce").to_numpy(dtype="float64")
+        bad = bad | ~np.isclose(a, e, rtol=rtol, atol=0, equal_nan=True)
+    bad = bad | (merged["STOCK_STATUS"].astype(str) != merged["STOCK_STATUS_EXPECTED"].astype(str)).to_numpy()
+    return merged[bad].drop(columns="_merge").reset_index(drop=True)
+
+
+def _day_numbers(dates) -> np.ndarray:
+    return (pd.to_datetime(dates).to_numpy().astype("datetime64[D]") - EPOCH).astype("int64")
+
+
+# =================================================
+# IN-MEMORY STORE
+# =================================================
+class IncrementalAggregates:
+    """
+    Per-key running state for appended DAILY_STOCK rows.
+
+    window_days: also keep each key's last N days (ISSUED, CLOSING_STOCK)
+    for rolling averages; a day written twice keeps the later value.
+    Totals assume each DATE x LOCATION x ITEM row arrives once.
+    policy: status thresholds (status.StatusPolicy) for STOCK_STATUS.
+    """
+
+    def __init__(self, window_days: int = None, capacity: int = 1024, policy=None):
+        self.window_days = window_days
+        self.policy = policy
+        self._slots = {}
+        self._keys = []
+        self._size = 0
+        self.latest_day = None
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int):
+        def grow(old, fill, shape_tail=()):
+            new = np.full((capacity,) + shape_tail, fill, dtype=old.dtype if old is not None else "float64")
+            if old is not None:
+                new[:len(old)] = old
+            return new
+
+        get = lambda name: getattr(self, name, None)
+        self._sum = grow(get("_sum"), 0.0)
+        self._count = grow(get("_count"), 0.0)
+        self._max_closing = grow(get("_max_closing"), -np.inf)
+        self._max_lead = grow(get("_max_lead"), -np.inf)
+        if self.window_days:
+            tail = (self.window_days,)
+            self._ring_issued = grow(get("_ring_issued"), np.nan, tail)
+            self._ring_closing = grow(get("_ring_closing"), np.nan, tail)
+            ring_day = get("_ring_day")
+            self._ring_day = np.full((capacity,) + tail, -1, dtype="int64")
+            if ring_day is not None:
+                self._ring_day[:len(ring_day)] = ring_day
+        self._capacity = capacity
+
+    def _slots_for(self, keys) -> np.ndarray:
+        slots = np.empty(len(keys), dtype="int64")
+        for i, key in enumerate(keys):
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = self._size
+                self._keys.append(key)
+                self._size += 1
+            slots[i] = slot
+        if self._size > self._capacity:
+            self._alloc(max(self._size, 2 * self._capacity))
+        return slots
+
+    def __len__(self):
+        return self._size
+
+    def update(self, rows: pd.DataFrame):
+        """Fold new DAILY_STOCK rows into the state: O(len(rows))."""
+        if not len(rows):
+            return
+        grouped = rows.groupby(KEY, sort=False, observed=True)
+        part = partials(rows)
+        slots = self._slots_for(list(zip(part["LOCATION"].tolist(), part["ITEM"].tolist())))
+
+        # Keys are unique within `part`, so plain fancy indexing is safe
+        self._sum[slots] += part["SUM_ISSUED"].to_numpy(dtype="float64")
+        self._count[slots] += part["N_DAYS"].to_numpy(dtype="float64")
+        self._max_closing[slots] = np.fmax(self._max_closing[slots], part["MAX_CLOSING"].to_numpy(dtype="float64"))
+        self._max_lead[slots] = np.fmax(self._max_lead[slots], part["MAX_LEAD"].to_numpy(dtype="float64"))
+
+        days = _day_numbers(rows["DATE"])
+        self.latest_day = int(days.max()) if self.latest_day is None else max(self.latest_day, int(days.max()))
+        if self.window_days:
+            self._update_window(slots[grouped.ngroup().to_numpy()], days, rows)
+
+    def _update_window(self, row_slots, days, rows):
+        # Oldest first, so the newest row for a ring cell is written last
+        order = np.argsort(days, kind="stable")
+        row_slots, days = row_slots[order], days[order]
+        pos = days % self.window_days
+        newer = days >= self._ring_day[row_slots, pos]
+        row_slots, pos, days = row_slots[newer], pos[newer], days[newer]
+        self._ring_day[row_slots, pos] = days
+        self._ring_issued[row_slots, pos] = rows["ISSUED"].to_numpy(dtype="float64")[order][newer]
+        self._ring_closing[row_slots, pos] = rows["CLOSING_STOCK"].to_numpy(dtype="float64")[order][newer]
+
+    def state(self) -> pd.DataFrame:
+        n = self._size
+        keys = self._keys
+        return pd.DataFrame({
+            "LOCATION": [k[0] for k in keys],
+            "ITEM": [k[1] for k in keys],
+            "SUM_ISSUED": self._sum[:n],
+            "N_DAYS": self._count[:n],
+            "MAX_CLOSING": np.where(np.isneginf(self._max_closing[:n]), np.nan, self._max_closing[:n]),
+            "MAX_LEAD": np.where(np.isneginf(self._max_lead[:n]), np.nan, self._max_lead[:n])
+        })
+
+    def health(self) -> pd.DataFrame:
+        """STOCK_HEALTH_DT for every key seen (O(keys))."""
+        out = health_from_state(self.state(), self.policy)
+        if self.window_days:
+            out = out.join(self.window())
+        return out
+
+    def window(self, as_of: int = None) -> pd.DataFrame:
+        """Rolling ISSUED average and CLOSING_STOCK max over the last window_days."""
+        if not self.window_days:
+            raise ValueError("store was created without window_days")
+        n = self._size
+        as_of = self.latest_day if as_of is None else as_of
+        ring_day = self._ring_day[:n]
+        live = (ring_day > as_of - self.window_days) & (ring_day <= as_of)
+        issued = np.where(live, self._ring_issued[:n], np.nan)
+        closing = np.where(live, self._ring_closing[:n], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            counts = np.sum(~np.isnan(issued), axis=1)
+            avg = np.where(counts > 0, np.nansum(issued, axis=1) / np.maximum(counts, 1), np.nan)
+        has_closing = ~np.all(np.isnan(closing), axis=1)
+        peak = np.full(n, np.nan)
+        peak[has_closing] = np.nanmax(closing[has_closing], axis=1)
+        suffix = f"_{self.window_days}D"
+        return pd.DataFrame({f"AVG_DAILY_DEMAND{suffix}": avg, f"MAX_CLOSING{suffix}": peak})
+
+    def verify(self, history: pd.DataFrame, rtol: float = 1e-9) -> pd.DataFrame:
+        """
+        Mismatches between the maintained values and a full recompute
+        over `history` (every row folded in so far). Empty = consistent.
+        """
+        mismatches = compare_health(
+            health_from_state(self.state(), self.policy), full_recompute(history, self.policy), rtol
+        )
+        mismatches["CHECK"] = "totals"
+        if self.window_days and len(history):
+            days = _day_numbers(history["DATE"])
+            recent = history[days > self.latest_day - self.window_days]
+            expected = recent.groupby(KEY, sort=False, observed=True).agg(
+                EXPECTED_AVG=("ISSUED", "mean"), EXPECTED_MAX=("CLOSING_STOCK", "max")
+            )
+            suffix = f"_{self.window_days}D"
+            got = self.window().set_index(pd.MultiIndex.from_tuples(self._keys, names=KEY))
+            got = got.join(expected, how="outer")
+            bad = ~np.isclose(got[f"AVG_DAILY_DEMAND{suffix}"], got["EXPECTED_AVG"], rtol=rtol, equal_nan=True)
+            bad |= ~np.isclose(got[f"MAX_CLOSING{suffix}"], got["EXPECTED_MAX"], rtol=rtol, equal_nan=True)
+            if bad.any():
+                window_bad = got[bad].reset_index()
+                window_bad["CHECK"] = "window"
+                mismatches = pd.concat([mismatches, window_bad], ignore_index=True)
+        return mismatches
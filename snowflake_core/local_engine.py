@@ -0,0 +1,599 @@
+# local_engine.py
+"""
+Embedded stand-in for the Snowflake schema (DuckDB, else SQLite).
+
+Without a Snowflake session the app used to fall back to a handful of
+demo rows, so the real data path (STOCK_HEALTH_DT computed over
+DAILY_STOCK) could not run offline. LocalEngine creates the same tables
+in an embedded database:
+
+- DAILY_STOCK       daily movements per location and item
+- STOCK_HEALTH_DT   same columns and expressions as the dynamic table,
+                    kept as a table and refreshed incrementally
+
+and answers the app's loader queries (STOCK_HEALTH_SQL, scoped or not)
+unchanged. ACTION_LOG is not mirrored here: actions belong to the impact
+store (impact.py), which keeps them next to IMPACT_STATE in every mode.
+
+Incremental refresh: every write folds its rows into per-series running
+state (STOCK_HEALTH_STATE: sum and count of ISSUED, max closing stock and
+lead time; see incremental_agg.py) and records the series it touched in
+STOCK_HEALTH_CHANGES. refresh() derives only those series' rows from the
+state, so a new day costs O(new rows) rather than a rescan of the
+history, and bumps the engine version, which the refresh coordinator
+polls like the dynamic table's data timestamp. A movement that lowers an
+existing day's closing stock rescans that one series. Writes that bypass
+the engine need refresh(full=True).
+
+verify=True (CARESTOCK_LOCAL_VERIFY=1 in the app) checks every refresh
+against a full recompute over DAILY_STOCK.
+
+Seed realistic volumes for offline work:
+
+    python local_engine.py --db /tmp/carestock_local.duckdb --locations 1000 --items 100 --days 30
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from incremental_agg import KEY, compare_health, partials
+from status import DEFAULT_POLICY, status_case_sql
+
+try:
+    import duckdb
+except Exception:
+    duckdb = None
+
+
+log = logging.getLogger("carestock.local_engine")
+
+DEFAULT_LOCAL_DB = os.path.join(
+    tempfile.gettempdir(), "carestock_local.duckdb" if duckdb is not None else "carestock_local.db"
+)
+
+DAILY_STOCK_COLUMNS = [
+    "DATE", "LOCATION", "ITEM", "OPENING_STOCK", "RECEIVED", "ISSUED", "CLOSING_STOCK", "LEAD_TIME_DAYS"
+]
+
+DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS DAILY_STOCK (
+        DATE DATE,
+        LOCATION VARCHAR,
+        ITEM VARCHAR,
+        OPENING_STOCK BIGINT,
+        RECEIVED BIGINT,
+        ISSUED BIGINT,
+        CLOSING_STOCK BIGINT,
+        LEAD_TIME_DAYS BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS STOCK_HEALTH_DT (
+        LOCATION VARCHAR,
+        ITEM VARCHAR,
+        AVG_DAILY_DEMAND DOUBLE,
+        CLOSING_STOCK BIGINT,
+        LEAD_TIME_DAYS BIGINT,
+        STOCK_STATUS VARCHAR,
+        DAYS_TO_STOCKOUT DOUBLE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS STOCK_HEALTH_CHANGES (
+        LOCATION VARCHAR,
+        ITEM VARCHAR,
+        PRIMARY KEY (LOCATION, ITEM)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS STOCK_HEALTH_STATE (
+        LOCATION VARCHAR,
+        ITEM VARCHAR,
+        SUM_ISSUED DOUBLE,
+        N_DAYS BIGINT,
+        MAX_CLOSING DOUBLE,
+        MAX_LEAD DOUBLE,
+        PRIMARY KEY (LOCATION, ITEM)
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS STOCK_HEALTH_REFRESH (VERSION BIGINT, REFRESHED_AT VARCHAR)",
+    "CREATE TABLE IF NOT EXISTS INGEST_BATCHES (BATCH_ID VARCHAR, INGESTED_AT VARCHAR, ROW_COUNT BIGINT)"
+]
+
+# Series lookups for refresh and movements; DuckDB scans columns fast
+# enough that an index would only slow bulk appends down
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS DAILY_STOCK_SERIES ON DAILY_STOCK (LOCATION, ITEM, DATE)",
+    "CREATE INDEX IF NOT EXISTS STOCK_HEALTH_SERIES ON STOCK_HEALTH_DT (LOCATION, ITEM)"
+]
+
+# The STOCK_HEALTH_DT definition over a DAILY_STOCK row source (full
+# recompute, used to verify the incremental path); {status} is the
+# status CASE from status.py
+STOCK_HEALTH_DT_SELECT = """
+    SELECT
+        d.LOCATION,
+        d.ITEM,
+        AVG(d.ISSUED) AS AVG_DAILY_DEMAND,
+        MAX(d.CLOSING_STOCK) AS CLOSING_STOCK,
+        MAX(d.LEAD_TIME_DAYS) AS LEAD_TIME_DAYS,
+        {status} AS STOCK_STATUS,
+        MAX(d.CLOSING_STOCK) / NULLIF(AVG(d.ISSUED), 1) AS DAYS_TO_STOCKOUT
+    FROM {source}
+    GROUP BY d.LOCATION, d.ITEM
+"""
+
+# Running state per series from a DAILY_STOCK row source
+STATE_SELECT = """
+    SELECT
+        d.LOCATION,
+        d.ITEM,
+        COALESCE(SUM(d.ISSUED), 0) AS SUM_ISSUED,
+        COUNT(d.ISSUED) AS N_DAYS,
+        MAX(d.CLOSING_STOCK) AS MAX_CLOSING,
+        MAX(d.LEAD_TIME_DAYS) AS MAX_LEAD
+    FROM {source}
+    GROUP BY d.LOCATION, d.ITEM
+"""
+
+# STOCK_HEALTH_DT rows derived from running state; same expressions as
+# STOCK_HEALTH_DT_SELECT with AVG(ISSUED) = SUM / COUNT
+STOCK_HEALTH_FROM_STATE = """
+    SELECT
+        h.LOCATION,
+        h.ITEM,
+        h.AVG_DAILY_DEMAND,
+        h.CLOSING_STOCK,
+        h.LEAD_TIME_DAYS,
+        {status} AS STOCK_STATUS,
+        h.CLOSING_STOCK / NULLIF(h.AVG_DAILY_DEMAND, 1) AS DAYS_TO_STOCKOUT
+    FROM (
+        SELECT
+            s.LOCATION,
+            s.ITEM,
+            s.SUM_ISSUED / NULLIF(s.N_DAYS, 0) AS AVG_DAILY_DEMAND,
+            s.MAX_CLOSING AS CLOSING_STOCK,
+            s.MAX_LEAD AS LEAD_TIME_DAYS
+        FROM {source}
+    ) h
+"""
+
+MERGE_STATE_SQL = """
+    INSERT INTO STOCK_HEALTH_STATE (LOCATION, ITEM, SUM_ISSUED, N_DAYS, MAX_CLOSING, MAX_LEAD)
+    SELECT LOCATION, ITEM, SUM_ISSUED, N_DAYS, MAX_CLOSING, MAX_LEAD FROM STOCK_HEALTH_PARTIALS WHERE true
+    ON CONFLICT (LOCATION, ITEM) DO UPDATE SET
+        SUM_ISSUED = SUM_ISSUED + excluded.SUM_ISSUED,
+        N_DAYS = N_DAYS + excluded.N_DAYS,
+        MAX_CLOSING = GREATEST(MAX_CLOSING, excluded.MAX_CLOSING),
+        MAX_LEAD = GREATEST(MAX_LEAD, excluded.MAX_LEAD)
+"""
+
+CHANGED_STATE = "STOCK_HEALTH_CHANGES c JOIN STOCK_HEALTH_STATE s ON s.LOCATION = c.LOCATION AND s.ITEM = c.ITEM"
+
+# Same semantics as SnowflakeSink's MERGE: movements add to an existing
+# day, a new day opens at the series' latest earlier closing stock
+APPLY_MOVEMENTS_SQL = [
+    """
+    UPDATE DAILY_STOCK
+    SET RECEIVED = DAILY_STOCK.RECEIVED + b.RECEIVED,
+        ISSUED = DAILY_STOCK.ISSUED + b.ISSUED,
+        CLOSING_STOCK = GREATEST(DAILY_STOCK.CLOSING_STOCK + b.RECEIVED - b.ISSUED, 0)
+    FROM STOCK_EVENTS_BATCH b
+    WHERE DAILY_STOCK.DATE = b.DATE AND DAILY_STOCK.LOCATION = b.LOCATION AND DAILY_STOCK.ITEM = b.ITEM
+    """,
+    """
+    INSERT INTO DAILY_STOCK
+    SELECT
+        o.DATE, o.LOCATION, o.ITEM, o.OPENING_STOCK, o.RECEIVED, o.ISSUED,
+        GREATEST(o.OPENING_STOCK + o.RECEIVED - o.ISSUED, 0), o.LEAD_TIME_DAYS
+    FROM (
+        SELECT
+            b.DATE, b.LOCATION, b.ITEM, b.RECEIVED, b.ISSUED,
+            COALESCE((
+                SELECT p.CLOSING_STOCK FROM DAILY_STOCK p
+                WHERE p.LOCATION = b.LOCATION AND p.ITEM = b.ITEM AND p.DATE < b.DATE
+                ORDER BY p.DATE DESC LIMIT 1
+            ), 0) AS OPENING_STOCK,
+            (
+                SELECT p.LEAD_TIME_DAYS FROM DAILY_STOCK p
+                WHERE p.LOCATION = b.LOCATION AND p.ITEM = b.ITEM AND p.DATE < b.DATE
+                ORDER BY p.DATE DESC LIMIT 1
+            ) AS LEAD_TIME_DAYS
+        FROM STOCK_EVENTS_BATCH b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM DAILY_STOCK t
+            WHERE t.DATE = b.DATE AND t.LOCATION = b.LOCATION AND t.ITEM = b.ITEM
+        )
+    ) o
+    """
+]
+
+
+def _iso_dates(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values).dt.strftime("%Y-%m-%d")
+
+
+def _greatest(a, b):
+    # DuckDB / Snowflake GREATEST semantics for SQLite: NULLs are ignored
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class LocalEngine:
+    """
+    One embedded database connection; every call holds the engine lock.
+
+    backend: "duckdb", "sqlite" or None (DuckDB when installed).
+    verify: check every incremental refresh against a full recompute
+    (raises AssertionError on a mismatch).
+    policy: status thresholds (status.StatusPolicy) for STOCK_STATUS.
+    """
+
+    def __init__(self, path: str = DEFAULT_LOCAL_DB, backend: str = None, verify: bool = False,
+                 policy=DEFAULT_POLICY):
+        self.backend = backend or ("duckdb" if duckdb is not None else "sqlite")
+        self.path = path
+        self.verify_refresh = verify
+        self.policy = policy
+        self._lock = threading.Lock()
+        if self.backend == "duckdb":
+            if duckdb is None:
+                raise ImportError("duckdb is not installed")
+            self._conn = duckdb.connect(path)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # SQLite spells GREATEST as the multi-argument MAX
+            self._conn.create_function("GREATEST", 2, _greatest, deterministic=True)
+        for ddl in DDL + (SQLITE_INDEXES if self.backend == "sqlite" else []):
+            self._conn.execute(ddl)
+        # Databases created before the running state existed
+        if self._execute("SELECT COUNT(*) FROM STOCK_HEALTH_STATE").fetchone()[0] == 0 and \
+                self._execute("SELECT COUNT(*) FROM DAILY_STOCK").fetchone()[0] > 0:
+            self.refresh(full=True)
+
+    # -------------------------------------------------
+    # low level
+    # -------------------------------------------------
+    def _execute(self, sql: str, params=None):
+        return self._conn.execute(sql, params or [])
+
+    def _frame(self, sql: str, params=None) -> pd.DataFrame:
+        if self.backend == "duckdb":
+            return self._conn.execute(sql, params or []).df()
+        return pd.read_sql_query(sql, self._conn, params=params or None)
+
+    def _insert_frame(self, table: str, frame: pd.DataFrame):
+        if self.backend == "duckdb":
+            self._conn.register("_carestock_frame", frame)
+            try:
+                self._conn.execute(
+                    f"INSERT INTO {table} ({', '.join(frame.columns)}) "
+                    f"SELECT {', '.join(frame.columns)} FROM _carestock_frame"
+                )
+            finally:
+                self._conn.unregister("_carestock_frame")
+        else:
+            marks = ", ".join("?" * len(frame.columns))
+            self._conn.executemany(
+                f"INSERT INTO {table} ({', '.join(frame.columns)}) VALUES ({marks})",
+                frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+            )
+
+    def _record_changes(self, frame: pd.DataFrame):
+        keys = frame[KEY].drop_duplicates()
+        self._insert_frame("STOCK_EVENTS_KEYS", keys)
+        self._execute(
+            "INSERT OR IGNORE INTO STOCK_HEALTH_CHANGES SELECT DISTINCT LOCATION, ITEM FROM STOCK_EVENTS_KEYS"
+        )
+        self._execute("DROP TABLE STOCK_EVENTS_KEYS")
+
+    def _merge_state(self, part: pd.DataFrame):
+        """Fold per-series partial state into STOCK_HEALTH_STATE."""
+        self._execute(
+            "CREATE TEMP TABLE STOCK_HEALTH_PARTIALS (LOCATION VARCHAR, ITEM VARCHAR, "
+            "SUM_ISSUED DOUBLE, N_DAYS BIGINT, MAX_CLOSING DOUBLE, MAX_LEAD DOUBLE)"
+        )
+        self._insert_frame("STOCK_HEALTH_PARTIALS", part)
+        self._execute(MERGE_STATE_SQL)
+        self._execute("DROP TABLE STOCK_HEALTH_PARTIALS")
+
+    def _rescan_state(self, keys: pd.DataFrame):
+        """Rebuild the running state of `keys` from DAILY_STOCK."""
+        self._execute("CREATE TEMP TABLE STOCK_EVENTS_KEYS (LOCATION VARCHAR, ITEM VARCHAR)")
+        self._insert_frame("STOCK_EVENTS_KEYS", keys)
+        self._execute(
+            "DELETE FROM STOCK_HEALTH_STATE WHERE EXISTS (SELECT 1 FROM STOCK_EVENTS_KEYS k "
+            "WHERE k.LOCATION = STOCK_HEALTH_STATE.LOCATION AND k.ITEM = STOCK_HEALTH_STATE.ITEM)"
+        )
+        self._execute("INSERT INTO STOCK_HEALTH_STATE " + STATE_SELECT.format(
+            source="STOCK_EVENTS_KEYS k JOIN DAILY_STOCK d ON d.LOCATION = k.LOCATION AND d.ITEM = k.ITEM"
+        ))
+        self._execute("DROP TABLE STOCK_EVENTS_KEYS")
+
+    def _transaction(self, work):
+        with self._lock:
+            self._execute("BEGIN")
+            try:
+                result = work()
+                self._execute("COMMIT")
+                return result
+            except Exception:
+                self._execute("ROLLBACK")
+                raise
+
+    # -------------------------------------------------
+    # reads (the app's loader queries)
+    # -------------------------------------------------
+    def query(self, sql: str, params=None) -> pd.DataFrame:
+        with self._lock:
+            return self._frame(sql, params)
+
+    def table(self, name: str) -> pd.DataFrame:
+        return self.query(f"SELECT * FROM {name}")
+
+    @property
+    def version(self):
+        """Number of the last STOCK_HEALTH_DT refresh (0 = never refreshed)."""
+        with self._lock:
+            row = self._execute("SELECT MAX(VERSION) FROM STOCK_HEALTH_REFRESH").fetchone()
+        return int(row[0] or 0)
+
+    # -------------------------------------------------
+    # writes
+    # -------------------------------------------------
+    def append_daily_stock(self, frame: pd.DataFrame, skip_existing: bool = False) -> int:
+        """
+        Append DAILY_STOCK rows (bulk upload path); returns rows written.
+
+        skip_existing: leave out rows whose DATE x LOCATION x ITEM is
+        already in DAILY_STOCK, so loading the same file twice adds
+        nothing the second time.
+        """
+        frame = frame.reindex(columns=DAILY_STOCK_COLUMNS).assign(DATE=lambda f: _iso_dates(f["DATE"]))
+
+        def work():
+            nonlocal frame
+            if skip_existing:
+                frame = self._new_days(frame)
+                if frame.empty:
+                    return 0
+            self._execute("CREATE TEMP TABLE STOCK_EVENTS_KEYS (LOCATION VARCHAR, ITEM VARCHAR)")
+            self._insert_frame("DAILY_STOCK", frame)
+            self._merge_state(partials(frame))
+            self._record_changes(frame)
+            return len(frame)
+
+        return self._transaction(work)
+
+    def _new_days(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Rows of `frame` whose DATE x LOCATION x ITEM is not in DAILY_STOCK."""
+        self._execute(
+            "CREATE TEMP TABLE STOCK_UPLOAD_KEYS (ROW_ID BIGINT, DATE DATE, LOCATION VARCHAR, ITEM VARCHAR)"
+        )
+        self._insert_frame("STOCK_UPLOAD_KEYS", frame[["DATE"] + KEY].assign(ROW_ID=np.arange(len(frame))))
+        existing = self._frame(
+            "SELECT k.ROW_ID FROM STOCK_UPLOAD_KEYS k WHERE EXISTS (SELECT 1 FROM DAILY_STOCK t "
+            "WHERE t.DATE = k.DATE AND t.LOCATION = k.LOCATION AND t.ITEM = k.ITEM)"
+        )["ROW_ID"].to_numpy()
+        self._execute("DROP TABLE STOCK_UPLOAD_KEYS")
+        keep = np.ones(len(frame), dtype=bool)
+        keep[existing.astype("int64")] = False
+        return frame[keep]
+
+    def apply_movements(self, frame: pd.DataFrame, batch_id: str = None) -> int:
+        """
+        Add DATE x LOCATION x ITEM movements (RECEIVED, ISSUED) to
+        DAILY_STOCK; a batch_id already applied is skipped. Several
+        movements for the same key are summed first.
+        """
+        batch_id = batch_id or uuid.uuid4().hex
+        frame = frame[["DATE", "LOCATION", "ITEM", "RECEIVED", "ISSUED"]].assign(
+            DATE=lambda f: _iso_dates(f["DATE"])
+        )
+        # The MERGE and the state delta both expect one row per key
+        frame = frame.groupby(["DATE"] + KEY, as_index=False, sort=False)[["RECEIVED", "ISSUED"]].sum(min_count=1)
+
+        def work():
+            done = self._execute("SELECT COUNT(*) FROM INGEST_BATCHES WHERE BATCH_ID = ?", [batch_id]).fetchone()[0]
+            if done:
+                return 0
+            self._execute(
+                "CREATE TEMP TABLE STOCK_EVENTS_BATCH "
+                "(DATE DATE, LOCATION VARCHAR, ITEM VARCHAR, RECEIVED BIGINT, ISSUED BIGINT)"
+            )
+            self._insert_frame("STOCK_EVENTS_BATCH", frame)
+            matched = (
+                "FROM STOCK_EVENTS_BATCH b JOIN DAILY_STOCK t "
+                "ON t.DATE = b.DATE AND t.LOCATION = b.LOCATION AND t.ITEM = b.ITEM"
+            )
+            before = self._frame(f"SELECT t.DATE, t.LOCATION, t.ITEM, t.CLOSING_STOCK AS OLD_CLOSING {matched}")
+            for sql in APPLY_MOVEMENTS_SQL:
+                self._execute(sql)
+            after = self._frame(f"SELECT t.DATE, t.LOCATION, t.ITEM, t.CLOSING_STOCK, t.LEAD_TIME_DAYS {matched}")
+            self._execute("DROP TABLE STOCK_EVENTS_BATCH")
+            self._apply_movement_state(frame, before, after)
+            self._execute("CREATE TEMP TABLE STOCK_EVENTS_KEYS (LOCATION VARCHAR, ITEM VARCHAR)")
+            self._record_changes(frame)
+            self._execute(
+                "INSERT INTO INGEST_BATCHES VALUES (?, ?, ?)",
+                [batch_id, time.strftime("%Y-%m-%dT%H:%M:%S"), len(frame)]
+            )
+            return len(frame)
+
+        return self._transaction(work)
+
+    def _apply_movement_state(self, frame, before, after):
+        """
+        Running-state delta of a movement batch: new days count once, an
+        existing day only adds its ISSUED. A day whose closing stock went
+        down may have held the series maximum, so its series is rescanned.
+        """
+        for side in (before, after):
+            side["DATE"] = _iso_dates(side["DATE"])
+        rows = frame.merge(after, on=["DATE"] + KEY).merge(before, on=["DATE"] + KEY, how="left", indicator="SEEN")
+        existed = (rows["SEEN"] == "both").to_numpy()
+        rows["NEW_DAY"] = ~existed & rows["ISSUED"].notna().to_numpy()
+        rows["LEAD_TIME_DAYS"] = rows["LEAD_TIME_DAYS"].where(~existed)
+
+        grouped = rows.groupby(KEY, sort=False, observed=True)
+        self._merge_state(grouped.agg(
+            SUM_ISSUED=("ISSUED", "sum"),
+            N_DAYS=("NEW_DAY", "sum"),
+            MAX_CLOSING=("CLOSING_STOCK", "max"),
+            MAX_LEAD=("LEAD_TIME_DAYS", "max")
+        ).reset_index())
+
+        lowered = existed & (rows["CLOSING_STOCK"] < rows["OLD_CLOSING"].fillna(-np.inf)).to_numpy()
+        if lowered.any():
+            self._rescan_state(rows.loc[lowered, KEY].drop_duplicates())
+
+    # -------------------------------------------------
+    # STOCK_HEALTH_DT refresh
+    # -------------------------------------------------
+    def refresh(self, full: bool = False) -> int:
+        """
+        Rederive STOCK_HEALTH_DT for changed series from their running
+        state (full=True rebuilds the state from DAILY_STOCK first).
+        Returns the series refreshed; 0 leaves the version.
+        """
+        def work():
+            if full:
+                self._execute("DELETE FROM STOCK_HEALTH_STATE")
+                self._execute("INSERT INTO STOCK_HEALTH_STATE " + STATE_SELECT.format(source="DAILY_STOCK d"))
+                self._execute("DELETE FROM STOCK_HEALTH_DT")
+                source = "STOCK_HEALTH_STATE s"
+            else:
+                pending = self._execute("SELECT COUNT(*) FROM STOCK_HEALTH_CHANGES").fetchone()[0]
+                if not pending:
+                    return 0
+                self._execute(
+                    "DELETE FROM STOCK_HEALTH_DT WHERE EXISTS (SELECT 1 FROM STOCK_HEALTH_CHANGES c "
+                    "WHERE c.LOCATION = STOCK_HEALTH_DT.LOCATION AND c.ITEM = STOCK_HEALTH_DT.ITEM)"
+                )
+                source = CHANGED_STATE
+            self._execute("INSERT INTO STOCK_HEALTH_DT " + STOCK_HEALTH_FROM_STATE.format(
+                source=source,
+                status=status_case_sql("h.CLOSING_STOCK / NULLIF(h.AVG_DAILY_DEMAND, 0)", "h.ITEM", self.policy)
+            ))
+            refreshed = self._execute("SELECT COUNT(*) FROM STOCK_HEALTH_DT").fetchone()[0] if full else pending
+            self._execute("DELETE FROM STOCK_HEALTH_CHANGES")
+            self._execute(
+                "INSERT INTO STOCK_HEALTH_REFRESH "
+                "SELECT COALESCE(MAX(VERSION), 0) + 1, ? FROM STOCK_HEALTH_REFRESH",
+                [time.strftime("%Y-%m-%dT%H:%M:%S")]
+            )
+            return int(refreshed)
+
+        refreshed = self._transaction(work)
+        if refreshed and self.verify_refresh and not full:
+            mismatches = self.verify()
+            if len(mismatches):
+                log.error("incremental STOCK_HEALTH_DT differs from a full recompute:\n%s", mismatches.head(20))
+                raise AssertionError(f"{len(mismatches)} STOCK_HEALTH_DT rows differ from a full recompute")
+        return refreshed
+
+    def verify(self, rtol: float = 1e-9) -> pd.DataFrame:
+        """STOCK_HEALTH_DT rows that differ from a full recompute (empty = consistent)."""
+        with self._lock:
+            actual = self._frame("SELECT * FROM STOCK_HEALTH_DT")
+            expected = self._frame(STOCK_HEALTH_DT_SELECT.format(
+                source="DAILY_STOCK d",
+                status=status_case_sql("MAX(d.CLOSING_STOCK) / NULLIF(AVG(d.ISSUED), 0)", "d.ITEM", self.policy)
+            ))
+        return compare_health(actual, expected, rtol)
+
+    def refreshed_version(self):
+        """Refresh pending changes, then report the version (a refresh probe)."""
+        self.refresh()
+        return self.version
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_local_engine(path: str = None, backend: str = None, verify: bool = False, policy=DEFAULT_POLICY):
+    """LocalEngine for `path`, or None when it cannot be opened."""
+    try:
+        return LocalEngine(path or DEFAULT_LOCAL_DB, backend, verify, policy)
+    except Exception:
+        return None
+
+
+# =================================================
+# SYNTHETIC HISTORY
+# =================================================
+def synthetic_daily_stock(n_locations: int = 200, n_items: int = 50, days: int = 30,
+                          end_date: str = None, seed: int = 0) -> pd.DataFrame:
+    """
+    DAILY_STOCK rows for every location x item x day: Poisson issues and
+    a restock every lead time, so a share of series runs low.
+    """
+    rng = np.random.default_rng(seed)
+    n_series = n_locations * n_items
+    demand = rng.gamma(2.0, 4.0, n_series)
+    lead = rng.integers(3, 21, n_series)
+    start = (demand * rng.uniform(2, 40, n_series)).round()
+
+    issued = rng.poisson(np.repeat(demand, days)).reshape(n_series, days)
+    day = np.arange(days)
+    restock = (day[None, :] % lead[:, None]) == (lead[:, None] - 1)
+    received = np.where(restock, np.round(demand * lead * rng.uniform(0.5, 1.5, n_series))[:, None], 0)
+    closing = np.maximum(start[:, None] + np.cumsum(received - issued, axis=1), 0)
+    opening = np.concatenate([start[:, None], closing[:, :-1]], axis=1)
+    # Clipped days issue only what was on the shelf
+    issued = np.minimum(issued, opening + received)
+
+    end = pd.Timestamp(end_date) if end_date else pd.Timestamp.today().normalize()
+    dates = pd.date_range(end=end, periods=days).strftime("%Y-%m-%d")
+    series = np.arange(n_series)
+    return pd.DataFrame({
+        "DATE": np.tile(dates.to_numpy(), n_series),
+        "LOCATION": np.repeat([f"Facility {i // n_items:05d}" for i in series], days),
+        "ITEM": np.repeat([f"Item {i % n_items:04d}" for i in series], days),
+        "OPENING_STOCK": opening.ravel().astype("int64"),
+        "RECEIVED": received.ravel().astype("int64"),
+        "ISSUED": issued.ravel().astype("int64"),
+        "CLOSING_STOCK": closing.ravel().astype("int64"),
+        "LEAD_TIME_DAYS": np.repeat(lead, days).astype("int64")
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed a local CareStock Watch engine with synthetic history")
+    parser.add_argument("--db", default=DEFAULT_LOCAL_DB)
+    parser.add_argument("--backend", choices=["duckdb", "sqlite"])
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engine = LocalEngine(args.db, args.backend)
+    t0 = time.perf_counter()
+    rows = engine.append_daily_stock(
+        synthetic_daily_stock(args.locations, args.items, args.days, seed=args.seed)
+    )
+    series = engine.refresh()
+    print(f"{engine.backend}: {rows:,} DAILY_STOCK rows, {series:,} series refreshed "
+          f"in {time.perf_counter() - t0:.1f}s -> {args.db}")
+    engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# lots.py
+"""
+Lot-level stock with expiry, and a vectorized FEFO depletion projection.
+
+Lot table (one row per lot):
+
+    LOCATION, ITEM, LOT_ID, QUANTITY, EXPIRY_DATE
+
+stored columnar: the STOCK_LOTS table in Snowflake, an Arrow/Feather file
+locally (categorical keys, int32 quantities, datetime64 expiry).
+
+FEFO (first-expiry-first-out) with a constant daily demand d per
+LOCATION x ITEM has a closed form. Measure time in units of demand
+(E_k = d * days until lot k expires) and let P_k be the cumulative lot
+quantity in expiry order. Demand consumed by the time lot k is finished
+(used up or expired) is
+
+    S_k = P_k + min(0, min_{j <= k} (E_j - P_j))
+
+so one grouped cumsum and one grouped cummin project every lot in the
+network at once. Lot k uses S_k - S_{k-1} units (capped at the demand
+of the horizon); what is left when it expires inside the horizon is
+projected waste.
+"""
+
+import os
+import tempfile
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_ARROW = True
+except Exception:
+    _HAS_ARROW = False
+
+
+DEFAULT_LOTS_PATH = os.path.join(tempfile.gettempdir(), "carestock_lots.arrow")
+DEFAULT_HORIZON_DAYS = 90
+
+KEY = ["LOCATION", "ITEM"]
+LOT_COLUMNS = KEY + ["LOT_ID", "QUANTITY", "EXPIRY_DATE"]
+
+LOT_DTYPES = {
+    "LOCATION": "category",
+    "ITEM": "category",
+    "LOT_ID": "string",
+    "QUANTITY": "int32"
+}
+
+LOTS_SQL = """
+    SELECT LOCATION, ITEM, LOT_ID, QUANTITY, EXPIRY_DATE
+    FROM STOCK_LOTS
+    WHERE QUANTITY > 0
+"""
+
+
+# =================================================
+# STORAGE
+# =================================================
+def compact_lots(lots: pd.DataFrame) -> pd.DataFrame:
+    out = lots[LOT_COLUMNS].copy()
+    for col, dtype in LOT_DTYPES.items():
+        if dtype == "int32":
+            out[col] = pd.to_numeric(out[col], errors="coerce").fillna(0).round().astype(dtype)
+        else:
+            out[col] = out[col].astype(dtype)
+    out["EXPIRY_DATE"] = pd.to_datetime(out["EXPIRY_DATE"])
+    return out
+
+
+def write_lots(lots: pd.DataFrame, path: str = DEFAULT_LOTS_PATH):
+    tmp = f"{path}.tmp"
+    frame = compact_lots(lots).reset_index(drop=True)
+    if _HAS_ARROW:
+        frame.to_feather(tmp)
+    else:
+        frame.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def read_lots(path: str = DEFAULT_LOTS_PATH):
+    if not os.path.exists(path):
+        return None
+    return pd.read_feather(path) if _HAS_ARROW else pd.read_pickle(path)
+
+
+def load_lots(session=None, path: str = DEFAULT_LOTS_PATH):
+    """Lots from Snowflake (STOCK_LOTS) or the local file; None if neither."""
+    if session is not None:
+        try:
+            return compact_lots(session.sql(LOTS_SQL).to_pandas())
+        except Exception:
+            return None
+    return read_lots(path)
+
+
+def synthetic_lots(stock: pd.DataFrame, max_lots: int = 4, max_shelf_days: int = 365,
+                   as_of=None, seed=None) -> pd.DataFrame:
+    """Split each row's CLOSING_STOCK into 1..max_lots lots with random expiry."""
+    rng = np.random.default_rng(seed)
+    as_of = pd.Timestamp(as_of or date.today())
+
+    n_lots = rng.integers(1, max_lots + 1, len(stock))
+    owner = np.repeat(np.arange(len(stock)), n_lots)
+
+    weights = rng.random(len(owner)) + 0.1
+    share = weights / np.bincount(owner, weights=weights)[owner]
+    qty = np.floor(share * stock["CLOSING_STOCK"].to_numpy(dtype="float64")[owner])
+
+    lot_no = np.arange(len(owner)) - np.repeat(np.cumsum(n_lots) - n_lots, n_lots)
+    return compact_lots(pd.DataFrame({
+        "LOCATION": stock["LOCATION"].to_numpy()[owner],
+        "ITEM": stock["ITEM"].to_numpy()[owner],
+        "LOT_ID": [f"L{o:06d}-{k}" for o, k in zip(owner, lot_no)],
+        "QUANTITY": qty,
+        "EXPIRY_DATE": as_of + pd.to_timedelta(rng.integers(-5, max_shelf_days, len(owner)), unit="D")
+    }))
+
+
+# =================================================
+# FEFO PROJECTION
+# =================================================
+def fefo_projection(lots: pd.DataFrame, demand: pd.DataFrame, as_of=None,
+                    horizon_days: int = DEFAULT_HORIZON_DAYS,
+                    demand_col: str = "AVG_DAILY_DEMAND") -> pd.DataFrame:
+    """
+    Per-lot FEFO projection over `horizon_days`.
+
+    demand: one row per LOCATION x ITEM with `demand_col` (units/day).
+    Adds DAYS_TO_EXPIRY, USED_UNITS and EXPIRING_UNITS to the lot rows.
+    """
+    as_of = pd.Timestamp(as_of or date.today())
+
+    rate = (
+        demand[KEY + [demand_col]]
+        .astype({k: "object" for k in KEY})
+        .groupby(KEY)[demand_col].mean()
+    )
+    out = lots.copy()
+    keys = pd.MultiIndex.from_arrays([out[k].astype("object") for k in KEY])
+    d = rate.reindex(keys).fillna(0).to_numpy(dtype="float64")
+    d = np.clip(d, 0, None)
+
+    days = (out["EXPIRY_DATE"] - as_of).dt.days.to_numpy(dtype="float64")
+    group = keys.factorize()[0]
+    order = np.lexsort((days, group))
+
+    g, q, dd, e_days = group[order], out["QUANTITY"].to_numpy(dtype="float64")[order], d[order], days[order]
+    expiry_units = dd * np.clip(e_days, 0, None)
+
+    cum_qty = pd.Series(q).groupby(g).cumsum().to_numpy()
+    slack = pd.Series(expiry_units - cum_qty).groupby(g).cummin().to_numpy()
+    finished = cum_qty + np.minimum(0, slack)
+
+    # Demand consumed when lot k starts = when lot k-1 finished
+    first = np.r_[True, g[1:] != g[:-1]]
+    started = np.where(first, 0.0, np.r_[0.0, finished[:-1]])
+
+    horizon_units = dd * horizon_days
+    used = np.minimum(finished, horizon_units) - np.minimum(started, horizon_units)
+    expiring = np.where(e_days <= horizon_days, q - used, 0.0)
+
+    out["DAYS_TO_EXPIRY"] = days.astype("int32")
+    for col, values in (("USED_UNITS", used), ("EXPIRING_UNITS", expiring)):
+        scattered = np.empty(len(out), dtype="float32")
+        scattered[order] = values
+        out[col] = scattered
+    return out
+
+
+def expiry_by_series(projection: pd.DataFrame) -> pd.DataFrame:
+    """Projected expiring units per LOCATION x ITEM."""
+    expiring_lot = projection["EXPIRING_UNITS"] > 0
+    out = projection.assign(EXPIRING_LOT=expiring_lot).groupby(KEY, observed=True).agg(
+        LOT_UNITS=("QUANTITY", "sum"),
+        EXPIRING_UNITS=("EXPIRING_UNITS", "sum"),
+        EXPIRING_LOTS=("EXPIRING_LOT", "sum"),
+        NEXT_EXPIRY_DAYS=("DAYS_TO_EXPIRY", "min")
+    ).reset_index()
+    out["EXPIRY_SHARE"] = (out["EXPIRING_UNITS"] / out["LOT_UNITS"].clip(lower=1)).astype("float32")
+    return out
@@ -0,0 +1,210 @@
+# pipeline.py
+"""
+Stock frame enrichment with a compact in-memory schema.
+
+The enriched frame holds only machine-friendly columns:
+- LOCATION / ITEM / STOCK_STATUS as categoricals
+- float32 / int32 numerics (forecast, EOQ, safety stock, reorder point,
+  risk score)
+- booleans for life-saving, overstock and reorder flags
+
+Display strings (status badges, priority labels, forecast explanations)
+are derived by with_display_columns() for the rows a page actually
+renders, never stored per row.
+"""
+
+import numpy as np
+import pandas as pd
+
+from ai_component_additions import cortex_demand_forecast_batch, forecast_explanation
+from status import STATUS_DTYPE, classify, days_of_stock
+
+STATUS_BADGES = {
+    "Critical": "🔴 Critical",
+    "Warning": "🟡 Warning",
+    "Healthy": "🟢 Healthy"
+}
+
+LIFE_SAVING_ITEMS = ["Insulin", "Oxygen", "Blood", "Ventilator"]
+
+FORECAST_HORIZON_DAYS = 7
+OVERSTOCK_COVER_DAYS = 90
+
+# Column -> dtype for the base STOCK_HEALTH_DT columns
+BASE_DTYPES = {
+    "LOCATION": "category",
+    "ITEM": "category",
+    "STOCK_STATUS": STATUS_DTYPE,
+    "CLOSING_STOCK": "int32",
+    "AVG_DAILY_DEMAND": "float32",
+    "DAYS_TO_STOCKOUT": "float32",
+    "LEAD_TIME_DAYS": "int32"
+}
+
+
+# =================================================
+# INVENTORY OPTIMIZATION (EOQ + SAFETY STOCK)
+# =================================================
+# Accept scalars or arrays; scalars come back as plain floats.
+
+def _as_result(x):
+    x = np.asarray(x)
+    return x.item() if x.ndim == 0 else x
+
+
+def calculate_eoq(avg_daily_demand, ordering_cost=500, holding_cost=50):
+    """
+    EOQ calculation
+    ordering_cost: cost per order (INR)
+    holding_cost: annual holding cost per unit (INR)
+    """
+    annual_demand = np.asarray(avg_daily_demand, dtype="float64") * 365
+    eoq = np.sqrt((2 * np.clip(annual_demand, 0, None) * ordering_cost) / holding_cost)
+    return _as_result(np.round(np.where(annual_demand > 0, eoq, 0), 1))
+
+
+def calculate_safety_stock(avg_daily_demand, lead_time_days, service_level=1.65):
+    """
+    Safety stock calculation
+    service_level = 1.65 ≈ 95% service level
+    """
+    demand_std = np.asarray(avg_daily_demand, dtype="float64") * 0.3  # assume 30% variability
+    lead = np.asarray(lead_time_days, dtype="float64")
+    return _as_result(np.round(service_level * demand_std * np.sqrt(lead), 1))
+
+
+def calculate_reorder_point(avg_daily_demand, lead_time_days, safety_stock):
+    """
+    Reorder Point (ROP)
+    """
+    demand = np.asarray(avg_daily_demand, dtype="float64")
+    lead = np.asarray(lead_time_days, dtype="float64")
+    return _as_result(np.round(demand * lead + np.asarray(safety_stock), 1))
+
+
+# =================================================
+# RISK SCORE
+# =================================================
+LIFE_SAVING_WEIGHT = 2.0
+STOCKOUT_PROB_WEIGHT = 5.0
+
+
+def risk_score(days_to_stockout, lead_time_days, forecast_high, closing_stock, is_life_saving,
+               stockout_prob=0.0):
+    """
+    Composite "act on this first" score (higher = more urgent).
+
+    - lead pressure: lead time / days to stock-out (>1 = runs out before
+      a new order could arrive)
+    - demand upside: share of current stock the 7-day upper-bound
+      forecast would consume
+    - simulated stock-out probability (simulation.py), scaled to the
+      same 0-5 range as the demand upside; 0 when not simulated
+    - life-saving items weighted x2
+    """
+    days_left = np.clip(np.asarray(days_to_stockout, dtype="float64"), 0.1, None)
+    stock = np.clip(np.asarray(closing_stock, dtype="float64"), 1, None)
+
+    lead_pressure = np.asarray(lead_time_days, dtype="float64") / days_left
+    demand_upside = np.clip(np.asarray(forecast_high, dtype="float64") / stock, 0, 5)
+    stockout = STOCKOUT_PROB_WEIGHT * np.asarray(stockout_prob, dtype="float64")
+    weight = np.where(np.asarray(is_life_saving, dtype=bool), LIFE_SAVING_WEIGHT, 1.0)
+
+    return _as_result((lead_pressure + demand_upside + stockout) * weight)
+
+
+# =================================================
+# COMPACT SCHEMA
+# =================================================
+def compact_stock_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast STOCK_HEALTH_DT columns to the compact dtypes."""
+    out = df.copy()
+    for col, dtype in BASE_DTYPES.items():
+        if col not in out.columns:
+            continue
+        if dtype in ("int32", "float32"):
+            values = pd.to_numeric(out[col], errors="coerce")
+            if dtype == "int32":
+                values = values.fillna(0).round()
+            out[col] = values.astype(dtype)
+        else:
+            out[col] = out[col].astype(dtype)
+    return out
+
+
+def enrich_stock_frame(df: pd.DataFrame, policy=None) -> pd.DataFrame:
+    """
+    Add forecast, cover, overstock and EOQ/ROP columns (vectorized).
+
+    policy: a non-default status.StatusPolicy reclassifies STOCK_STATUS,
+    so every source (Snowflake, snapshot, history, demo) follows it;
+    frames without a status are always classified.
+    """
+    out = compact_stock_frame(df)
+
+    demand = out["AVG_DAILY_DEMAND"].to_numpy(dtype="float64")
+    lead = out["LEAD_TIME_DAYS"].to_numpy(dtype="float64")
+    stock = out["CLOSING_STOCK"].to_numpy(dtype="float64")
+
+    if "STOCK_STATUS" not in out.columns or (policy is not None and not policy.is_default):
+        out["STOCK_STATUS"] = classify(days_of_stock(stock, demand), out["ITEM"], policy)
+
+    # Cortex-style forecast
+    forecast = cortex_demand_forecast_batch(demand, FORECAST_HORIZON_DAYS)
+    out["FORECAST_7D"] = forecast["forecast_units"].astype("float32")
+    out["FORECAST_LOW"] = forecast["lower_bound"].astype("float32")
+    out["FORECAST_HIGH"] = forecast["upper_bound"].astype("float32")
+
+    # Derived metrics
+    days_of_cover = stock / np.where(lead == 0, 1, lead)
+    out["DAYS_OF_COVER"] = days_of_cover.astype("float32")
+    out["IS_LIFE_SAVING"] = out["ITEM"].isin(LIFE_SAVING_ITEMS).to_numpy()
+    out["OVERSTOCK_RISK"] = days_of_cover > OVERSTOCK_COVER_DAYS
+
+    # EOQ + safety stock
+    safety_stock = calculate_safety_stock(demand, lead)
+    reorder_point = calculate_reorder_point(demand, lead, safety_stock)
+    out["EOQ"] = np.asarray(calculate_eoq(demand), dtype="float32")
+    out["SAFETY_STOCK"] = np.asarray(safety_stock, dtype="float32")
+    out["REORDER_POINT"] = np.asarray(reorder_point, dtype="float32")
+    out["REORDER_NOW"] = stock <= reorder_point
+
+    out["RISK_SCORE"] = risk_score(
+        out["DAYS_TO_STOCKOUT"].to_numpy(dtype="float64"),
+        lead,
+        out["FORECAST_HIGH"].to_numpy(dtype="float64"),
+        stock,
+        out["IS_LIFE_SAVING"].to_numpy()
+    ).astype("float32")
+
+    return out
+
+
+# =================================================
+# RENDER-TIME DISPLAY COLUMNS
+# =================================================
+def status_badge(status) -> str:
+    return STATUS_BADGES.get(status, "")
+
+
+def with_display_columns(view: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return a copy of `view` with human-readable columns added.
+
+    Call this on the rows being rendered or exported, not the full frame.
+    """
+    out = view.copy()
+    if "STOCK_STATUS" in out.columns:
+        out["STATUS_BADGE"] = out["STOCK_STATUS"].astype("object").map(STATUS_BADGES)
+    if "IS_LIFE_SAVING" in out.columns:
+        out["ITEM_PRIORITY"] = np.where(out["IS_LIFE_SAVING"], "🔴 Life-saving", "🟢 Essential")
+    if "OVERSTOCK_RISK" in out.columns:
+        out["OVERSTOCK_BADGE"] = np.where(out["OVERSTOCK_RISK"], "🟣 Overstock risk", "")
+    if "REORDER_NOW" in out.columns:
+        out["REORDER_RECOMMENDATION"] = np.where(out["REORDER_NOW"], "🔴 Order now", "🟢 Stock sufficient")
+    if "AVG_DAILY_DEMAND" in out.columns and "LEAD_TIME_DAYS" in out.columns:
+        out["AI_EXPLANATION"] = [
+            forecast_explanation(float(d), int(l), FORECAST_HORIZON_DAYS)
+            for d, l in zip(out["AVG_DAILY_DEMAND"], out["LEAD_TIME_DAYS"])
+        ]
+    return out
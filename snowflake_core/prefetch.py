@@ -0,0 +1,130 @@
+# prefetch.py
+"""
+Background prefetch of page aggregates.
+
+Each page used to compute its aggregates only once it was selected, so
+every page switch paid for them serially. Once the frame for a data
+version and filter set is ready, the app submits the Dashboard,
+Analytics and Impact aggregates to a shared thread pool; they run
+concurrently (NumPy and pandas release the GIL in most of the work) and
+land in a process-wide cache. A page then reads its entry: a finished
+job is a dictionary lookup, a running one is joined, and a missing one
+runs inline.
+
+Jobs are single-flight per key and never touch Streamlit: everything a
+job needs is passed in.
+"""
+
+import copy
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from figures import heat_grid
+from hierarchy import AggregateCube
+from lots import expiry_by_series, fefo_projection, synthetic_lots
+from pipeline import with_display_columns
+from query import at_risk_mask
+
+
+DEFAULT_WORKERS = int(os.getenv("CARESTOCK_PREFETCH_WORKERS", "3"))
+DEFAULT_MAX_ENTRIES = 32
+HEAT_COLUMNS = ["DAYS_OF_COVER", "STOCKOUT_PROB"]
+
+
+class Prefetcher:
+    """Shared pool plus an LRU of Futures keyed by (page, data signature)."""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._futures = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="carestock-prefetch")
+
+    def submit(self, key, fn, *args):
+        """Start `fn(*args)` unless `key` is already running or done."""
+        with self._lock:
+            fut = self._futures.get(key)
+            if fut is None:
+                fut = self._pool.submit(fn, *args)
+                self._futures[key] = fut
+                while len(self._futures) > self.max_entries:
+                    self._futures.popitem(last=False)
+            self._futures.move_to_end(key)
+            return fut
+
+    def get(self, key, fn, *args):
+        """Result for `key`: prefetched, joined, or computed now."""
+        with self._lock:
+            fut = self._futures.get(key)
+        if fut is not None:
+            try:
+                return fut.result()
+            except Exception:
+                # A failed prefetch must not break the page; retry inline
+                with self._lock:
+                    if self._futures.get(key) is fut:
+                        del self._futures[key]
+        return fn(*args)
+
+    def ready(self, key) -> bool:
+        with self._lock:
+            fut = self._futures.get(key)
+        return fut is not None and fut.done() and fut.exception() is None
+
+
+# =================================================
+# PAGE AGGREGATES
+# =================================================
+def dashboard_aggregates(df) -> dict:
+    status = df["STOCK_STATUS"].value_counts()
+    risk_mask = at_risk_mask(df)
+    return {
+        "critical": int(status.get("Critical", 0)),
+        "warning": int(status.get("Warning", 0)),
+        "healthy": int(status.get("Healthy", 0)),
+        "overstock": int(df["OVERSTOCK_RISK"].sum()),
+        "risk_mask": risk_mask,
+        "life_saving_mask": at_risk_mask(df, life_saving_only=True),
+        "priority_csv": with_display_columns(df[risk_mask]).to_csv(index=False)
+    }
+
+
+def analytics_aggregates(df, hierarchy) -> dict:
+    """A built cube plus the default ("top") heat grids for both metrics."""
+    cube = AggregateCube(hierarchy)
+    cube.refresh(df)
+    return {
+        "cube": cube,
+        "heat": {col: heat_grid(df, col, mode="top") for col in HEAT_COLUMNS if col in df.columns}
+    }
+
+
+def impact_aggregates(df, lots, simulate_lots: bool = False, horizon_days: int = 90) -> dict:
+    """
+    FEFO expiry per series. Without a lot table, demo mode simulates lots
+    from current stock; otherwise the result is empty.
+    """
+    simulated = lots is None and simulate_lots
+    if simulated:
+        lots = synthetic_lots(df, seed=0)
+    if lots is None or not len(lots):
+        return {"expiry": None, "simulated": simulated}
+    return {
+        "expiry": expiry_by_series(fefo_projection(lots, df, horizon_days=horizon_days)),
+        "simulated": simulated
+    }
+
+
+def adopt_cube(prefetched: dict) -> AggregateCube:
+    """Private copy of a prefetched cube for a session that will refresh it."""
+    return copy.deepcopy(prefetched["cube"])
+
+
+def prefetch_pages(prefetcher: Prefetcher, signature, df, hierarchy=None, lots=None,
+                   simulate_lots: bool = False):
+    """Queue every page's aggregates for `signature` (data version + filters)."""
+    prefetcher.submit(("Dashboard", *signature), dashboard_aggregates, df)
+    prefetcher.submit(("Analytics", *signature), analytics_aggregates, df, hierarchy)
+    prefetcher.submit(("Impact", *signature), impact_aggregates, df, lots, simulate_lots)
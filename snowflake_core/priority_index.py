@@ -0,0 +1,94 @@
+# priority_index.py
+"""
+Risk-priority index: "what to act on first".
+
+Rows are kept in a sorted list ordered by descending RISK_SCORE, so:
+- top(k)            O(k)
+- update / discard  O(log n) search + one list memmove
+- build             one vectorized sort
+
+The Action Center patches single rows after each action instead of
+re-sorting the whole frame.
+"""
+
+import heapq
+from bisect import bisect_left, insort
+
+import numpy as np
+
+
+class RiskPriorityIndex:
+    """Sorted index of row labels by descending risk score."""
+
+    def __init__(self):
+        self._entries = []      # (-score, label) ascending == score descending
+        self._by_label = {}     # label -> entry
+
+    @classmethod
+    def from_frame(cls, df, mask=None, score_col="RISK_SCORE"):
+        index = cls()
+        positions = np.arange(len(df)) if mask is None else np.flatnonzero(mask)
+        labels = df.index[positions].tolist()
+        scores = df[score_col].to_numpy(dtype="float64")[positions]
+
+        # The vectorized pre-sort leaves only ties for sorted() to fix, so the
+        # tuple sort is a near-linear timsort pass; exact tuple order is what
+        # bisect relies on in update() / discard()
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        order = np.argsort(-scores, kind="stable")
+        index._entries = sorted((-float(scores[i]), labels[i]) for i in order)
+        index._by_label = {entry[1]: entry for entry in index._entries}
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, label):
+        return label in self._by_label
+
+    def score(self, label):
+        entry = self._by_label.get(label)
+        return None if entry is None else -entry[0]
+
+    def discard(self, label):
+        entry = self._by_label.pop(label, None)
+        if entry is not None:
+            pos = bisect_left(self._entries, entry)
+            del self._entries[pos]
+
+    def update(self, label, score):
+        """Insert `label` or move it to its new score."""
+        self.discard(label)
+        score = -np.inf if score is None or np.isnan(score) else float(score)
+        entry = (-score, label)
+        insort(self._entries, entry)
+        self._by_label[label] = entry
+
+    def top(self, k, allowed=None):
+        """
+        Labels of the k highest-risk rows.
+
+        allowed: optional set of labels (or a boolean Series over labels)
+        to skip rows, such as those not matching a search.
+        """
+        if allowed is None:
+            return [label for _, label in self._entries[:k]]
+
+        if not isinstance(allowed, (set, frozenset)):
+            allowed = set(allowed.index[allowed.to_numpy(dtype=bool)].tolist())
+        if not allowed or k <= 0:
+            return []
+
+        # A selective search ranks only its own matches; a broad one scans
+        # from the top and stops after about k * n / m entries
+        if len(allowed) ** 2 < k * len(self._entries):
+            entries = [self._by_label[label] for label in allowed if label in self._by_label]
+            return [label for _, label in heapq.nsmallest(k, entries)]
+
+        out = []
+        for _, label in self._entries:
+            if label in allowed:
+                out.append(label)
+                if len(out) == k:
+                    break
+        return out
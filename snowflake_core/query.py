@@ -0,0 +1,125 @@
+# query.py
+"""
+Core query layer over the enriched stock frame.
+
+Pages ask this module for *which rows* to show (filtered, ranked,
+paged) and only the resulting slice is turned into display columns and
+sent to the browser.
+
+Ranking uses np.argpartition, so top-K and the first pages cost O(n)
+rather than a full sort of every matching row.
+"""
+
+import numpy as np
+import pandas as pd
+
+from status import status_case_sql
+
+
+AT_RISK_STATUSES = ["Critical", "Warning"]
+
+STOCK_HEALTH_SQL = """
+    SELECT
+        LOCATION,
+        ITEM,
+        CLOSING_STOCK,
+        AVG_DAILY_DEMAND,
+        DAYS_TO_STOCKOUT,
+        STOCK_STATUS,
+        LEAD_TIME_DAYS
+    FROM STOCK_HEALTH_DT
+"""
+
+
+def stock_health_sql(policy=None) -> str:
+    """
+    STOCK_HEALTH_SQL under a status policy. A non-default policy is pushed
+    down: STOCK_STATUS is recomputed in the query from the same columns
+    the dynamic table's CASE uses.
+    """
+    if policy is None or policy.is_default:
+        return STOCK_HEALTH_SQL
+    status = status_case_sql("CLOSING_STOCK / NULLIF(AVG_DAILY_DEMAND, 0)", "ITEM", policy)
+    return f"""
+    SELECT
+        LOCATION,
+        ITEM,
+        CLOSING_STOCK,
+        AVG_DAILY_DEMAND,
+        DAYS_TO_STOCKOUT,
+        {status} AS STOCK_STATUS,
+        LEAD_TIME_DAYS
+    FROM STOCK_HEALTH_DT
+"""
+
+
+def at_risk_mask(df: pd.DataFrame, life_saving_only: bool = False) -> np.ndarray:
+    mask = df["STOCK_STATUS"].isin(AT_RISK_STATUSES).to_numpy()
+    if life_saving_only:
+        mask = mask & df["IS_LIFE_SAVING"].to_numpy()
+    return mask
+
+
+def search_mask(df: pd.DataFrame, text: str, columns=("LOCATION", "ITEM")) -> np.ndarray:
+    """Case-insensitive substring match on any of `columns`."""
+    text = (text or "").strip().lower()
+    if not text:
+        return np.ones(len(df), dtype=bool)
+
+    mask = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Match each distinct label once, then broadcast through codes
+            hits = np.array(
+                [text in str(c).lower() for c in values.cat.categories] + [False]
+            )
+            mask |= hits[values.cat.codes.to_numpy()]
+        else:
+            mask |= values.astype(str).str.lower().str.contains(text, regex=False).to_numpy()
+    return mask
+
+
+def ranked_positions(df: pd.DataFrame, mask=None, sort_by: str = "RISK_SCORE",
+                     ascending: bool = False, limit: int = None) -> np.ndarray:
+    """
+    Row positions matching `mask`, ordered by `sort_by`.
+
+    With `limit`, only the first `limit` positions are ordered.
+    """
+    positions = np.arange(len(df)) if mask is None else np.flatnonzero(mask)
+    if positions.size == 0:
+        return positions
+
+    keys = df[sort_by].to_numpy(dtype="float64")[positions]
+    if not ascending:
+        keys = -keys
+    keys = np.where(np.isnan(keys), np.inf, keys)
+
+    if limit is not None and limit < positions.size:
+        part = np.argpartition(keys, limit - 1)[:limit]
+        order = part[np.argsort(keys[part], kind="stable")]
+    else:
+        order = np.argsort(keys, kind="stable")
+
+    return positions[order]
+
+
+def top_k(df: pd.DataFrame, k: int, mask=None, sort_by: str = "RISK_SCORE",
+          ascending: bool = False) -> pd.DataFrame:
+    return df.iloc[ranked_positions(df, mask, sort_by, ascending, limit=k)]
+
+
+def page_of(df: pd.DataFrame, page: int, page_size: int, mask=None,
+            sort_by: str = "RISK_SCORE", ascending: bool = False):
+    """
+    One page of ranked rows.
+
+    Returns (page_frame, total_matching_rows). `page` is 1-based.
+    """
+    total = int(len(df) if mask is None else np.count_nonzero(mask))
+    page = max(1, int(page))
+    start = (page - 1) * page_size
+
+    positions = ranked_positions(df, mask, sort_by, ascending, limit=start + page_size)
+    return df.iloc[positions[start:start + page_size]], total
@@ -0,0 +1,223 @@
+# redistribution.py
+"""
+Redistribution optimizer: inter-facility transfer suggestions.
+
+Matches surplus to shortage per item across every location in one call:
+
+- shortage: at-risk rows (Critical / Warning or at/below reorder point)
+  need REORDER_POINT - CLOSING_STOCK units
+- surplus: overstocked rows (DAYS_OF_COVER > 90) can give what they hold
+  above max(REORDER_POINT, 90 days of cover), so a donor never becomes
+  overstock-free *and* short at the same time
+
+Without distances every transfer costs the same, so any full matching is
+optimal; the solver lays shortages (riskiest first) and surpluses
+(largest first) on one cumulative axis per item and intersects the
+intervals — fully vectorized, no per-item Python loop.
+
+With travel distances each shortage keeps its `max_donors` nearest
+donors and the whole network is solved as one sparse LP (min distance,
+weighted by shortage priority) with SciPy (listed in requirements.txt).
+Without SciPy a greedy pass over the pruned candidate pairs is used:
+riskiest shortage first, nearest donor first — feasible, but not
+guaranteed minimum-distance.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pipeline import OVERSTOCK_COVER_DAYS
+from query import AT_RISK_STATUSES
+
+try:
+    from scipy.optimize import linprog
+    from scipy.sparse import coo_matrix, vstack
+except Exception:
+    linprog = None
+
+
+TRANSFER_COLUMNS = ["ITEM", "FROM_LOCATION", "TO_LOCATION", "QUANTITY", "DISTANCE_KM", "TO_ROW"]
+
+
+def shortages(df: pd.DataFrame) -> pd.DataFrame:
+    stock = df["CLOSING_STOCK"].to_numpy(dtype="float64")
+    rop = df["REORDER_POINT"].to_numpy(dtype="float64")
+    at_risk = df["STOCK_STATUS"].isin(AT_RISK_STATUSES).to_numpy() | (stock <= rop)
+
+    need = np.ceil(np.clip(rop - stock, 0, None))
+    mask = at_risk & (need > 0)
+    out = pd.DataFrame({
+        "ROW": df.index[mask],
+        "ITEM": df["ITEM"].astype(str).to_numpy()[mask],
+        "LOCATION": df["LOCATION"].astype(str).to_numpy()[mask],
+        "NEED": need[mask],
+        "PRIORITY": df["RISK_SCORE"].to_numpy(dtype="float64")[mask]
+    })
+    return out
+
+
+def surpluses(df: pd.DataFrame) -> pd.DataFrame:
+    stock = df["CLOSING_STOCK"].to_numpy(dtype="float64")
+    lead = np.clip(df["LEAD_TIME_DAYS"].to_numpy(dtype="float64"), 1, None)
+    keep = np.maximum(df["REORDER_POINT"].to_numpy(dtype="float64"), OVERSTOCK_COVER_DAYS * lead)
+
+    give = np.floor(np.clip(stock - keep, 0, None))
+    mask = df["OVERSTOCK_RISK"].to_numpy(dtype=bool) & (give > 0)
+    return pd.DataFrame({
+        "ITEM": df["ITEM"].astype(str).to_numpy()[mask],
+        "LOCATION": df["LOCATION"].astype(str).to_numpy()[mask],
+        "SURPLUS": give[mask]
+    })
+
+
+def _empty():
+    return pd.DataFrame(columns=TRANSFER_COLUMNS)
+
+
+# =================================================
+# UNIFORM COST: vectorized interval matching
+# =================================================
+def _match_uniform(need: pd.DataFrame, give: pd.DataFrame) -> pd.DataFrame:
+    items = pd.Index(sorted(set(need["ITEM"]) & set(give["ITEM"])))
+    need = need[need["ITEM"].isin(items)].copy()
+    give = give[give["ITEM"].isin(items)].copy()
+    if need.empty or give.empty:
+        return _empty()
+
+    need["CODE"] = items.get_indexer(need["ITEM"])
+    give["CODE"] = items.get_indexer(give["ITEM"])
+    need = need.sort_values(["CODE", "PRIORITY"], ascending=[True, False], kind="stable")
+    give = give.sort_values(["CODE", "SURPLUS"], ascending=[True, False], kind="stable")
+
+    # Lay every item on its own stretch of one global axis
+    total_need = np.bincount(need["CODE"], weights=need["NEED"], minlength=len(items))
+    total_give = np.bincount(give["CODE"], weights=give["SURPLUS"], minlength=len(items))
+    span = np.maximum(total_need, total_give)
+    offset = np.concatenate([[0.0], np.cumsum(span)[:-1]])
+    matched_end = offset + np.minimum(total_need, total_give)
+
+    need_end = offset[need["CODE"]] + need.groupby("CODE")["NEED"].cumsum().to_numpy()
+    give_end = offset[give["CODE"]] + give.groupby("CODE")["SURPLUS"].cumsum().to_numpy()
+
+    cuts = np.unique(np.concatenate([offset, need_end, give_end, matched_end]))
+    seg_start, seg_end = cuts[:-1], cuts[1:]
+
+    n_idx = np.searchsorted(need_end, seg_start, side="right")
+    g_idx = np.searchsorted(give_end, seg_start, side="right")
+    ok = (n_idx < len(need)) & (g_idx < len(give))
+    n_idx, g_idx = n_idx[ok], g_idx[ok]
+    seg_start, seg_end = seg_start[ok], seg_end[ok]
+
+    n_code = need["CODE"].to_numpy()[n_idx]
+    g_code = give["CODE"].to_numpy()[g_idx]
+    ok = (n_code == g_code) & (seg_start < matched_end[n_code])
+    if not ok.any():
+        return _empty()
+
+    return pd.DataFrame({
+        "ITEM": need["ITEM"].to_numpy()[n_idx[ok]],
+        "FROM_LOCATION": give["LOCATION"].to_numpy()[g_idx[ok]],
+        "TO_LOCATION": need["LOCATION"].to_numpy()[n_idx[ok]],
+        "QUANTITY": (seg_end[ok] - seg_start[ok]).round().astype("int64"),
+        "DISTANCE_KM": np.nan,
+        "TO_ROW": need["ROW"].to_numpy()[n_idx[ok]]
+    })
+
+
+# =================================================
+# DISTANCE COSTS: pruned candidates, one LP
+# =================================================
+def _candidates(need, give, distances, max_donors, default_distance):
+    need = need.reset_index(drop=True).rename_axis("N").reset_index()
+    give = give.reset_index(drop=True).rename_axis("G").reset_index()
+
+    pairs = need[["N", "ITEM", "LOCATION"]].merge(
+        give[["G", "ITEM", "LOCATION"]], on="ITEM", suffixes=("_TO", "_FROM")
+    )
+    pairs = pairs[pairs["LOCATION_TO"] != pairs["LOCATION_FROM"]]
+
+    dist = distances.rename(columns={"FROM_LOCATION": "LOCATION_FROM", "TO_LOCATION": "LOCATION_TO"})
+    pairs = pairs.merge(dist[["LOCATION_FROM", "LOCATION_TO", "DISTANCE_KM"]],
+                        on=["LOCATION_FROM", "LOCATION_TO"], how="left")
+    if default_distance is None:
+        pairs = pairs[pairs["DISTANCE_KM"].notna()]
+    else:
+        pairs["DISTANCE_KM"] = pairs["DISTANCE_KM"].fillna(default_distance)
+
+    pairs = pairs.sort_values(["N", "DISTANCE_KM"], kind="stable")
+    pairs = pairs[pairs.groupby("N").cumcount() < max_donors]
+    return need, give, pairs.reset_index(drop=True)
+
+
+def _solve_lp(need, give, pairs):
+    n_vars = len(pairs)
+    # Fulfilment dominates distance: each unit to a shortage earns a bonus
+    # scaled by its priority, larger than any travel cost
+    bonus = (pairs["DISTANCE_KM"].max() + 1.0) * (1.0 + need["PRIORITY"].to_numpy()[pairs["N"]])
+    cost = pairs["DISTANCE_KM"].to_numpy() - bonus
+
+    cols = np.arange(n_vars)
+    a_need = coo_matrix((np.ones(n_vars), (pairs["N"], cols)), shape=(len(need), n_vars))
+    a_give = coo_matrix((np.ones(n_vars), (pairs["G"], cols)), shape=(len(give), n_vars))
+
+    res = linprog(
+        cost,
+        A_ub=vstack([a_need, a_give]).tocsr(),
+        b_ub=np.concatenate([need["NEED"].to_numpy(), give["SURPLUS"].to_numpy()]),
+        bounds=(0, None),
+        method="highs"
+    )
+    if not res.success:
+        raise RuntimeError(f"transfer LP failed: {res.message}")
+    return np.floor(res.x + 1e-6)
+
+
+def _solve_greedy(need, give, pairs):
+    order = np.lexsort((pairs["DISTANCE_KM"].to_numpy(), -need["PRIORITY"].to_numpy()[pairs["N"]]))
+    remaining_need = need["NEED"].to_numpy().copy()
+    remaining_give = give["SURPLUS"].to_numpy().copy()
+    n_arr = pairs["N"].to_numpy()
+    g_arr = pairs["G"].to_numpy()
+
+    qty = np.zeros(len(pairs))
+    for p in order:
+        n, g = n_arr[p], g_arr[p]
+        q = min(remaining_need[n], remaining_give[g])
+        if q > 0:
+            qty[p] = q
+            remaining_need[n] -= q
+            remaining_give[g] -= q
+    return qty
+
+
+def suggest_transfers(df: pd.DataFrame, distances: pd.DataFrame = None, max_donors: int = 5,
+                      default_distance: float = None) -> pd.DataFrame:
+    """
+    Transfer suggestions for the whole network.
+
+    distances: optional FROM_LOCATION, TO_LOCATION, DISTANCE_KM table.
+    Pairs missing from it are skipped unless default_distance is set.
+    """
+    need = shortages(df)
+    give = surpluses(df)
+    if need.empty or give.empty:
+        return _empty()
+
+    if distances is None:
+        return _match_uniform(need, give)
+
+    need, give, pairs = _candidates(need, give, distances, max_donors, default_distance)
+    if pairs.empty:
+        return _empty()
+
+    qty = _solve_lp(need, give, pairs) if linprog is not None else _solve_greedy(need, give, pairs)
+    used = qty > 0
+    pairs = pairs[used]
+    return pd.DataFrame({
+        "ITEM": pairs["ITEM"].to_numpy(),
+        "FROM_LOCATION": pairs["LOCATION_FROM"].to_numpy(),
+        "TO_LOCATION": pairs["LOCATION_TO"].to_numpy(),
+        "QUANTITY": qty[used].astype("int64"),
+        "DISTANCE_KM": pairs["DISTANCE_KM"].to_numpy(),
+        "TO_ROW": need["ROW"].to_numpy()[pairs["N"]]
+    })
@@ -0,0 +1,113 @@
+# refresh.py
+"""
+Push-style live refresh driven by STOCK_HEALTH_DT's refresh metadata.
+
+One RefreshCoordinator runs per server process. Its daemon thread asks
+Snowflake for the dynamic table's data timestamp (SHOW DYNAMIC TABLES:
+metadata only, no warehouse) every few seconds, whatever the number of
+connected users. When the timestamp moves it bumps `version` and calls
+its listeners (e.g. clearing the shared data cache).
+
+Sessions never query: a small timed fragment compares the version they
+rendered with the coordinator's (an attribute read) and reruns the page
+when it changed, so new data reaches the screen within one poll plus one
+tick instead of a cache TTL plus the user's next click.
+"""
+
+import logging
+import threading
+import time
+
+
+log = logging.getLogger("carestock.refresh")
+
+DEFAULT_POLL_SECONDS = 10
+DEFAULT_TICK_SECONDS = 5
+DYNAMIC_TABLE = "STOCK_HEALTH_DT"
+
+
+def dynamic_table_version(session, name: str = DYNAMIC_TABLE):
+    """Last refresh of a dynamic table, or None if unknown."""
+    rows = session.sql(f"SHOW DYNAMIC TABLES LIKE '{name}'").collect()
+    if rows:
+        meta = rows[0].as_dict()
+        return meta.get("data_timestamp") or meta.get("refreshed_on")
+    return None
+
+
+class RefreshCoordinator:
+    """
+    probe: zero-argument callable returning the current data version.
+    poll_seconds: delay between probes (errors back off up to 8x).
+    """
+
+    def __init__(self, probe, poll_seconds: float = DEFAULT_POLL_SECONDS):
+        self.probe = probe
+        self.poll_seconds = poll_seconds
+        self.version = None
+        self.changed_at = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """callback(old_version, new_version) runs on every change."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def poll_once(self) -> bool:
+        """Probe now; True if the version moved."""
+        version = self.probe()
+        if version is None:
+            return False
+        version = str(version)
+        with self._lock:
+            old = self.version
+            if version == old:
+                return False
+            self.version = version
+            self.changed_at = time.time()
+            # The first version seen is a baseline, not a change
+            listeners = list(self._listeners) if old is not None else []
+            self._changed.notify_all()
+
+        for callback in listeners:
+            try:
+                callback(old, version)
+            except Exception:
+                log.exception("refresh listener failed")
+        return True
+
+    def _run(self):
+        delay = self.poll_seconds
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                delay = self.poll_seconds
+            except Exception:
+                log.warning("version probe failed; retrying", exc_info=True)
+                delay = min(delay * 2, self.poll_seconds * 8)
+            self._stop.wait(delay)
+
+    def start(self):
+        """Probe once synchronously, then keep polling in the background."""
+        if self._thread is not None:
+            return self
+        try:
+            self.poll_once()
+        except Exception:
+            log.warning("initial version probe failed", exc_info=True)
+        self._thread = threading.Thread(target=self._run, name="carestock-refresh", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def wait_for_change(self, seen, timeout: float = None):
+        """Block until `version` differs from `seen`; returns the version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen, timeout=timeout)
+            return self.version
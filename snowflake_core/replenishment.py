@@ -0,0 +1,218 @@
+# replenishment.py
+"""
+Network-wide replenishment plan.
+
+For every row below its reorder point:
+
+    ORDER_QTY = REORDER_POINT + EOQ - CLOSING_STOCK, rounded up to whole packs
+
+Budget caps (per location, or per district via a location -> district
+mapping) are applied with a greedy fill: rows are ranked inside each
+budget group (life-saving first, then risk score) and each row gets the
+whole packs that still fit in what its group has left after the rows
+before it. The fill runs in vectorized rounds across all groups (see
+_fill_budget), with no Python loop over rows or groups.
+
+Plans are written in chunks (CSV or Parquet), so a national plan is
+never rendered into one in-memory string.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pq = None
+
+
+DEFAULT_PACK_SIZE = 1
+DEFAULT_UNIT_COST = 1.0
+DEFAULT_CHUNK_ROWS = 50_000
+
+PLAN_COLUMNS = [
+    "BUDGET_GROUP",
+    "LOCATION",
+    "ITEM",
+    "IS_LIFE_SAVING",
+    "CLOSING_STOCK",
+    "SAFETY_STOCK",
+    "REORDER_POINT",
+    "EOQ",
+    "RISK_SCORE",
+    "PACK_SIZE",
+    "UNIT_COST",
+    "ORDER_QTY",
+    "APPROVED_QTY",
+    "APPROVED_COST"
+]
+
+
+def _per_item(items: pd.Series, mapping, default) -> np.ndarray:
+    if mapping is None:
+        return np.full(len(items), float(default))
+    values = items.astype("object").map(mapping)
+    return pd.to_numeric(values, errors="coerce").fillna(default).to_numpy(dtype="float64")
+
+
+def order_quantities(df: pd.DataFrame, pack_sizes=None, default_pack: int = DEFAULT_PACK_SIZE):
+    """
+    (ORDER_QTY, PACK_SIZE) arrays for an enriched frame.
+
+    Rows at or above their reorder point order nothing.
+    """
+    stock = df["CLOSING_STOCK"].to_numpy(dtype="float64")
+    rop = df["REORDER_POINT"].to_numpy(dtype="float64")
+    eoq = df["EOQ"].to_numpy(dtype="float64")
+
+    pack = np.clip(_per_item(df["ITEM"], pack_sizes, default_pack), 1, None)
+    raw = np.where(stock < rop, np.clip(rop + eoq - stock, 0, None), 0.0)
+    return np.ceil(raw / pack) * pack, pack
+
+
+def apply_budget(plan: pd.DataFrame, budgets=None, default_budget: float = None) -> np.ndarray:
+    """
+    APPROVED_QTY under per-group budget caps.
+
+    `plan` needs BUDGET_GROUP, ORDER_QTY, PACK_SIZE, UNIT_COST,
+    IS_LIFE_SAVING and RISK_SCORE. `budgets` maps group -> cap; groups
+    without a cap use `default_budget` (None = unlimited).
+    """
+    qty = plan["ORDER_QTY"].to_numpy(dtype="float64")
+    if budgets is None and default_budget is None:
+        return qty
+
+    cap = plan["BUDGET_GROUP"].astype("object").map(budgets or {})
+    cap = pd.to_numeric(cap, errors="coerce").to_numpy(dtype="float64")
+    if default_budget is not None:
+        cap = np.where(np.isnan(cap), default_budget, cap)
+    cap = np.where(np.isnan(cap), np.inf, cap)
+
+    # Greedy order inside each group: life-saving, then riskiest
+    groups = pd.factorize(plan["BUDGET_GROUP"])[0]
+    order = np.lexsort((
+        -plan["RISK_SCORE"].to_numpy(dtype="float64"),
+        ~plan["IS_LIFE_SAVING"].to_numpy(dtype=bool),
+        groups
+    ))
+    pack = plan["PACK_SIZE"].to_numpy(dtype="float64")[order]
+    pack_cost = pack * plan["UNIT_COST"].to_numpy(dtype="float64")[order]
+    fitted = _fill_budget(groups[order], qty[order] / pack, pack_cost, cap[order]) * pack
+
+    approved = np.empty_like(qty)
+    approved[order] = fitted
+    return approved
+
+
+def _fill_budget(groups, wanted, pack_cost, cap) -> np.ndarray:
+    """
+    Packs approved per row, rows sorted by group then greedy rank.
+
+    Same result as walking each group's rows in order and giving every
+    row the whole packs that fit in what is left *after the approved
+    cost* of the rows before it. Done in rounds, vectorized across
+    groups: each round approves the longest prefix of every group that
+    fits in full plus a partial fill of the next row, then drops rows
+    whose single pack no longer fits. Each round retires at least one
+    row per group, and usually many.
+    """
+    left = np.zeros(groups.max() + 1 if len(groups) else 0)
+    left[groups] = cap
+    packs = np.zeros(len(wanted))
+    cost = wanted * pack_cost
+
+    active = np.flatnonzero(wanted > 0)
+    while active.size:
+        g = groups[active]
+        c = cost[active]
+        cum = np.cumsum(c)
+        starts = np.r_[True, g[1:] != g[:-1]]
+        # Spent by earlier groups, subtracted to restart the sum per group
+        cum = cum - np.maximum.accumulate(np.where(starts, cum - c, 0.0))
+        before = cum - c
+        room = left[g]
+
+        full = cum <= room * (1 + 1e-12)
+        # Running sums only grow, so `full` is a prefix of each group and
+        # the first row past it is the only one with `before` in budget
+        partial = ~full & (before <= room)
+        packs[active[full]] = wanted[active[full]]
+        packs[active[partial]] = np.floor((room[partial] - before[partial]) / pack_cost[active[partial]])
+
+        done = full | partial
+        spent = np.bincount(g[done], weights=packs[active[done]] * pack_cost[active[done]], minlength=len(left))
+        left = np.clip(left - spent, 0, None)
+
+        rest = active[~done]
+        active = rest[pack_cost[rest] <= left[groups[rest]]]
+    return packs
+
+
+def build_plan(df: pd.DataFrame, pack_sizes=None, unit_costs=None, budgets=None,
+               default_budget: float = None, location_groups=None) -> pd.DataFrame:
+    """
+    Replenishment plan for every row below its reorder point.
+
+    location_groups: optional LOCATION -> DISTRICT mapping; budgets then
+    apply per district instead of per location.
+    """
+    qty, pack = order_quantities(df, pack_sizes)
+    needed = qty > 0
+
+    rows = df.loc[needed, [c for c in PLAN_COLUMNS if c in df.columns]]
+    plan = rows.assign(
+        PACK_SIZE=pack[needed].astype("int32"),
+        UNIT_COST=_per_item(rows["ITEM"], unit_costs, DEFAULT_UNIT_COST).astype("float32"),
+        ORDER_QTY=qty[needed].astype("int64")
+    )
+    location = plan["LOCATION"].astype("object")
+    plan.insert(0, "BUDGET_GROUP", location.map(location_groups).fillna(location) if location_groups else location)
+
+    approved = apply_budget(plan, budgets, default_budget)
+    plan["APPROVED_QTY"] = approved.astype("int64")
+    plan["APPROVED_COST"] = (approved * plan["UNIT_COST"].to_numpy(dtype="float64")).astype("float64")
+
+    return plan.sort_values(
+        ["BUDGET_GROUP", "IS_LIFE_SAVING", "RISK_SCORE"], ascending=[True, False, False], kind="stable"
+    )[PLAN_COLUMNS].reset_index(drop=True)
+
+
+# =================================================
+# CHUNKED WRITERS
+# =================================================
+def iter_chunks(plan: pd.DataFrame, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    for start in range(0, len(plan), chunk_rows):
+        yield plan.iloc[start:start + chunk_rows]
+
+
+def write_csv(plan: pd.DataFrame, path_or_buf, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """Append the plan chunk by chunk; header written once."""
+    own = isinstance(path_or_buf, str)
+    fh = open(path_or_buf, "w", encoding="utf-8", newline="") if own else path_or_buf
+    try:
+        plan.iloc[:0].to_csv(fh, index=False)
+        for chunk in iter_chunks(plan, chunk_rows):
+            chunk.to_csv(fh, index=False, header=False)
+    finally:
+        if own:
+            fh.close()
+
+
+def write_parquet(plan: pd.DataFrame, path, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """One Parquet row group per chunk."""
+    if pq is None:
+        raise ImportError("pyarrow is required for Parquet export")
+
+    writer = None
+    try:
+        for chunk in iter_chunks(plan, chunk_rows):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(plan, preserve_index=False), path)
+    finally:
+        if writer is not None:
+            writer.close()
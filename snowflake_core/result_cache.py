@@ -0,0 +1,232 @@
+# result_cache.py
+"""
+Persistent result cache for loader queries.
+
+st.cache_data only lives in process memory, so a deploy or pod restart
+sends every user to the warehouse at once. This cache keeps query
+results on disk as Arrow IPC (Feather) files so a fresh process can
+serve the last known result immediately.
+
+Behaviour:
+- Entries are keyed by the SQL text; each entry records the table
+  version (e.g. the dynamic table's data timestamp) it was fetched at
+- Same version  -> served from disk, no warehouse query
+- New version   -> stale result served while one background refresh runs
+  (stale-while-revalidate)
+- No entry      -> fetched synchronously; concurrent callers for the same
+  key wait on the single in-flight query (single-flight)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (Feather needs pyarrow; Snowpark ships it)
+    _HAS_ARROW = True
+except Exception:
+    _HAS_ARROW = False
+
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "carestock_cache")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace so formatting changes don't split the cache."""
+    return " ".join(sql.split())
+
+
+def cache_key(sql: str, partition: str = None) -> str:
+    if partition is not None:
+        sql = f"{sql}\n-- partition: {partition}"
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()[:32]
+
+
+class ResultCache:
+    """
+    On-disk result cache with stale-while-revalidate and single-flight.
+
+    fresh_ttl: seconds an entry is trusted when no table version is known
+    max_stale: seconds a stale entry may still be served while refreshing
+    """
+
+    def __init__(
+        self,
+        root: str = DEFAULT_CACHE_DIR,
+        fresh_ttl: int = 300,
+        max_stale: int = 24 * 3600,
+        max_workers: int = 2
+    ):
+        self.root = root
+        self.fresh_ttl = fresh_ttl
+        self.max_stale = max_stale
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="carestock-revalidate"
+        )
+
+    # -------------------------------------------------
+    # Storage
+    # -------------------------------------------------
+    def _paths(self, key):
+        ext = "arrow" if _HAS_ARROW else "pkl"
+        base = os.path.join(self.root, key)
+        return f"{base}.{ext}", f"{base}.json"
+
+    def _read_meta(self, key):
+        _, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except Exception:
+            return None
+
+    def _read_frame(self, key):
+        data_path, _ = self._paths(key)
+        if _HAS_ARROW:
+            return pd.read_feather(data_path)
+        return pd.read_pickle(data_path)
+
+    def _write(self, key, sql, version, frame, partition=None):
+        data_path, meta_path = self._paths(key)
+        tmp_data = f"{data_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_meta = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        frame = frame.reset_index(drop=True)
+        if _HAS_ARROW:
+            frame.to_feather(tmp_data)
+        else:
+            frame.to_pickle(tmp_data)
+
+        with open(tmp_meta, "w", encoding="utf-8") as fh:
+            json.dump({
+                "sql": normalize_sql(sql),
+                "partition": partition,
+                "version": version,
+                "fetched_at": time.time(),
+                "rows": len(frame)
+            }, fh)
+
+        # Data first, then metadata: readers never see metadata pointing
+        # at a half-written file.
+        os.replace(tmp_data, data_path)
+        os.replace(tmp_meta, meta_path)
+
+    # -------------------------------------------------
+    # Single-flight
+    # -------------------------------------------------
+    def _fetch(self, key, sql, version, fetch, partition=None):
+        """Run fetch() once per key; concurrent callers share the Future."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self._inflight[key] = fut
+
+        if not owner:
+            return fut.result()
+
+        try:
+            frame = fetch()
+            try:
+                self._write(key, sql, version, frame, partition)
+            except Exception:
+                # Disk problems must never break the page; serve the result.
+                pass
+            fut.set_result(frame)
+            return frame
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _revalidate(self, key, sql, version, fetch, partition=None):
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def run():
+            try:
+                self._fetch(key, sql, version, fetch, partition)
+            except Exception:
+                # The stale copy stays in place; next call retries.
+                pass
+
+        self._pool.submit(run)
+
+    # -------------------------------------------------
+    # Public API
+    # -------------------------------------------------
+    def get(self, sql: str, fetch, version=None, partition: str = None) -> pd.DataFrame:
+        """
+        Return the result of `sql`, calling fetch() only when needed.
+
+        version: opaque token for the source table state (None = unknown).
+        partition: separates results of the same SQL bound to different
+        parameters (e.g. one entry per tenant).
+        """
+        return self.lookup(sql, fetch, version, partition)[0]
+
+    def lookup(self, sql: str, fetch, version=None, partition: str = None):
+        """
+        Like get(), returning (frame, fresh). fresh is False when a stale
+        entry was served while the refresh runs: callers must not keep
+        it under `version`.
+        """
+        key = cache_key(sql, partition)
+        meta = self._read_meta(key)
+        version = None if version is None else str(version)
+
+        if meta is not None:
+            age = time.time() - meta.get("fetched_at", 0)
+            same_version = version is not None and meta.get("version") == version
+            fresh = same_version or (version is None and age < self.fresh_ttl)
+
+            if fresh or age < self.max_stale:
+                try:
+                    frame = self._read_frame(key)
+                except Exception:
+                    frame = None
+
+                if frame is not None:
+                    if not fresh:
+                        self._revalidate(key, sql, version, fetch, partition)
+                    return frame, fresh
+
+        return self._fetch(key, sql, version, fetch, partition), True
+
+    def version_of(self, sql: str, partition: str = None):
+        """Table version the cached entry for `sql` was fetched at, if any."""
+        meta = self._read_meta(cache_key(sql, partition))
+        return None if meta is None else meta.get("version")
+
+    def invalidate(self, sql: str = None, partition: str = None):
+        """
+        Drop the entry for `sql` in `partition`; with sql None, every entry
+        of the partition, or every entry when both are None.
+        """
+        if sql is not None:
+            keys = [cache_key(sql, partition)]
+        else:
+            keys = {f.split(".")[0] for f in os.listdir(self.root) if not f.endswith(".tmp")}
+            if partition is not None:
+                keys = [k for k in keys if (self._read_meta(k) or {}).get("partition") == partition]
+        for key in keys:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,201 @@
+# snapshot.py
+"""
+Offline snapshot export / import (Arrow IPC).
+
+Remote facilities often run without a Snowflake session. Instead of the
+random demo frame they can load the last synced copy of STOCK_HEALTH_DT
+plus recent DAILY_STOCK history from a snapshot directory:
+
+    <snapshot_dir>/
+        manifest.json        sync time, row counts, history window
+        stock_health.arrow   STOCK_HEALTH_DT rows
+        history.arrow        DAILY_STOCK rows for the last N days
+
+Files are written uncompressed so they can be memory-mapped at startup:
+load time is near zero and untouched pages never count against RSS.
+A snapshot travels between machines as a single zip bundle.
+"""
+
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from tenancy import ALL_TENANT, scoped_sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except Exception:
+    pa = None
+    feather = None
+
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), "carestock_snapshot")
+
+HEALTH_FILE = "stock_health.arrow"
+HISTORY_FILE = "history.arrow"
+MANIFEST_FILE = "manifest.json"
+
+HISTORY_SQL = """
+    SELECT
+        DATE,
+        LOCATION,
+        ITEM,
+        OPENING_STOCK,
+        RECEIVED,
+        ISSUED,
+        CLOSING_STOCK,
+        LEAD_TIME_DAYS
+    FROM DAILY_STOCK
+    WHERE DATE >= DATEADD(day, -{days}, CURRENT_DATE())
+"""
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _require_arrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for offline snapshots")
+
+
+# =================================================
+# EXPORT
+# =================================================
+def write_snapshot(
+    stock_health: pd.DataFrame,
+    history: pd.DataFrame = None,
+    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+    history_days: int = 30
+) -> dict:
+    """Write a snapshot directory and return its manifest."""
+    _require_arrow()
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    frames = {HEALTH_FILE: stock_health}
+    if history is not None:
+        frames[HISTORY_FILE] = history
+    else:
+        _remove(os.path.join(snapshot_dir, HISTORY_FILE))
+
+    for name, frame in frames.items():
+        tmp = os.path.join(snapshot_dir, f".{name}.tmp")
+        feather.write_feather(
+            frame.reset_index(drop=True),
+            tmp,
+            compression="uncompressed"
+        )
+        os.replace(tmp, os.path.join(snapshot_dir, name))
+
+    manifest = {
+        "synced_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "stock_health_rows": len(stock_health),
+        "history_rows": 0 if history is None else len(history),
+        "history_days": history_days
+    }
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh)
+
+    return manifest
+
+
+def export_from_session(session, stock_health_sql: str, history_days: int = 30,
+                        snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, tenant=ALL_TENANT) -> dict:
+    """
+    Pull STOCK_HEALTH_DT and recent DAILY_STOCK from Snowflake into a
+    snapshot, limited in Snowflake to the rows `tenant` may see.
+    """
+    frames = []
+    for sql in (stock_health_sql, HISTORY_SQL.format(days=int(history_days))):
+        scoped, params = scoped_sql(sql, tenant)
+        frames.append(session.sql(scoped, params=params).to_pandas())
+    stock_health, history = frames
+    return write_snapshot(stock_health, history, snapshot_dir, history_days)
+
+
+def bundle_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> bytes:
+    """Zip a snapshot directory for download / transfer."""
+    buf = io.BytesIO()
+    # Stored, not deflated: Arrow files stay mmap-able once extracted
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name in (MANIFEST_FILE, HEALTH_FILE, HISTORY_FILE):
+            path = os.path.join(snapshot_dir, name)
+            if os.path.exists(path):
+                zf.write(path, arcname=name)
+    return buf.getvalue()
+
+
+# =================================================
+# IMPORT
+# =================================================
+def import_bundle(data, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> dict:
+    """Extract a snapshot bundle (bytes or file-like) into snapshot_dir."""
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+
+    allowed = {MANIFEST_FILE, HEALTH_FILE, HISTORY_FILE}
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    with zipfile.ZipFile(data) as zf:
+        names = set(zf.namelist())
+        if MANIFEST_FILE not in names or HEALTH_FILE not in names:
+            raise ValueError("Not a CareStock snapshot bundle")
+        # History from an earlier import must not outlive its bundle
+        _remove(os.path.join(snapshot_dir, HISTORY_FILE))
+        for name in names & allowed:
+            tmp = os.path.join(snapshot_dir, f".{name}.tmp")
+            with zf.open(name) as src, open(tmp, "wb") as dst:
+                dst.write(src.read())
+            os.replace(tmp, os.path.join(snapshot_dir, name))
+
+    return read_manifest(snapshot_dir)
+
+
+def read_manifest(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except Exception:
+        return None
+
+
+def _read_mapped(path: str) -> pd.DataFrame:
+    # memory_map keeps the file out of RSS until pages are touched;
+    # split_blocks lets numeric columns stay zero-copy views over the map
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def load_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, include_history: bool = False):
+    """
+    Memory-map a snapshot.
+
+    Returns (stock_health, history, manifest), or None when no snapshot
+    exists. history is None unless include_history is set.
+    """
+    if pa is None:
+        return None
+
+    manifest = read_manifest(snapshot_dir)
+    health_path = os.path.join(snapshot_dir, HEALTH_FILE)
+    if manifest is None or not os.path.exists(health_path):
+        return None
+
+    stock_health = _read_mapped(health_path)
+
+    history = None
+    history_path = os.path.join(snapshot_dir, HISTORY_FILE)
+    if include_history and os.path.exists(history_path):
+        history = _read_mapped(history_path)
+
+    return stock_health, history, manifest
@@ -0,0 +1,129 @@
+# sparse_pivot.py
+"""
+Sparse LOCATION x ITEM pivot.
+
+Most location x item pairs do not exist: a facility stocks a fraction
+of the catalogue. A dense pivot_table allocates every pair and, once
+filled with 0, shows a missing pair as "zero days of cover". This pivot
+keeps only the cells that have rows, in CSR layout built from the
+categorical codes of the two key columns:
+
+    indptr  (n_rows + 1)  row r's cells are entries indptr[r]:indptr[r+1]
+    indices (nnz)         column code of each cell
+    sums, counts (nnz)    sum and number of non-null values in the cell
+
+so memory is proportional to the real rows. Dense arrays are only built
+for what is drawn: a window of chosen rows and columns, or a bucketed
+grid, and cells without data are NaN, never 0.
+
+Plain numpy; scipy.sparse is not needed for sums, counts and windows.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def key_codes(values: pd.Series):
+    """(codes, labels) for a key column; -1 marks a null key."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy(dtype=np.int64)
+        categories = np.asarray(values.cat.categories, dtype=object)
+        # Drop unused categories with a bincount (cheaper than remove_unused_categories)
+        used = np.bincount(codes[codes >= 0], minlength=len(categories)) > 0
+        remap = np.cumsum(used) - 1
+        return np.where(codes >= 0, remap[codes], -1), categories[used]
+    codes, labels = pd.factorize(values)
+    return codes.astype(np.int64), np.asarray(labels, dtype=object)
+
+
+class SparsePivot:
+    def __init__(self, indptr, indices, sums, counts, row_labels, col_labels):
+        self.indptr = indptr
+        self.indices = indices
+        self.sums = sums
+        self.counts = counts
+        self.row_labels = row_labels
+        self.col_labels = col_labels
+
+    @classmethod
+    def from_codes(cls, row_codes, col_codes, values, row_labels, col_labels):
+        """Aggregate rows into cells; rows whose value or key is null do not count."""
+        values = np.asarray(values, dtype="float64")
+        valid = ~np.isnan(values) & (row_codes >= 0) & (col_codes >= 0)
+        n_cols = len(col_labels)
+
+        cell = row_codes[valid] * n_cols + col_codes[valid]
+        cells, inverse = np.unique(cell, return_inverse=True)
+        sums = np.bincount(inverse, weights=values[valid], minlength=len(cells))
+        counts = np.bincount(inverse, minlength=len(cells)).astype(np.int32)
+
+        rows = cells // n_cols
+        indptr = np.zeros(len(row_labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(row_labels)), out=indptr[1:])
+        return cls(indptr, (cells % n_cols).astype(np.int32), sums, counts, row_labels, col_labels)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, value_col: str, row: str = "LOCATION", col: str = "ITEM"):
+        row_codes, row_labels = key_codes(df[row])
+        col_codes, col_labels = key_codes(df[col])
+        return cls.from_codes(row_codes, col_codes, df[value_col].to_numpy(), row_labels, col_labels)
+
+    @property
+    def shape(self):
+        return len(self.row_labels), len(self.col_labels)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.sums.nbytes + self.counts.nbytes
+
+    def entry_rows(self) -> np.ndarray:
+        """Row code of every stored cell (CSR -> COO)."""
+        return np.repeat(np.arange(len(self.row_labels)), np.diff(self.indptr))
+
+    def means(self) -> np.ndarray:
+        return self.sums / self.counts
+
+    def _entries(self, rows: np.ndarray) -> np.ndarray:
+        """Positions of the stored cells of `rows`, row by row."""
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        return np.arange(lengths.sum()) + offsets
+
+    def window(self, rows, cols) -> pd.DataFrame:
+        """Dense means for the given row and column positions; NaN = no data."""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+
+        col_pos = np.full(len(self.col_labels), -1, dtype=np.int64)
+        col_pos[cols] = np.arange(len(cols))
+
+        entries = self._entries(rows)
+        row_pos = np.repeat(np.arange(len(rows)), np.diff(self.indptr)[rows])
+        target = col_pos[self.indices[entries]]
+        keep = target >= 0
+
+        dense = np.full((len(rows), len(cols)), np.nan)
+        dense[row_pos[keep], target[keep]] = self.sums[entries[keep]] / self.counts[entries[keep]]
+        return pd.DataFrame(
+            dense,
+            index=pd.Index(self.row_labels[rows]),
+            columns=pd.Index(self.col_labels[cols])
+        )
+
+    def bucketed(self, row_of: np.ndarray, col_of: np.ndarray, n_row_buckets: int, n_col_buckets: int):
+        """
+        Dense (n_row_buckets x n_col_buckets) means where row r falls in
+        bucket row_of[r] and column c in col_of[c]; NaN = no data.
+        """
+        bucket = row_of[self.entry_rows()] * n_col_buckets + col_of[self.indices]
+        size = n_row_buckets * n_col_buckets
+        sums = np.bincount(bucket, weights=self.sums, minlength=size)
+        counts = np.bincount(bucket, weights=self.counts, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return means.reshape(n_row_buckets, n_col_buckets)
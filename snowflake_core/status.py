@@ -0,0 +1,221 @@
+# status.py
+"""
+Stock status classification shared by SQL, the pipeline and the app.
+
+    Critical   days of stock < critical_days   (default 3)
+    Warning    days of stock < warning_days    (default 7)
+    Healthy    otherwise, including unknown demand
+
+Days of stock are CLOSING_STOCK / AVG_DAILY_DEMAND, with zero demand
+treated as unknown, exactly as the STOCK_HEALTH_DT CASE does
+(CLOSING_STOCK / NULLIF(AVG(ISSUED), 0)).
+
+Thresholds can differ per item class (e.g. tighter margins for
+life-saving items). A StatusPolicy holds the default thresholds plus
+per-class overrides and is applied two ways:
+
+- classify(): one array operation over any number of rows
+- status_case_sql(): the equivalent SQL CASE, so the same rule can be
+  pushed down to Snowflake or the local engine
+
+A policy file (CARESTOCK_STATUS_POLICY) looks like:
+
+    {"critical_days": 3, "warning_days": 7,
+     "classes": {"life_saving": {"critical_days": 5, "warning_days": 10,
+                                 "items": ["Insulin", "Oxygen"]}}}
+
+`python status.py [policy.json]` prints the CASE for redefining
+STOCK_HEALTH_DT with that policy.
+"""
+
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+
+STATUS_LEVELS = ["Critical", "Warning", "Healthy"]
+STATUS_DTYPE = pd.CategoricalDtype(STATUS_LEVELS)
+
+CRITICAL_DAYS = 3
+WARNING_DAYS = 7
+
+# Codes into STATUS_LEVELS
+CRITICAL, WARNING, HEALTHY = 0, 1, 2
+
+
+@dataclass(frozen=True)
+class StatusThresholds:
+    critical_days: float = CRITICAL_DAYS
+    warning_days: float = WARNING_DAYS
+
+    def __post_init__(self):
+        if not self.critical_days <= self.warning_days:
+            raise ValueError("critical_days must not exceed warning_days")
+
+
+@dataclass(frozen=True)
+class StatusPolicy:
+    """
+    default: thresholds for items without a class.
+    classes: class name -> (StatusThresholds, frozenset of items).
+    """
+    default: StatusThresholds = StatusThresholds()
+    classes: dict = field(default_factory=dict)
+
+    def __hash__(self):
+        return hash((self.default, tuple(sorted((k, v[0], tuple(sorted(v[1]))) for k, v in self.classes.items()))))
+
+    @property
+    def is_default(self) -> bool:
+        return self.default == StatusThresholds() and not self.classes
+
+    @classmethod
+    def from_dict(cls, spec: dict):
+        default = StatusThresholds(
+            spec.get("critical_days", CRITICAL_DAYS), spec.get("warning_days", WARNING_DAYS)
+        )
+        classes = {}
+        for name, c in (spec.get("classes") or {}).items():
+            classes[name] = (
+                StatusThresholds(
+                    c.get("critical_days", default.critical_days), c.get("warning_days", default.warning_days)
+                ),
+                frozenset(str(i) for i in c.get("items", []))
+            )
+        return cls(default, classes)
+
+
+DEFAULT_POLICY = StatusPolicy()
+
+
+def load_policy(path: str = None) -> StatusPolicy:
+    """Policy from a JSON file (default: CARESTOCK_STATUS_POLICY); DEFAULT_POLICY without one."""
+    path = path or os.getenv("CARESTOCK_STATUS_POLICY")
+    if not path or not os.path.exists(path):
+        return DEFAULT_POLICY
+    with open(path, "r", encoding="utf-8") as fh:
+        return StatusPolicy.from_dict(json.load(fh))
+
+
+# =================================================
+# VECTORIZED CLASSIFICATION
+# =================================================
+def days_of_stock(closing_stock, avg_daily_demand) -> np.ndarray:
+    """CLOSING_STOCK / AVG_DAILY_DEMAND; NaN where demand is zero or missing."""
+    stock = np.asarray(closing_stock, dtype="float64")
+    demand = np.asarray(avg_daily_demand, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return stock / np.where(demand == 0, np.nan, demand)
+
+
+def _row_thresholds(items, policy: StatusPolicy):
+    """Per-row (critical, warning) threshold arrays, or scalars without classes."""
+    if not policy.classes or items is None:
+        return policy.default.critical_days, policy.default.warning_days
+
+    names = [None] + list(policy.classes)
+    critical = np.array([policy.default.critical_days] + [policy.classes[c][0].critical_days for c in names[1:]])
+    warning = np.array([policy.default.warning_days] + [policy.classes[c][0].warning_days for c in names[1:]])
+    lookup = {item: i for i, c in enumerate(names[1:], start=1) for item in policy.classes[c][1]}
+
+    items = pd.Series(items) if not isinstance(items, pd.Series) else items
+    if isinstance(items.dtype, pd.CategoricalDtype):
+        # One lookup per distinct item, broadcast through the codes
+        per_category = np.array([lookup.get(str(c), 0) for c in items.cat.categories] + [0])
+        class_idx = per_category[items.cat.codes.to_numpy()]
+    else:
+        class_idx = items.astype(str).map(lookup).fillna(0).to_numpy(dtype="int64")
+    return critical[class_idx], warning[class_idx]
+
+
+def classify_codes(days, items=None, policy: StatusPolicy = None) -> np.ndarray:
+    """int8 codes into STATUS_LEVELS for each row's days of stock."""
+    policy = policy or DEFAULT_POLICY
+    days = np.asarray(days, dtype="float64")
+    critical, warning = _row_thresholds(items, policy)
+    # NaN compares False: unknown demand is Healthy, like the SQL ELSE
+    with np.errstate(invalid="ignore"):
+        return np.where(days < critical, CRITICAL, np.where(days < warning, WARNING, HEALTHY)).astype("int8")
+
+
+def classify(days, items=None, policy: StatusPolicy = None) -> pd.Categorical:
+    """STOCK_STATUS (STATUS_DTYPE) for each row's days of stock."""
+    return pd.Categorical.from_codes(classify_codes(days, items, policy), dtype=STATUS_DTYPE)
+
+
+def reclassify(df: pd.DataFrame, index=None, policy: StatusPolicy = None) -> pd.DataFrame:
+    """
+    Recompute DAYS_TO_STOCKOUT and STOCK_STATUS in place from
+    CLOSING_STOCK and AVG_DAILY_DEMAND, for the rows labelled `index`
+    (every row when None).
+    """
+    rows = df if index is None else df.loc[index]
+    days = days_of_stock(rows["CLOSING_STOCK"], rows["AVG_DAILY_DEMAND"])
+    status = classify(days, rows["ITEM"] if "ITEM" in rows.columns else None, policy)
+    days = np.round(days, 1)
+
+    if "DAYS_TO_STOCKOUT" in df.columns:
+        days = days.astype(df["DAYS_TO_STOCKOUT"].dtype)
+    if index is None:
+        df["DAYS_TO_STOCKOUT"] = days
+        if "STOCK_STATUS" not in df.columns or isinstance(df["STOCK_STATUS"].dtype, pd.CategoricalDtype):
+            df["STOCK_STATUS"] = status
+        else:
+            df["STOCK_STATUS"] = np.asarray(status, dtype=object)
+    else:
+        df.loc[index, "DAYS_TO_STOCKOUT"] = days
+        df.loc[index, "STOCK_STATUS"] = np.asarray(status, dtype=object)
+    return df
+
+
+# =================================================
+# SQL PUSHDOWN
+# =================================================
+def _sql_literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_number(value) -> str:
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _case_lines(cover_expr: str, t: StatusThresholds, indent: str) -> list:
+    return [
+        f"{indent}WHEN {cover_expr} < {_sql_number(t.critical_days)} THEN 'Critical'",
+        f"{indent}WHEN {cover_expr} < {_sql_number(t.warning_days)} THEN 'Warning'",
+    ]
+
+
+def status_case_sql(cover_expr: str, item_expr: str = "ITEM", policy: StatusPolicy = None,
+                    indent: str = "        ") -> str:
+    """
+    SQL CASE returning STOCK_STATUS for `cover_expr` (days of stock, NULL
+    when unknown) under `policy`.
+    """
+    policy = policy or DEFAULT_POLICY
+    inner = indent + "    "
+    lines = ["CASE"]
+    for name, (t, items) in policy.classes.items():
+        if not items:
+            continue
+        members = ", ".join(_sql_literal(i) for i in sorted(items))
+        lines.append(f"{inner}WHEN {item_expr} IN ({members}) THEN CASE")
+        lines += _case_lines(cover_expr, t, inner + "    ")
+        lines.append(f"{inner}    ELSE 'Healthy'")
+        lines.append(f"{inner}END")
+    lines += _case_lines(cover_expr, policy.default, inner)
+    lines.append(f"{inner}ELSE 'Healthy'")
+    lines.append(f"{indent}END")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(status_case_sql(
+        "MAX(CLOSING_STOCK) / NULLIF(AVG(ISSUED), 0)",
+        policy=load_policy(sys.argv[1] if len(sys.argv) > 1 else None),
+        indent="    "
+    ) + " AS STOCK_STATUS")
@@ -5,6 +5,47 @@ import plotly.express as px
 from datetime import datetime
 import numpy as np
 import json
+import os
+import tempfile
+
+from connection import session_from_env
+from result_cache import DEFAULT_CACHE_DIR, ResultCache
+from snapshot import (
+    DEFAULT_SNAPSHOT_DIR,
+    bundle_snapshot,
+    export_from_session,
+    import_bundle,
+    load_snapshot
+)
+from pipeline import enrich_stock_frame, risk_score
+from priority_index import RiskPriorityIndex
+from alerts import DEFAULT_OUTBOX_DIR, FileSender, Subscription
+from subscriptions import DEFAULT_SQLITE_PATH, open_subscription_store
+from alert_runner import load_frame as load_alert_frame, run_once as run_alert_scan
+from transitions import open_transition_store
+from history import DEFAULT_HISTORY_DIR, HistoryStore
+from query import at_risk_mask, stock_health_sql
+from redistribution import suggest_transfers
+from replenishment import build_plan, write_csv, write_parquet
+from simulation import stockout_probability, with_stockout_probability
+from lots import DEFAULT_LOTS_PATH, load_lots
+from impact import open_impact_store, refresh_impact, summary as impact_summary
+from hierarchy import LEVEL_LABELS, load_hierarchy
+from figures import DEFAULT_CELL_BUDGET, FigureCache, heat_grid
+from refresh import DEFAULT_POLL_SECONDS, DEFAULT_TICK_SECONDS, RefreshCoordinator, dynamic_table_version
+from tenancy import ALL_TENANT, TenantCache, load_directory, resolve_tenant, scope_frame, scoped_sql
+from bulk_upload import UPLOAD_TYPES, copy_into_daily_stock, load_into_engine, validate_file
+from local_engine import open_local_engine
+from status import load_policy, reclassify
+from prefetch import (
+    Prefetcher,
+    adopt_cube,
+    analytics_aggregates,
+    dashboard_aggregates,
+    impact_aggregates,
+    prefetch_pages
+)
+from components import paginated_table, searchable_item_picker
 
 
 # -------------------------------------------------
@@ -22,37 +63,6 @@ def sf_float(x):
     except Exception:
         return None
  
-# =================================================
-# INVENTORY OPTIMIZATION (EOQ + SAFETY STOCK)
-# =================================================
-
-def calculate_eoq(avg_daily_demand, ordering_cost=500, holding_cost=50):
-    """
-    EOQ calculation
-    ordering_cost: cost per order (INR)
-    holding_cost: annual holding cost per unit (INR)
-    """
-    annual_demand = avg_daily_demand * 365
-    if annual_demand <= 0:
-        return 0
-    return round(np.sqrt((2 * annual_demand * ordering_cost) / holding_cost), 1)
-
-
-def calculate_safety_stock(avg_daily_demand, lead_time_days, service_level=1.65):
-    """
-    Safety stock calculation
-    service_level = 1.65 ≈ 95% service level
-    """
-    demand_std = avg_daily_demand * 0.3  # assume 30% variability
-    return round(service_level * demand_std * np.sqrt(lead_time_days), 1)
-
-
-def calculate_reorder_point(avg_daily_demand, lead_time_days, safety_stock):
-    """
-    Reorder Point (ROP)
-    """
-    return round((avg_daily_demand * lead_time_days) + safety_stock, 1)
-
 # =================================================
 # PAGE CONFIG
 # =================================================
@@ -80,32 +90,10 @@ def get_session():
         return get_active_session()
     except Exception:
         # Attempt to build a session from environment variables (for local dev)
-        import os
         try:
-            from snowflake.snowpark.session import Session
-        except Exception:
-            Session = None
-
-        cfg = {}
-        for k, env in {
-            "account": "SNOWFLAKE_ACCOUNT",
-            "user": "SNOWFLAKE_USER",
-            "password": "SNOWFLAKE_PASSWORD",
-            "role": "SNOWFLAKE_ROLE",
-            "warehouse": "SNOWFLAKE_WAREHOUSE",
-            "database": "SNOWFLAKE_DATABASE",
-            "schema": "SNOWFLAKE_SCHEMA",
-            "private_key": "SNOWFLAKE_PRIVATE_KEY"
-        }.items():
-            v = os.getenv(env)
-            if v:
-                cfg[k] = v
-
-        if cfg and Session is not None:
-            try:
-                return Session.builder.configs(cfg).create()
-            except Exception as e:
-                st.warning(f"Failed to create Snowflake Session from env vars: {e}")
+            return session_from_env()
+        except Exception as e:
+            st.warning(f"Failed to create Snowflake Session from env vars: {e}")
 
         # No session available; app should run in local demo mode
         # Removed warning about no Snowflake session found. Running in silent local demo mode.
@@ -113,13 +101,95 @@ def get_session():
 
 session = get_session()
 
+
+@st.cache_resource
+def get_status_policy():
+    # Critical / Warning thresholds, optionally per item class (CARESTOCK_STATUS_POLICY)
+    return load_policy()
+
+
+status_policy = get_status_policy()
+
+
+@st.cache_resource
+def get_local_engine():
+    # Embedded DAILY_STOCK / STOCK_HEALTH_DT for offline work; point
+    # CARESTOCK_LOCAL_DB at a DuckDB or SQLite file (see local_engine.py)
+    path = os.getenv("CARESTOCK_LOCAL_DB")
+    if session is not None or not path:
+        return None
+    # CARESTOCK_LOCAL_VERIFY=1 checks each incremental refresh against a full recompute
+    return open_local_engine(path, verify=os.getenv("CARESTOCK_LOCAL_VERIFY") == "1", policy=status_policy)
+
+
+local_engine = get_local_engine()
+
 # =================================================
 # LOAD DATA (Dynamic Table = AI Brain)
 # =================================================
-@st.cache_data(ttl=300)
-def load_stock_health():
-    # If no Snowflake session is available, return a small demo dataframe for local testing
-    if session is None:
+@st.cache_resource
+def get_result_cache():
+    # Shared by every session in this process; survives restarts on disk
+    return ResultCache(os.getenv("CARESTOCK_CACHE_DIR", DEFAULT_CACHE_DIR))
+
+
+def current_subscriber_id():
+    try:
+        email = st.experimental_user.get("email")
+    except Exception:
+        email = None
+    return email or "local-user"
+
+
+# =================================================
+# TENANT (row scope + cache partition)
+# =================================================
+@st.cache_resource(ttl=600)
+def get_tenant_directory():
+    # TENANTS / TENANT_USERS / TENANT_LOCATIONS, or a local JSON file;
+    # None keeps the deployment single-tenant
+    return load_directory(session, os.getenv("CARESTOCK_TENANTS_PATH"))
+
+
+@st.cache_resource
+def get_tenant_cache():
+    # One LRU partition per tenant, each within its own memory quota
+    return TenantCache(ttl=60)
+
+
+tenant = resolve_tenant(get_tenant_directory(), current_subscriber_id())
+
+
+@st.cache_resource
+def get_refresh_coordinator():
+    # One metadata poll per server process, however many users are connected
+    if session is not None:
+        probe = lambda: dynamic_table_version(session)
+    elif local_engine is not None:
+        # Each poll applies pending DAILY_STOCK changes, like the DT's TARGET_LAG
+        probe = local_engine.refreshed_version
+    else:
+        return None
+    coordinator = RefreshCoordinator(
+        probe,
+        poll_seconds=float(os.getenv("CARESTOCK_REFRESH_POLL_SECONDS", DEFAULT_POLL_SECONDS))
+    )
+    # Entries for older versions can never be hit again
+    coordinator.subscribe(lambda old, new: get_tenant_cache().clear())
+    return coordinator.start()
+
+
+def stock_health_version():
+    """Last refresh of STOCK_HEALTH_DT, as last seen by the refresh coordinator."""
+    coordinator = get_refresh_coordinator()
+    return coordinator.version if coordinator is not None else None
+
+
+def load_stock_health(version=None, tenant=ALL_TENANT):
+    # Cached per tenant partition and keyed by `version`: a new
+    # STOCK_HEALTH_DT refresh is a miss right away instead of after the TTL
+    # If no Snowflake session or local engine is available, return a small demo dataframe for local testing
+    if session is None and local_engine is None:
         demo = pd.DataFrame([
             {
                 "LOCATION": "Central Medical Store",
@@ -149,21 +219,224 @@ def load_stock_health():
                 "LEAD_TIME_DAYS": 5
             }
         ])
-        return demo
-
-    return session.sql("""
-        SELECT
-            LOCATION,
-            ITEM,
-            CLOSING_STOCK,
-            AVG_DAILY_DEMAND,
-            DAYS_TO_STOCKOUT,
-            STOCK_STATUS,
-            LEAD_TIME_DAYS
-        FROM STOCK_HEALTH_DT
-    """).to_pandas()
-
-df = load_stock_health()
+        return scope_frame(demo, tenant)
+
+    if session is None:
+        # Same loader query against the embedded STOCK_HEALTH_DT; the
+        # engine has no TENANT_LOCATIONS, so rows are scoped locally
+        return get_tenant_cache().get(
+            tenant, version, lambda: scope_frame(local_engine.query(stock_health_sql(status_policy)), tenant)
+        )
+
+    # Row scope is applied in Snowflake: only the tenant's rows leave it.
+    # Disk-backed: a restarted process serves the last result instead of
+    # sending every user to the warehouse at once
+    sql, params = scoped_sql(stock_health_sql(status_policy), tenant)
+    served = {}
+
+    def load():
+        frame, served["fresh"] = get_result_cache().lookup(
+            sql,
+            lambda: session.sql(sql, params=params).to_pandas(),
+            version=version,
+            partition=tenant.tenant_id
+        )
+        return frame
+
+    # A stale frame served during revalidation is not `version`'s result
+    return get_tenant_cache().get(tenant, version, load, keep=lambda _: served.get("fresh", True))
+
+
+@st.cache_data(ttl=3600)
+def load_location_distances():
+    # Optional FROM_LOCATION, TO_LOCATION, DISTANCE_KM table; without it
+    # every transfer is treated as equally expensive
+    if session is None:
+        return None
+    try:
+        return session.table("LOCATION_DISTANCES").to_pandas()
+    except Exception:
+        return None
+
+
+@st.cache_data(ttl=3600)
+def load_item_catalog():
+    # Optional ITEM, PACK_SIZE, UNIT_COST table for replenishment plans
+    if session is None:
+        return None
+    try:
+        return session.table("ITEM_CATALOG").to_pandas()
+    except Exception:
+        return None
+
+
+@st.cache_data(ttl=600)
+def load_stock_lots():
+    # STOCK_LOTS in Snowflake, or the local columnar lot file
+    return load_lots(session, os.getenv("CARESTOCK_LOTS_PATH", DEFAULT_LOTS_PATH))
+
+
+PLAN_DIR = os.path.join(tempfile.gettempdir(), "carestock_plans")
+PLAN_MAX_AGE_SECONDS = 24 * 3600
+
+
+def new_plan_path(suffix, previous=None):
+    # One plan file per session: the previous one is removed when a new
+    # plan is built, and files left by ended sessions are swept after a day
+    os.makedirs(PLAN_DIR, exist_ok=True)
+    stale = [previous[0]] if previous else []
+    cutoff = datetime.now().timestamp() - PLAN_MAX_AGE_SECONDS
+    stale += [
+        e.path for e in os.scandir(PLAN_DIR)
+        if e.name.startswith("carestock_plan_") and e.stat().st_mtime < cutoff
+    ]
+    for path in stale:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    fd, path = tempfile.mkstemp(prefix="carestock_plan_", suffix=suffix, dir=PLAN_DIR)
+    os.close(fd)
+    return path
+
+
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache()
+
+
+@st.cache_resource
+def get_prefetcher():
+    # One pool per server process, shared by every session
+    return Prefetcher()
+
+
+@st.cache_data(ttl=3600)
+def load_location_hierarchy():
+    # LOCATION_HIERARCHY table, or a local LOCATION,DISTRICT,STATE csv
+    return load_hierarchy(session, os.getenv("CARESTOCK_HIERARCHY_PATH"))
+
+
+SNAPSHOT_DIR = os.getenv("CARESTOCK_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+
+
+@st.cache_resource
+def load_offline_snapshot():
+    # cache_resource (not cache_data): the memory-mapped frame is shared
+    # across sessions instead of being pickled and copied per rerun
+    try:
+        return load_snapshot(SNAPSHOT_DIR)
+    except Exception:
+        return None
+
+
+offline_snapshot = load_offline_snapshot() if session is None and local_engine is None else None
+
+# Read once per run: the coordinator may move on while the page renders
+live_version = stock_health_version()
+
+if offline_snapshot is not None:
+    df, _, snapshot_manifest = offline_snapshot
+    df = scope_frame(df, tenant)
+else:
+    df = load_stock_health(live_version, tenant)
+    snapshot_manifest = None
+
+# The tenant's rows before sidebar filters and display renames
+tenant_df = df
+
+
+# =================================================
+# STATUS TRANSITION FEED (once per data version)
+# =================================================
+@st.cache_resource
+def get_transition_store():
+    try:
+        return open_transition_store(session, os.getenv("CARESTOCK_SQLITE", DEFAULT_SQLITE_PATH), status_policy)
+    except Exception:
+        return None
+
+
+@st.cache_resource
+def get_impact_store():
+    try:
+        return open_impact_store(session, os.getenv("CARESTOCK_SQLITE", DEFAULT_SQLITE_PATH))
+    except Exception:
+        return None
+
+
+@st.cache_resource
+def published_versions():
+    # Versions this process already diffed; the store's version claim
+    # covers other processes
+    return set()
+
+
+def load_network_frame():
+    """
+    Every tenant's rows. The transition feed, daily history and impact
+    aggregates are network-wide stores: feeding them a tenant's slice
+    would record every other tenant's rows as removed.
+    """
+    if offline_snapshot is not None:
+        return offline_snapshot[0]
+    return load_stock_health(live_version, ALL_TENANT)
+
+
+def publish_transitions(version, load_frame):
+    store = get_transition_store()
+    seen = published_versions()
+    if store is None or version is None or version in seen:
+        return
+    seen.add(version)
+    try:
+        # Loaded only by the session that diffs this version
+        store.refresh(version, load_frame())
+    except Exception:
+        seen.discard(version)
+
+
+if session is not None:
+    # The diff runs in Snowflake over STOCK_HEALTH_DT; no frame is needed
+    publish_transitions(live_version, lambda: None)
+elif local_engine is not None:
+    publish_transitions(live_version, load_network_frame)
+elif snapshot_manifest is not None:
+    publish_transitions(snapshot_manifest["synced_at"], load_network_frame)
+
+
+# =================================================
+# SNAPSHOT HISTORY (daily, delta-encoded)
+# =================================================
+@st.cache_resource
+def get_history_store():
+    try:
+        return HistoryStore(os.getenv("CARESTOCK_HISTORY_DIR", DEFAULT_HISTORY_DIR))
+    except Exception:
+        return None
+
+
+@st.cache_resource
+def recorded_days():
+    return set()
+
+
+def record_daily_history(load_frame):
+    store = get_history_store()
+    today = str(datetime.now().date())
+    if store is None or today in recorded_days():
+        return
+    recorded_days().add(today)
+    try:
+        store.record(load_frame(), today)
+    except Exception:
+        recorded_days().discard(today)
+
+
+# Only real data is worth keeping; demo frames are random. The whole
+# network is recorded; readers scope it per tenant
+if session is not None or local_engine is not None or snapshot_manifest is not None:
+    record_daily_history(load_network_frame)
 
 # Demo data generator (for local testing)
 def generate_demo_data(n=100):
@@ -183,23 +456,18 @@ def generate_demo_data(n=100):
         closing_stock = max(0, int(np.random.poisson(80)))
         avg_daily_demand = max(0.1, round(np.random.exponential(2.5), 2))
         lead_time = random.randint(1, 30)
-        days_to_stockout = round(closing_stock / max(avg_daily_demand, 1), 1)
-        if days_to_stockout <= 5:
-            status = "Critical"
-        elif days_to_stockout <= 15:
-            status = "Warning"
-        else:
-            status = "Healthy"
         rows.append({
             "LOCATION": loc,
             "ITEM": item,
             "CLOSING_STOCK": closing_stock,
             "AVG_DAILY_DEMAND": avg_daily_demand,
-            "DAYS_TO_STOCKOUT": days_to_stockout,
-            "STOCK_STATUS": status,
-            "LEAD_TIME_DAYS": lead_time
+            "DAYS_TO_STOCKOUT": np.nan,
+            "LEAD_TIME_DAYS": lead_time,
+            "STOCK_STATUS": None
         })
-    return pd.DataFrame(rows)
+    demo = pd.DataFrame(rows)
+    # Same days of stock and thresholds as STOCK_HEALTH_DT (status.py)
+    return reclassify(demo, policy=status_policy)
 
 
 def generate_targeted_demo(n=100, pct_at_risk=0.2, pct_life_saving=0.15):
@@ -216,16 +484,14 @@ def generate_targeted_demo(n=100, pct_at_risk=0.2, pct_life_saving=0.15):
             # Reduce closing stock to create a risk
             avg = df_local.at[i, "AVG_DAILY_DEMAND"]
             df_local.at[i, "CLOSING_STOCK"] = max(0, int(max(1, avg) * np.random.uniform(0, 4)))
-            df_local.at[i, "DAYS_TO_STOCKOUT"] = round(df_local.at[i, "CLOSING_STOCK"] / max(df_local.at[i, "AVG_DAILY_DEMAND"], 1), 1)
-            df_local.at[i, "STOCK_STATUS"] = "Critical" if df_local.at[i, "DAYS_TO_STOCKOUT"] <= 5 else "Warning"
 
     if num_life > 0:
         idxs2 = np.random.choice(df_local.index, size=num_life, replace=False)
         for i in idxs2:
             df_local.at[i, "ITEM"] = np.random.choice(life_items)
             df_local.at[i, "CLOSING_STOCK"] = max(0, int(max(1, df_local.at[i, "AVG_DAILY_DEMAND"]) * np.random.uniform(0, 4)))
-            df_local.at[i, "DAYS_TO_STOCKOUT"] = round(df_local.at[i, "CLOSING_STOCK"] / max(df_local.at[i, "AVG_DAILY_DEMAND"], 1), 1)
-            df_local.at[i, "STOCK_STATUS"] = "Critical" if df_local.at[i, "DAYS_TO_STOCKOUT"] <= 5 else "Warning"
+
+    reclassify(df_local, policy=status_policy)
 
     # Normalize dtypes to avoid warnings when inserting into existing dataframe
     if "CLOSING_STOCK" in df_local.columns:
@@ -242,9 +508,10 @@ def generate_targeted_demo(n=100, pct_at_risk=0.2, pct_life_saving=0.15):
 
 if "location_map" in st.session_state and st.session_state.location_map:
     try:
-        df["LOCATION"] = df["LOCATION"].astype(str).apply(
+        # assign() rather than in-place: df may be the shared snapshot frame
+        df = df.assign(LOCATION=df["LOCATION"].astype(str).apply(
             lambda x: st.session_state.location_map.get(x, x)
-        )
+        ))
     except Exception:
         # if mapping fails, continue with original LOCATION values
         pass
@@ -254,12 +521,31 @@ if "demo_df" in st.session_state and st.session_state.demo_df is not None:
     df = st.session_state.demo_df
 
 # Auto-seed a small targeted demo when running locally so key panels show content
-if session is None and "demo_df" not in st.session_state and "demo_auto_seeded" not in st.session_state:
+# (not needed when a real offline snapshot is available)
+if session is None and local_engine is None and offline_snapshot is None and "demo_df" not in st.session_state and "demo_auto_seeded" not in st.session_state:
     # 50 rows with 20% at-risk and 15% life-saving by default
     st.session_state.demo_df = generate_targeted_demo(50, pct_at_risk=0.2, pct_life_saving=0.15)
     st.session_state.demo_auto_seeded = True
     df = st.session_state.demo_df
 
+
+def current_data_version() -> str:
+    """Label that changes whenever the rows behind `df` change."""
+    if st.session_state.get("demo_df") is not None:
+        source = f"demo:{id(st.session_state.demo_df)}"
+    elif session is not None or local_engine is not None:
+        source = f"live:{live_version}"
+    elif snapshot_manifest is not None:
+        source = f"snapshot:{snapshot_manifest['synced_at']}"
+    else:
+        source = "demo"
+    renames = sorted((st.session_state.get("location_map") or {}).items())
+    return (
+        f"{tenant.tenant_id}|{source}|{hash(tuple(renames))}|"
+        f"{st.session_state.get('history_as_of', 'Live')}"
+    )
+
+
 # =================================================
 # SESSION STATE (Settings persistence)
 # =================================================
@@ -277,6 +563,32 @@ if "recipients" not in st.session_state:
     st.session_state.recipients = ["Hospital procurement team"]
 
 
+@st.cache_resource
+def get_subscription_store():
+    # Snowflake tables when connected, local SQLite otherwise
+    try:
+        return open_subscription_store(session, os.getenv("CARESTOCK_SQLITE", DEFAULT_SQLITE_PATH))
+    except Exception:
+        return None
+
+
+# Restore saved preferences once per browser session
+subscription_store = get_subscription_store()
+if subscription_store is not None and "alert_prefs_loaded" not in st.session_state:
+    st.session_state.alert_prefs_loaded = True
+    try:
+        saved = subscription_store.get_subscription(current_subscriber_id())
+    except Exception:
+        saved = None
+    if saved is not None:
+        st.session_state.email_alert = saved.email_alert
+        st.session_state.email = saved.email
+        st.session_state.sms_alert = saved.sms_alert
+        st.session_state.phone = saved.phone
+        st.session_state.alert_levels = saved.levels
+        st.session_state.recipients = saved.recipients
+
+
 
 
 # =================================================
@@ -287,6 +599,44 @@ page = st.selectbox(
     ["Dashboard", "Analytics", "Actions", "Impact", "Settings"]
 )
 
+# Time travel: Dashboard and Analytics can show any recorded day
+history_store = get_history_store()
+if page in ("Dashboard", "Analytics") and history_store is not None:
+    history_dates = history_store.dates()
+    if history_dates:
+        as_of = st.select_slider(
+            "🕰️ As of",
+            options=history_dates + ["Live"],
+            value="Live",
+            key="history_as_of"
+        )
+        if as_of != "Live":
+            df = scope_frame(history_store.reconstruct(as_of), tenant)
+            st.caption(f"Showing the network as recorded on **{as_of}**.")
+
+
+# Live refresh: the timed fragment only compares two strings; the single
+# metadata poll runs in the server's refresh coordinator
+refresh_coordinator = get_refresh_coordinator()
+st.session_state.rendered_version = live_version
+
+
+@st.fragment(run_every=DEFAULT_TICK_SECONDS)
+def live_refresh_watch():
+    latest = refresh_coordinator.version
+    if latest is not None and latest != st.session_state.get("rendered_version"):
+        st.rerun()
+    if latest is not None:
+        st.caption(f"🟢 Live — STOCK_HEALTH_DT refreshed {latest}")
+
+
+if (
+    refresh_coordinator is not None
+    and page in ("Dashboard", "Analytics", "Impact")
+    and st.session_state.get("history_as_of", "Live") == "Live"
+):
+    live_refresh_watch()
+
 
 # =================================================
 # TOP FILTER BAR (GLOBAL)
@@ -335,83 +685,45 @@ df = df[
 
 
 # =================================================
-# CORTEX AI DEMAND FORECAST
+# ENRICHMENT (forecast, derived metrics, EOQ + safety stock)
 # =================================================
-def safe_cortex_forecast(row):
-    try:
-        return cortex_demand_forecast(
-            row["AVG_DAILY_DEMAND"],
-            row["LEAD_TIME_DAYS"],
-            horizon_days=7
-        )
-    except Exception:
-        return {
-            "forecast_units": row["AVG_DAILY_DEMAND"] * 7,
-            "lower_bound": row["AVG_DAILY_DEMAND"] * 5,
-            "upper_bound": row["AVG_DAILY_DEMAND"] * 9,
-            "explanation": "Fallback estimate based on historical demand"
-        }
+# Compact schema: categoricals, float32 numerics and boolean flags.
+# Badges and explanations are added by with_display_columns() only for
+# the rows a page renders.
+df = enrich_stock_frame(df, status_policy)
 
-df["AI_FORECAST"] = df.apply(safe_cortex_forecast, axis=1)
 
-df["FORECAST_7D"] = df["AI_FORECAST"].apply(lambda x: x["forecast_units"])
-df["FORECAST_LOW"] = df["AI_FORECAST"].apply(lambda x: x["lower_bound"])
-df["FORECAST_HIGH"] = df["AI_FORECAST"].apply(lambda x: x["upper_bound"])
-df["AI_EXPLANATION"] = df["AI_FORECAST"].apply(lambda x: x["explanation"])
-
-# =================================================
-# DERIVED METRICS
-# =================================================
-df["DAYS_OF_COVER"] = df["CLOSING_STOCK"] / df["LEAD_TIME_DAYS"].replace(0, 1)
-
-status_badge = {
-    "Critical": "🔴 Critical",
-    "Warning": "🟡 Warning",
-    "Healthy": "🟢 Healthy"
-}
-df["STATUS_BADGE"] = df["STOCK_STATUS"].map(status_badge)
-
-LIFE_SAVING_ITEMS = ["Insulin", "Oxygen", "Blood", "Ventilator"]
-df["ITEM_PRIORITY"] = df["ITEM"].apply(
-    lambda x: "🔴 Life-saving" if x in LIFE_SAVING_ITEMS else "🟢 Essential"
-)
+@st.cache_data(ttl=600, show_spinner="Simulating stock-out risk…")
+def simulate_stockout(stock, demand, lead):
+    # Fixed seed: the same data gives the same probabilities on every rerun
+    return stockout_probability(stock, demand, lead, seed=0)
 
-df["OVERSTOCK_RISK"] = df["DAYS_OF_COVER"] > 90
-df["OVERSTOCK_BADGE"] = df["OVERSTOCK_RISK"].apply(
-    lambda x: "🟣 Overstock risk" if x else ""
-)
-# =================================================
-# EOQ + SAFETY STOCK CALCULATIONS
-# =================================================
 
-df["EOQ"] = df["AVG_DAILY_DEMAND"].apply(
-    lambda d: calculate_eoq(d)
+# Monte-Carlo P(stock-out before replenishment); feeds RISK_SCORE
+df = with_stockout_probability(
+    df,
+    prob=simulate_stockout(
+        df["CLOSING_STOCK"].to_numpy(),
+        df["AVG_DAILY_DEMAND"].to_numpy(),
+        df["LEAD_TIME_DAYS"].to_numpy()
+    )
 )
 
-df["SAFETY_STOCK"] = df.apply(
-    lambda row: calculate_safety_stock(
-        row["AVG_DAILY_DEMAND"],
-        row["LEAD_TIME_DAYS"]
-    ),
-    axis=1
-)
 
-df["REORDER_POINT"] = df.apply(
-    lambda row: calculate_reorder_point(
-        row["AVG_DAILY_DEMAND"],
-        row["LEAD_TIME_DAYS"],
-        row["SAFETY_STOCK"]
-    ),
-    axis=1
-)
-
-df["REORDER_RECOMMENDATION"] = df.apply(
-    lambda row: (
-        "🔴 Order now"
-        if row["CLOSING_STOCK"] <= row["REORDER_POINT"]
-        else "🟢 Stock sufficient"
-    ),
-    axis=1
+# =================================================
+# PAGE PREFETCH
+# =================================================
+# Every page's aggregates for this data version and filter set are
+# computed concurrently in the background; pages read the shared result
+page_signature = (current_data_version(), tuple(sel_locations), tuple(sel_items))
+prefetcher = get_prefetcher()
+prefetch_pages(
+    prefetcher,
+    page_signature,
+    df,
+    hierarchy=load_location_hierarchy(),
+    lots=scope_frame(load_stock_lots(), tenant),
+    simulate_lots=session is None
 )
 
 
@@ -449,17 +761,62 @@ if page == "Dashboard":
     # -------------------------------------------------
     # DATA STATUS PANEL (helps debug empty views)
     # -------------------------------------------------
-    total_rows = len(df)
-    status_counts = df["STOCK_STATUS"].value_counts().to_dict() if "STOCK_STATUS" in df.columns else {}
-    life_saving_at_risk = len(df[(df.get("ITEM_PRIORITY") == "🔴 Life-saving") & (df.get("STOCK_STATUS").isin(["Critical","Warning"]))]) if "ITEM_PRIORITY" in df.columns and "STOCK_STATUS" in df.columns else 0
+    dashboard = prefetcher.get(("Dashboard", *page_signature), dashboard_aggregates, df)
 
-    conn_label = "Snowflake" if session else "LOCAL demo"
+    total_rows = len(df)
+    status_counts = {
+        "Critical": dashboard["critical"],
+        "Warning": dashboard["warning"],
+        "Healthy": dashboard["healthy"]
+    }
+    life_saving_at_risk = int((df["IS_LIFE_SAVING"] & df["STOCK_STATUS"].isin(["Critical","Warning"])).sum()) if "IS_LIFE_SAVING" in df.columns and "STOCK_STATUS" in df.columns else 0
+
+    if session:
+        conn_label = "Snowflake"
+    elif local_engine is not None:
+        conn_label = f"Local engine ({local_engine.backend})"
+    elif snapshot_manifest is not None:
+        conn_label = f"Offline snapshot (synced {snapshot_manifest['synced_at']})"
+    else:
+        conn_label = "LOCAL demo"
 
     st.info(
         f"**Data status:** Connection: **{conn_label}** — Rows: **{total_rows}**  |  "
         f"🔴 Critical: **{status_counts.get('Critical',0)}**  |  🟡 Warning: **{status_counts.get('Warning',0)}**  |  🟢 Healthy: **{status_counts.get('Healthy',0)}**"
     )
 
+    with st.expander("🗄️ Offline snapshot"):
+        if session:
+            st.caption(
+                "Export STOCK_HEALTH_DT and recent history for facilities "
+                "that run without a Snowflake connection."
+            )
+            history_days = st.selectbox("History window (days)", [7, 30, 90], index=1)
+            if st.button("📦 Build snapshot", key="build_snapshot"):
+                # Only the tenant's rows, in a directory of its own
+                export_dir = os.path.join(SNAPSHOT_DIR, "export", tenant.tenant_id)
+                export_from_session(session, stock_health_sql(status_policy), history_days, export_dir, tenant)
+                st.session_state.snapshot_bundle = bundle_snapshot(export_dir)
+            if st.session_state.get("snapshot_bundle"):
+                st.download_button(
+                    "⬇️ Download snapshot bundle",
+                    st.session_state.snapshot_bundle,
+                    file_name="carestock_snapshot.zip",
+                    mime="application/zip"
+                )
+        else:
+            uploaded = st.file_uploader("Import snapshot bundle (.zip)", type=["zip"])
+            if uploaded is not None and st.button("📥 Load snapshot", key="load_snapshot"):
+                try:
+                    manifest = import_bundle(uploaded, SNAPSHOT_DIR)
+                except Exception as e:
+                    st.error(f"Could not import snapshot: {e}")
+                else:
+                    load_offline_snapshot.clear()
+                    st.session_state.pop("demo_df", None)
+                    st.success(f"Snapshot from {manifest['synced_at']} loaded")
+                    st.experimental_rerun()
+
     if not session:
         with st.expander("Demo data tools"):
             size = st.selectbox("Demo dataset size", [10, 50, 100, 200], index=1)
@@ -512,10 +869,10 @@ if page == "Dashboard":
     # -------------------------------------------------
     # CORE KPIs (EXECUTIVE VIEW)
     # -------------------------------------------------
-    critical = (df["STOCK_STATUS"] == "Critical").sum()
-    warning = (df["STOCK_STATUS"] == "Warning").sum()
-    healthy = (df["STOCK_STATUS"] == "Healthy").sum()
-    overstock = df["OVERSTOCK_RISK"].sum()
+    critical = dashboard["critical"]
+    warning = dashboard["warning"]
+    healthy = dashboard["healthy"]
+    overstock = dashboard["overstock"]
 
     col1, col2, col3, col4 = st.columns(4)
 
@@ -594,23 +951,24 @@ if page == "Dashboard":
     # -------------------------------------------------
     st.subheader("🚨 Early-warning: items requiring attention")
 
-    risk_df = df[df["STOCK_STATUS"].isin(["Critical", "Warning"])]
+    risk_mask = dashboard["risk_mask"]
 
-    if risk_df.empty:
+    if not risk_mask.any():
         st.success("No immediate risks detected. Inventory is stable ✅")
     else:
-        st.dataframe(
-            risk_df[
-                [
-                    "LOCATION",
-                    "ITEM",
-                    "ITEM_PRIORITY",
-                    "STATUS_BADGE",
-                    "CLOSING_STOCK",
-                    "DAYS_TO_STOCKOUT"
-                ]
+        paginated_table(
+            df,
+            risk_mask,
+            [
+                "LOCATION",
+                "ITEM",
+                "ITEM_PRIORITY",
+                "STATUS_BADGE",
+                "CLOSING_STOCK",
+                "DAYS_TO_STOCKOUT",
+                "STOCKOUT_PROB"
             ],
-            width='stretch'
+            key="early_warning"
         )
 
     st.divider()
@@ -620,26 +978,24 @@ if page == "Dashboard":
     # -------------------------------------------------
     st.subheader("🤖 AI snapshot: next 7-day demand risk")
 
-    ai_focus = df[
-        (df["STOCK_STATUS"].isin(["Critical", "Warning"])) &
-        (df["ITEM_PRIORITY"] == "🔴 Life-saving")
-    ]
+    ai_focus_mask = dashboard["life_saving_mask"]
 
-    if ai_focus.empty:
+    if not ai_focus_mask.any():
         st.info("Life-saving items are currently well covered.")
     else:
-        st.dataframe(
-            ai_focus[
-                [
-                    "LOCATION",
-                    "ITEM",
-                    "AVG_DAILY_DEMAND",
-                    "FORECAST_7D",
-                    "FORECAST_LOW",
-                    "FORECAST_HIGH"
-                ]
+        paginated_table(
+            df,
+            ai_focus_mask,
+            [
+                "LOCATION",
+                "ITEM",
+                "AVG_DAILY_DEMAND",
+                "FORECAST_7D",
+                "FORECAST_LOW",
+                "FORECAST_HIGH"
             ],
-            width='stretch'
+            key="ai_snapshot",
+            page_size=10
         )
 
         with st.expander("🧠 How the AI forecast works"):
@@ -663,11 +1019,41 @@ if page == "Dashboard":
     # -------------------------------------------------
     st.download_button(
         "⬇️ Download priority action list (CSV)",
-        risk_df.to_csv(index=False),
+        dashboard["priority_csv"],
         file_name="carestock_priority_actions.csv",
         mime="text/csv"
     )
 
+    with st.expander("🧾 Replenishment plan"):
+        catalog = load_item_catalog()
+        st.caption(
+            "Order quantities for every row below its reorder point "
+            "(reorder point + EOQ − stock, in whole packs)."
+            + ("" if catalog is not None else " No ITEM_CATALOG found: pack size 1, budget in units.")
+        )
+        budget = st.number_input("Budget cap per location (0 = no cap)", min_value=0.0, step=1000.0)
+        plan_format = st.radio("Format", ["CSV", "Parquet"], horizontal=True)
+        if st.button("🧮 Build plan", key="build_plan"):
+            plan = build_plan(
+                df,
+                pack_sizes=None if catalog is None else dict(zip(catalog["ITEM"], catalog["PACK_SIZE"])),
+                unit_costs=None if catalog is None else dict(zip(catalog["ITEM"], catalog["UNIT_COST"])),
+                default_budget=budget or None
+            )
+            suffix = ".csv" if plan_format == "CSV" else ".parquet"
+            plan_path = new_plan_path(suffix, st.session_state.get("plan_file"))
+            (write_csv if plan_format == "CSV" else write_parquet)(plan, plan_path)
+            st.session_state.plan_file = (plan_path, plan_format, len(plan))
+        if st.session_state.get("plan_file") and os.path.exists(st.session_state.plan_file[0]):
+            plan_path, plan_format, plan_rows = st.session_state.plan_file
+            with open(plan_path, "rb") as fh:
+                st.download_button(
+                    f"⬇️ Download plan ({plan_rows} rows, {plan_format})",
+                    fh,
+                    file_name="carestock_replenishment_plan" + os.path.splitext(plan_path)[1],
+                    mime="text/csv" if plan_format == "CSV" else "application/octet-stream"
+                )
+
     st.divider()
 
     # -------------------------------------------------
@@ -695,9 +1081,21 @@ elif page == "Actions":
 
     if "working_df" not in st.session_state:
         st.session_state.working_df = df.copy()
+        st.session_state.risk_index = None
+        st.session_state.transfer_plan = None
 
     df = st.session_state.working_df
 
+    # Built once per working frame, then patched row-by-row after actions
+    if st.session_state.get("risk_index") is None:
+        st.session_state.risk_index = RiskPriorityIndex.from_frame(df, at_risk_mask(df))
+    risk_index = st.session_state.risk_index
+
+    # One network-wide solve per working frame; cleared after each action
+    if st.session_state.get("transfer_plan") is None:
+        st.session_state.transfer_plan = suggest_transfers(df, load_location_distances())
+    transfer_plan = st.session_state.transfer_plan
+
     # -------------------------------------------------
     # HEADER
     # -------------------------------------------------
@@ -717,22 +1115,19 @@ elif page == "Actions":
     # -------------------------------------------------
     # FILTER AT-RISK ITEMS
     # -------------------------------------------------
-    at_risk = df[df["STOCK_STATUS"].isin(["Critical", "Warning"])]
+    at_risk = at_risk_mask(df)
 
-    if at_risk.empty:
+    if not at_risk.any():
         st.success("🎉 No critical or warning items right now.")
         st.stop()
 
-    selected_index = st.selectbox(
-        "Select item",
-        at_risk.index,
-        format_func=lambda i: (
-            f"{at_risk.loc[i,'LOCATION']} → "
-            f"{at_risk.loc[i,'ITEM']} "
-            f"({at_risk.loc[i,'STATUS_BADGE']})"
-        )
+    selected_index = searchable_item_picker(
+        df, at_risk, key="action_item", priority_index=risk_index
     )
 
+    if selected_index is None:
+        st.stop()
+
     item = df.loc[selected_index]
 
     # -------------------------------------------------
@@ -751,6 +1146,21 @@ elif page == "Actions":
         unsafe_allow_html=True
     )
 
+    # -------------------------------------------------
+    # SUGGESTED TRANSFERS
+    # -------------------------------------------------
+    suggestions = transfer_plan[transfer_plan["TO_ROW"] == selected_index]
+    if not suggestions.empty:
+        st.markdown("**🔁 Suggested transfers from overstocked locations**")
+        shown = suggestions[["FROM_LOCATION", "QUANTITY", "DISTANCE_KM"]].rename(columns={
+            "FROM_LOCATION": "From",
+            "QUANTITY": "Units",
+            "DISTANCE_KM": "Distance (km)"
+        })
+        if shown["Distance (km)"].isna().all():
+            shown = shown.drop(columns="Distance (km)")
+        st.dataframe(shown, hide_index=True, width='stretch')
+
     st.divider()
 
     # -------------------------------------------------
@@ -792,24 +1202,42 @@ elif page == "Actions":
             # Update stock
             df.loc[selected_index, "CLOSING_STOCK"] += quantity
 
-            # Recalculate days to stockout
-            avg_demand = max(item["AVG_DAILY_DEMAND"], 1)
-            new_days = df.loc[selected_index, "CLOSING_STOCK"] / avg_demand
-            df.loc[selected_index, "DAYS_TO_STOCKOUT"] = round(new_days, 1)
-
-            # Update status automatically
-            if new_days > 15:
-                df.loc[selected_index, "STOCK_STATUS"] = "Healthy"
-                df.loc[selected_index, "STATUS_BADGE"] = "🟢 Healthy"
-            elif new_days > 5:
-                df.loc[selected_index, "STOCK_STATUS"] = "Warning"
-                df.loc[selected_index, "STATUS_BADGE"] = "🟡 Warning"
+            # Recalculate days to stock-out and status (same rule as STOCK_HEALTH_DT)
+            reclassify(df, [selected_index], status_policy)
+
+            # Re-simulate and patch the priority index for this row only
+            row = df.loc[selected_index]
+            new_prob = stockout_probability(
+                [row["CLOSING_STOCK"]], [row["AVG_DAILY_DEMAND"]], [row["LEAD_TIME_DAYS"]], seed=0
+            )[0]
+            df.loc[selected_index, "STOCKOUT_PROB"] = new_prob
+            new_score = risk_score(
+                row["DAYS_TO_STOCKOUT"],
+                row["LEAD_TIME_DAYS"],
+                row["FORECAST_HIGH"],
+                row["CLOSING_STOCK"],
+                row["IS_LIFE_SAVING"],
+                new_prob
+            )
+            df.loc[selected_index, "RISK_SCORE"] = new_score
+            if row["STOCK_STATUS"] == "Healthy":
+                risk_index.discard(selected_index)
             else:
-                df.loc[selected_index, "STOCK_STATUS"] = "Critical"
-                df.loc[selected_index, "STATUS_BADGE"] = "🔴 Critical"
+                risk_index.update(selected_index, new_score)
 
             # Persist changes
             st.session_state.working_df = df
+            st.session_state.transfer_plan = None
+
+            # Persist to ACTION_LOG (feeds the Impact page)
+            impact_store = get_impact_store()
+            if impact_store is not None:
+                try:
+                    impact_store.log_action(
+                        item["LOCATION"], item["ITEM"], action_type, f"+{quantity} units", user
+                    )
+                except Exception as e:
+                    st.warning(f"Action applied but not saved to the action log: {e}")
 
             # Log action
             st.session_state.action_log.insert(0, {
@@ -825,6 +1253,79 @@ elif page == "Actions":
 
     st.divider()
 
+    # -------------------------------------------------
+    # BULK UPLOAD (CSV / EXCEL)
+    # -------------------------------------------------
+    with st.expander("📤 Bulk stock upload (CSV / Excel)"):
+        st.caption(
+            "Columns: DATE, LOCATION, ITEM, CLOSING_STOCK; optional OPENING_STOCK, "
+            "RECEIVED, ISSUED, LEAD_TIME_DAYS. One row per date, location and item."
+        )
+        upload = st.file_uploader("Stock file", type=UPLOAD_TYPES, key="bulk_file")
+        if upload is not None and st.button("🔍 Validate file", key="bulk_validate"):
+            previous = st.session_state.get("bulk_upload")
+            if previous is not None:
+                previous.cleanup()
+            # Real LOCATION / ITEM values the tenant may write: not the
+            # sidebar-filtered frame, and never display renames
+            catalog = load_item_catalog()
+            known_items = set(tenant_df["ITEM"].astype(str))
+            if catalog is not None:
+                known_items |= set(catalog["ITEM"].astype(str))
+            known_locations = (
+                set(tenant_df["LOCATION"].astype(str)) if tenant.unrestricted else tenant.locations
+            )
+            try:
+                with st.spinner("Validating…"):
+                    st.session_state.bulk_upload = validate_file(
+                        upload, upload.name, known_locations, known_items
+                    )
+            except (ValueError, ImportError) as e:
+                st.session_state.bulk_upload = None
+                st.error(f"Could not read the file: {e}")
+
+        bulk = st.session_state.get("bulk_upload")
+        if bulk is not None:
+            b1, b2, b3 = st.columns(3)
+            b1.metric("Rows read", f"{bulk.rows_read:,}")
+            b2.metric("Valid rows", f"{bulk.rows_valid:,}")
+            b3.metric("Rejected rows", f"{bulk.rows_rejected:,}")
+
+            if bulk.error_count:
+                errors = bulk.error_frame()
+                st.dataframe(errors.head(200), hide_index=True, width='stretch')
+                if bulk.error_count > len(errors):
+                    st.caption(f"Report holds the first {len(errors):,} of {bulk.error_count:,} errors.")
+                st.download_button(
+                    "⬇️ Download error report (CSV)",
+                    errors.to_csv(index=False),
+                    file_name="carestock_upload_errors.csv",
+                    mime="text/csv"
+                )
+
+            if bulk.rows_valid and session is None and local_engine is None:
+                st.info("Demo mode: valid rows are staged locally but not loaded (no Snowflake session).")
+            elif bulk.rows_valid and st.button(
+                f"⬆️ Load {bulk.rows_valid:,} valid rows into DAILY_STOCK", key="bulk_load"
+            ):
+                try:
+                    with st.spinner("Loading…"):
+                        if session is not None:
+                            loaded = copy_into_daily_stock(session, bulk)
+                        else:
+                            loaded = load_into_engine(local_engine, bulk)
+                except Exception as e:
+                    st.error(f"Load failed: {e}")
+                else:
+                    skipped = bulk.rows_valid - loaded
+                    bulk.cleanup()
+                    st.session_state.bulk_upload = None
+                    st.success(f"✅ {loaded:,} rows loaded; STOCK_HEALTH_DT picks them up on its next refresh.")
+                    if skipped:
+                        st.info(f"{skipped:,} rows were already in DAILY_STOCK for that date, location and item and were skipped.")
+
+    st.divider()
+
     # -------------------------------------------------
     # RECENT ACTIONS
     # -------------------------------------------------
@@ -923,11 +1424,49 @@ elif page == "Settings":
     st.divider()
 
     if st.button("💾 Save alert preferences"):
-        st.success("Alert preferences saved successfully ✅")
+        subscription = Subscription(
+            subscription_id=current_subscriber_id(),
+            levels=alert_levels,
+            recipients=recipients,
+            email=st.session_state.email,
+            phone=st.session_state.phone,
+            email_alert=st.session_state.email_alert,
+            sms_alert=st.session_state.sms_alert,
+            tenant_id=tenant.tenant_id
+        )
+        if subscription_store is None:
+            st.error("Alert preferences could not be saved: no subscription store available.")
+        else:
+            subscription_store.save_subscription(subscription)
+            st.success("Alert preferences saved successfully ✅")
+            if not subscription.channels():
+                st.warning("No channel enabled — enable email or SMS alerts to receive notifications.")
+
+    if subscription_store is not None and st.button("📨 Run alert scan now"):
+        # Same path and same data as the scheduled runner: the shared alert
+        # state comes from the whole network, never from this session's
+        # filtered frame, and each subscriber's digest from its tenant's
+        # rows. Ledger-deduplicated, so nothing the runner delivered is re-sent
+        sender = FileSender(os.getenv("CARESTOCK_OUTBOX_DIR", DEFAULT_OUTBOX_DIR))
+        network = load_alert_frame(session, SNAPSHOT_DIR, status_policy, local_engine)
+        report = (
+            run_alert_scan(subscription_store, sender, network, directory=get_tenant_directory())
+            if network is not None else None
+        )
+        if report is None:
+            st.info("No Snowflake session, local engine or offline snapshot to scan.")
+        elif report.sent or report.failed:
+            st.info(
+                f"📨 {len(report.sent)} alert digest(s) delivered "
+                f"({sum(len(d.rows) for d in report.sent)} item alerts) → `{sender.outbox_dir}`"
+                + (f" · ⚠️ {len(report.failed)} failed" if report.failed else "")
+            )
+        else:
+            st.info("No new alert transitions since the last scan.")
 
     st.info(
-        "ℹ️ In production, these settings would be stored in Snowflake "
-        "and consumed by Tasks or external notification services."
+        "ℹ️ Preferences are stored in Snowflake (SQLite locally) and scanned every "
+        "5 minutes by `alert_runner.py`, independent of open browser sessions."
     )
 
 
@@ -959,16 +1498,18 @@ elif page == "Impact":
     # -------------------------------------------------
     # ASSUMPTIONS (TRANSPARENT & EXPLAINABLE)
     # -------------------------------------------------
-    with st.expander("📌 Impact assumptions (transparent & conservative)"):
+    with st.expander("📌 How these numbers are computed"):
         st.markdown(
             """
-            - Average patients served per item per day: **3**  
-            - Average emergency procurement cost per stock-out: **₹2,500**  
-            - Average wastage reduction due to early visibility: **15%**  
-            - Average stock-out days prevented per incident: **5 days**  
-
-            These assumptions are conservative and can be refined using
-            real hospital / PDS / NGO data in production.
+            - An **at-risk episode** starts when an item enters Critical or Warning
+              and ends when it is Healthy again  
+            - **Stock-outs prevented**: episodes resolved after an action was logged  
+            - **Emergency orders avoided**: episodes resolved by logged actions before
+              reaching Critical, without an emergency delivery  
+            - **Units expired**: lot stock still on hand when its expiry date passed  
+
+            Figures come from the action log and the status history, updated
+            incrementally on every refresh, and cover the locations in view.
             """
         )
 
@@ -982,24 +1523,37 @@ elif page == "Impact":
     # -------------------------------------------------
     # IMPACT CALCULATIONS
     # -------------------------------------------------
-    PATIENTS_PER_ITEM_PER_DAY = 3
-    COST_PER_STOCKOUT = 2500
-    DAYS_PREVENTED = 5
-    WASTE_REDUCTION_RATE = 0.15
-
-    patients_protected = (
-        (len(critical) + len(warning))
-        * PATIENTS_PER_ITEM_PER_DAY
-        * DAYS_PREVENTED
-    )
-
-    cost_saved = len(critical) * COST_PER_STOCKOUT
-    waste_reduction_pct = int(WASTE_REDUCTION_RATE * 100)
+    # Incremental: only actions and transitions after the stored
+    # watermarks are read, however long the history is
+    impact_store = get_impact_store()
+    network_lots = load_stock_lots()
+    real_lots = scope_frame(network_lots, tenant)
+    impact = None
+    if impact_store is not None:
+        try:
+            # One network-wide aggregate with one expiry watermark: it must
+            # see every tenant's lots, not just this session's. Shown only
+            # for the locations on this page (tenant scope and filters)
+            impact = impact_summary(
+                refresh_impact(impact_store, get_transition_store(), network_lots),
+                set(df["LOCATION"].astype(str))
+            )
+        except Exception as e:
+            st.warning(f"Impact history unavailable: {e}")
+    if impact is None:
+        impact = {
+            "stockouts_prevented": 0,
+            "emergency_orders_avoided": 0,
+            "emergency_deliveries": 0,
+            "expired_units": 0,
+            "open_episodes": 0,
+            "mean_resolution_days": None
+        }
 
     locations_covered = df["LOCATION"].nunique()
     items_monitored = df["ITEM"].nunique()
 
-    life_saving_items_monitored = df[df["ITEM_PRIORITY"] == "🔴 Life-saving"]["ITEM"].nunique()
+    life_saving_items_monitored = df.loc[df["IS_LIFE_SAVING"], "ITEM"].nunique()
 
     # -------------------------------------------------
     # PREMIUM KPI CARDS
@@ -1011,12 +1565,12 @@ elif page == "Impact":
             f"""
             <div style="background:#ECFDF5; border:1px solid #A7F3D0;
                         border-radius:16px; padding:20px; text-align:center;">
-                <div style="font-size:14px; color:#065F46;">🧑‍⚕️ Patients protected</div>
+                <div style="font-size:14px; color:#065F46;">🛡️ Stock-outs prevented</div>
                 <div style="font-size:34px; font-weight:700; color:#064E3B;">
-                    {patients_protected}+
+                    {impact['stockouts_prevented']:,}
                 </div>
                 <div style="font-size:12px; color:#064E3B;">
-                    uninterrupted care delivered
+                    at-risk episodes resolved after action
                 </div>
             </div>
             """,
@@ -1028,12 +1582,12 @@ elif page == "Impact":
             f"""
             <div style="background:#EFF6FF; border:1px solid #BFDBFE;
                         border-radius:16px; padding:20px; text-align:center;">
-                <div style="font-size:14px; color:#1E3A8A;">💰 Cost savings</div>
+                <div style="font-size:14px; color:#1E3A8A;">🚑 Emergency orders avoided</div>
                 <div style="font-size:34px; font-weight:700; color:#1E40AF;">
-                    ₹{cost_saved:,}
+                    {impact['emergency_orders_avoided']:,}
                 </div>
                 <div style="font-size:12px; color:#1E40AF;">
-                    emergency procurement avoided
+                    {impact['emergency_deliveries']:,} emergency deliveries logged
                 </div>
             </div>
             """,
@@ -1045,12 +1599,12 @@ elif page == "Impact":
             f"""
             <div style="background:#FFFBEB; border:1px solid #FDE68A;
                         border-radius:16px; padding:20px; text-align:center;">
-                <div style="font-size:14px; color:#92400E;">♻️ Waste reduced</div>
+                <div style="font-size:14px; color:#92400E;">♻️ Units expired</div>
                 <div style="font-size:34px; font-weight:700; color:#78350F;">
-                    {waste_reduction_pct}%
+                    {impact['expired_units']:,}
                 </div>
                 <div style="font-size:12px; color:#78350F;">
-                    expiry risk prevented
+                    past expiry while on hand
                 </div>
             </div>
             """,
@@ -1081,7 +1635,7 @@ elif page == "Impact":
     # -------------------------------------------------
     st.subheader("📈 Additional impact indicators")
 
-    c1, c2, c3 = st.columns(3)
+    c1, c2, c3, c4 = st.columns(4)
 
     c1.metric(
         "Life-saving items tracked",
@@ -1101,6 +1655,52 @@ elif page == "Impact":
         help="Potential expiry or wastage identified in advance"
     )
 
+    c4.metric(
+        "Open at-risk episodes",
+        impact["open_episodes"],
+        help=(
+            f"Mean time to resolve: {impact['mean_resolution_days']:.1f} days"
+            if impact["mean_resolution_days"] is not None else "No episode resolved yet"
+        )
+    )
+
+    # -------------------------------------------------
+    # LOT EXPIRY (FEFO PROJECTION)
+    # -------------------------------------------------
+    lot_expiry = prefetcher.get(
+        ("Impact", *page_signature), impact_aggregates, df, real_lots, session is None
+    )
+    expiry = lot_expiry["expiry"]
+    simulated_lots = lot_expiry["simulated"]
+
+    if expiry is not None:
+        expiring_units = float(expiry["EXPIRING_UNITS"].sum())
+        lot_units = float(expiry["LOT_UNITS"].sum())
+
+        e1, e2 = st.columns(2)
+        e1.metric(
+            "Units projected to expire (90 days)",
+            f"{expiring_units:,.0f}",
+            help="First-expiry-first-out depletion of every lot against forecast demand"
+        )
+        e2.metric(
+            "Share of lot stock at risk",
+            f"{expiring_units / max(lot_units, 1):.1%}"
+        )
+
+        expiring = expiry[expiry["EXPIRING_UNITS"] > 0].nlargest(20, "EXPIRING_UNITS")
+        if not expiring.empty:
+            with st.expander("⏳ Lots expiring before use"):
+                st.dataframe(
+                    expiring[[
+                        "LOCATION", "ITEM", "EXPIRING_UNITS", "EXPIRING_LOTS", "NEXT_EXPIRY_DAYS"
+                    ]].round({"EXPIRING_UNITS": 0}),
+                    hide_index=True,
+                    width='stretch'
+                )
+                if simulated_lots:
+                    st.caption("Demo mode: lots are simulated from current stock.")
+
     st.divider()
 
     # -------------------------------------------------
@@ -1183,46 +1783,70 @@ elif page == "Analytics":
     # -------------------------------------------------
     # 1️⃣ STOCK HEALTH DISTRIBUTION
     # -------------------------------------------------
+    # Aggregate cube: refreshed by deltas when the rows behind df change,
+    # every chart below reads its small per-level frames
+    cube_key = page_signature
+    analytics_key = ("Analytics", *cube_key)
+    if st.session_state.get("cube_key") != cube_key:
+        if prefetcher.ready(analytics_key) or st.session_state.get("cube") is None:
+            # The background build is done (or there is nothing to refresh)
+            st.session_state.cube = adopt_cube(
+                prefetcher.get(analytics_key, analytics_aggregates, df, load_location_hierarchy())
+            )
+        else:
+            st.session_state.cube.refresh(df)
+        st.session_state.cube_key = cube_key
+    cube = st.session_state.cube
+
+    # Built figures are shared across sessions and reruns for the same
+    # data version and filters
+    figure_cache = get_figure_cache()
+
     st.subheader("Overall stock health distribution")
 
-    status_counts = (
-        df.groupby("STOCK_STATUS")
-        .size()
-        .reset_index(name="COUNT")
-    )
+    def build_status_figure():
+        totals = cube.totals()
+        status_counts = pd.DataFrame({
+            "STOCK_STATUS": ["Critical", "Warning", "Healthy"],
+            "COUNT": [int(totals["CRITICAL"]), int(totals["WARNING"]), int(totals["HEALTHY"])]
+        })
+        status_counts = status_counts[status_counts["COUNT"] > 0]
+
+        fig_status = px.bar(
+            status_counts,
+            x="STOCK_STATUS",
+            y="COUNT",
+            color="STOCK_STATUS",
+            color_discrete_map={
+                "Critical": "#EF4444",
+                "Warning": "#F59E0B",
+                "Healthy": "#10B981"
+            },
+            text="COUNT"
+        )
 
-    fig_status = px.bar(
-        status_counts,
-        x="STOCK_STATUS",
-        y="COUNT",
-        color="STOCK_STATUS",
-        color_discrete_map={
-            "Critical": "#EF4444",
-            "Warning": "#F59E0B",
-            "Healthy": "#10B981"
-        },
-        text="COUNT"
-    )
+        fig_status.update_layout(
+            template="simple_white",
+            height=360,
+            margin=dict(l=20, r=20, t=40, b=20),
+            xaxis_title="",
+            yaxis_title="Number of items",
+            showlegend=False,
+            title=dict(
+                text="Items by inventory health status",
+                x=0,
+                font=dict(size=18)
+            )
+        )
 
-    fig_status.update_layout(
-        template="simple_white",
-        height=360,
-        margin=dict(l=20, r=20, t=40, b=20),
-        xaxis_title="",
-        yaxis_title="Number of items",
-        showlegend=False,
-        title=dict(
-            text="Items by inventory health status",
-            x=0,
-            font=dict(size=18)
+        fig_status.update_traces(
+            textposition="outside",
+            marker=dict(opacity=0.9)
         )
-    )
 
-    fig_status.update_traces(
-        textposition="outside",
-        marker=dict(opacity=0.9)
-    )
+        return fig_status
 
+    fig_status = figure_cache.get_or_build(("status", *cube_key), build_status_figure)
     st.plotly_chart(fig_status, width='stretch')
 
     st.caption(
@@ -1233,49 +1857,86 @@ elif page == "Analytics":
     st.divider()
 
     # -------------------------------------------------
-    # 2️⃣ LOCATION RISK COMPARISON
+    # 2️⃣ RISK BY LEVEL (DRILL-DOWN)
     # -------------------------------------------------
-    st.subheader("At-risk items by location")
+    st.subheader("At-risk items by state, district and facility")
+
+    dcol1, dcol2, dcol3 = st.columns(3)
+    with dcol1:
+        level = st.radio(
+            "Level",
+            ["STATE", "DISTRICT", "LOCATION"],
+            format_func=LEVEL_LABELS.get,
+            horizontal=True,
+            key="drill_level"
+        )
+    drill_state = drill_district = None
+    if level != "STATE":
+        with dcol2:
+            drill_state = st.selectbox("State", ["All"] + cube.children("STATE"), key="drill_state")
+            drill_state = None if drill_state == "All" else drill_state
+    if level == "LOCATION":
+        with dcol3:
+            drill_district = st.selectbox(
+                "District", ["All"] + cube.children("DISTRICT", state=drill_state), key="drill_district"
+            )
+            drill_district = None if drill_district == "All" else drill_district
 
+    level_view = cube.view(level, state=drill_state, district=drill_district)
     location_risk = (
-        df[df["STOCK_STATUS"].isin(["Critical", "Warning"])]
-        .groupby("LOCATION")
-        .size()
-        .reset_index(name="AT_RISK_ITEMS")
-        .sort_values("AT_RISK_ITEMS", ascending=False)
+        level_view[level_view["AT_RISK"] > 0]
+        .sort_values("AT_RISK", ascending=False)
+        .head(30)
+        .rename(columns={level: "NODE", "AT_RISK": "AT_RISK_ITEMS"})
     )
 
     if location_risk.empty:
         st.info("No locations currently have critical or warning items.")
     else:
-        fig_location = px.bar(
-            location_risk,
-            x="LOCATION",
-            y="AT_RISK_ITEMS",
-            text="AT_RISK_ITEMS",
-            color_discrete_sequence=["#6366F1"]
-        )
+        def build_location_figure():
+            fig_location = px.bar(
+                location_risk,
+                x="NODE",
+                y="AT_RISK_ITEMS",
+                text="AT_RISK_ITEMS",
+                color_discrete_sequence=["#6366F1"]
+            )
 
-        fig_location.update_layout(
-            template="simple_white",
-            height=360,
-            margin=dict(l=20, r=20, t=40, b=20),
-            xaxis_title="Location",
-            yaxis_title="At-risk items",
-            title=dict(
-                text="Locations with highest supply risk",
-                x=0,
-                font=dict(size=18)
+            fig_location.update_layout(
+                template="simple_white",
+                height=360,
+                margin=dict(l=20, r=20, t=40, b=20),
+                xaxis_title=LEVEL_LABELS[level],
+                yaxis_title="At-risk items",
+                title=dict(
+                    text=f"{LEVEL_LABELS[level]}s with highest supply risk",
+                    x=0,
+                    font=dict(size=18)
+                )
             )
-        )
 
-        fig_location.update_traces(
-            textposition="outside",
-            marker=dict(opacity=0.85)
-        )
+            fig_location.update_traces(
+                textposition="outside",
+                marker=dict(opacity=0.85)
+            )
+
+            return fig_location
 
+        fig_location = figure_cache.get_or_build(
+            ("location", *cube_key, level, drill_state, drill_district), build_location_figure
+        )
         st.plotly_chart(fig_location, width='stretch')
 
+        with st.expander(f"📋 {LEVEL_LABELS[level]} summary"):
+            st.dataframe(
+                level_view.sort_values("AT_RISK", ascending=False)[[
+                    level, "ROWS", "CRITICAL", "WARNING", "AT_RISK_SHARE",
+                    "LIFE_SAVING_AT_RISK", "OVERSTOCK", "MEAN_COVER", "STD_COVER"
+                ]].round(2),
+                hide_index=True,
+                width='stretch'
+            )
+
     st.caption(
         "This ranking helps prioritize interventions at locations "
         "with the highest concentration of risk."
@@ -1286,57 +1947,101 @@ elif page == "Analytics":
     # -------------------------------------------------
     # 3️⃣ STOCK COVERAGE HEATMAP
     # -------------------------------------------------
-    st.subheader("Days of stock cover — heatmap")
+    st.subheader("Stock risk — heatmap")
 
-    # Use pivot_table with aggregation to handle duplicate LOCATION×ITEM pairs safely
-    try:
-        heat = (
-            df.pivot_table(
-                index="LOCATION",
-                columns="ITEM",
-                values="DAYS_OF_COVER",
-                aggfunc="mean"
-            )
-            .fillna(0)
-        )
-    except Exception as e:
-        # Fallback: group & unstack then fill missing values
-        st.warning("Duplicate LOCATION×ITEM rows found — aggregating DAYS_OF_COVER using mean for the heatmap.")
-        heat = (
-            df.groupby(["LOCATION", "ITEM"])["DAYS_OF_COVER"].mean().unstack(fill_value=0)
+    heat_metric = st.radio(
+        "Heatmap metric",
+        ["Days of cover", "Stock-out probability"],
+        horizontal=True,
+        key="heat_metric"
+    )
+    heat_col, heat_scale = (
+        ("DAYS_OF_COVER", ["#FEE2E2", "#FEF3C7", "#DCFCE7"])  # low cover = risk
+        if heat_metric == "Days of cover"
+        else ("STOCKOUT_PROB", ["#DCFCE7", "#FEF3C7", "#FEE2E2"])  # high prob = risk
+    )
+
+    hcol1, hcol2 = st.columns(2)
+    with hcol1:
+        heat_mode = st.radio(
+            "Large grids",
+            ["top", "cluster"],
+            format_func={"top": "Top risk + other", "cluster": "Risk bands"}.get,
+            horizontal=True,
+            key="heat_mode",
+            help=f"Grids above {DEFAULT_CELL_BUDGET:,} cells are reduced to the riskiest "
+                 "locations and items, or to bands of similar risk."
         )
 
-    fig_heat = px.imshow(
-        heat,
-        color_continuous_scale=[
-            "#FEE2E2",  # low cover (risk)
-            "#FEF3C7",  # medium
-            "#DCFCE7"   # healthy
-        ],
-        aspect="auto"
-    )
+    # Drill-in: restrict the grid to the locations behind one row
+    heat_rows = st.session_state.get("heat_rows")
+    heat_df = df if not heat_rows else df[df["LOCATION"].isin(heat_rows)]
+    heat_key = (*cube_key, heat_col, heat_mode, tuple(heat_rows or ()))
+
+    def build_heat_grid():
+        if heat_mode == "top" and not heat_rows:
+            # Default view: prefetched with the rest of the page
+            analytics = prefetcher.get(analytics_key, analytics_aggregates, df, load_location_hierarchy())
+            return analytics["heat"][heat_col]
+        return heat_grid(heat_df, heat_col, mode=heat_mode)
+
+    heat, row_members = figure_cache.get_or_build(("heat_grid", *heat_key), build_heat_grid)
+
+    def drill_into_row():
+        choice = st.session_state.heat_drill
+        if choice in row_members:
+            st.session_state.heat_rows = row_members[choice]
+        st.session_state.heat_drill = "All locations"
+
+    def drill_back():
+        st.session_state.heat_rows = None
+
+    with hcol2:
+        drill_options = ["All locations"] + [r for r, m in row_members.items() if len(m) > 1]
+        st.selectbox("Drill into row", drill_options, key="heat_drill", on_change=drill_into_row)
+        if heat_rows:
+            st.button("⬅️ Back to all locations", key="heat_back", on_click=drill_back)
+
+    def build_heat_figure():
+        fig_heat = px.imshow(
+            heat,
+            color_continuous_scale=heat_scale,
+            aspect="auto"
+        )
 
-    fig_heat.update_layout(
-        template="simple_white",
-        height=420,
-        margin=dict(l=20, r=20, t=40, b=20),
-        title=dict(
-            text="Days of stock cover by location and item",
-            x=0,
-            font=dict(size=18)
-        ),
-        coloraxis_colorbar=dict(
-            title="Days of cover",
-            thickness=12,
-            len=0.6
+        fig_heat.update_layout(
+            template="simple_white",
+            height=420,
+            margin=dict(l=20, r=20, t=40, b=20),
+            title=dict(
+                text=f"{heat_metric} by location and item",
+                x=0,
+                font=dict(size=18)
+            ),
+            coloraxis_colorbar=dict(
+                title=heat_metric,
+                thickness=12,
+                len=0.6
+            )
         )
-    )
 
-    st.plotly_chart(fig_heat, width='stretch')
+        return fig_heat
+
+    if heat.empty:
+        st.info("No rows to map for the current selection.")
+    else:
+        fig_heat = figure_cache.get_or_build(("heat", *heat_key), build_heat_figure)
+        if len(row_members) < heat_df["LOCATION"].nunique() or heat.shape[1] < heat_df["ITEM"].nunique():
+            st.caption(
+                f"Showing {heat.shape[0]} × {heat.shape[1]} cells; "
+                "each cell is the mean over the rows it covers."
+            )
+        st.plotly_chart(fig_heat, width='stretch')
 
     st.caption(
         "Red zones indicate items likely to run out soon; "
-        "green zones indicate adequate coverage."
+        "green zones indicate adequate coverage. "
+        "Blank cells mean the location does not stock the item."
     )
 
     st.divider()
@@ -1346,25 +2051,22 @@ elif page == "Analytics":
     # -------------------------------------------------
     st.subheader("Life-saving items at risk")
 
-    life_risk = df[
-        (df["ITEM_PRIORITY"] == "🔴 Life-saving") &
-        (df["STOCK_STATUS"].isin(["Critical", "Warning"]))
-    ]
+    life_risk_mask = at_risk_mask(df, life_saving_only=True)
 
-    if life_risk.empty:
+    if not life_risk_mask.any():
         st.success("All life-saving items currently have sufficient coverage.")
     else:
-        st.dataframe(
-            life_risk[
-                [
-                    "LOCATION",
-                    "ITEM",
-                    "STATUS_BADGE",
-                    "CLOSING_STOCK",
-                    "DAYS_TO_STOCKOUT"
-                ]
+        paginated_table(
+            df,
+            life_risk_mask,
+            [
+                "LOCATION",
+                "ITEM",
+                "STATUS_BADGE",
+                "CLOSING_STOCK",
+                "DAYS_TO_STOCKOUT"
             ],
-            width='stretch'
+            key="life_risk"
         )
 
         st.warning(
@@ -0,0 +1,402 @@
+# subscriptions.py
+"""
+Persistent alert subscriptions, alert state and run ledger.
+
+Two interchangeable backends:
+- SnowflakeSubscriptionStore: tables next to STOCK_HEALTH_DT
+- SqliteSubscriptionStore: a local file for offline / dev use
+
+Tables
+- ALERT_SUBSCRIPTIONS  one row per subscriber (levels, groups, channels,
+                       tenant whose rows the digests may carry)
+- ALERT_STATE          LOCATION|ITEM keys currently alerted per level
+- ALERT_META           state_version, bumped by compare-and-set commits
+- ALERT_RUN_LEDGER     one row per digest ever claimed; the claim is an
+                       atomic insert, so overlapping runners never send
+                       the same digest twice. A FAILED digest, or one
+                       CLAIMED longer than the lease (its runner died
+                       mid-send), can be claimed again
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from alerts import Subscription
+
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "carestock.db")
+
+# Far beyond a send with all its retries (alert_runner.send_with_retry)
+CLAIM_LEASE_SECONDS = 15 * 60
+
+SUBSCRIPTION_COLUMNS = [
+    "SUBSCRIPTION_ID", "LEVELS", "RECIPIENTS", "EMAIL", "PHONE",
+    "EMAIL_ALERT", "SMS_ALERT", "UPDATED_AT", "TENANT_ID"
+]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _lease_cutoff(lease_seconds: float) -> str:
+    """CLAIMED_AT before which a claim has expired (same format as _now)."""
+    return (datetime.now(timezone.utc) - timedelta(seconds=lease_seconds)).isoformat(timespec="seconds")
+
+
+def _to_row(sub: Subscription) -> list:
+    return [
+        sub.subscription_id,
+        json.dumps(list(sub.levels)),
+        json.dumps(list(sub.recipients)),
+        sub.email,
+        sub.phone,
+        bool(sub.email_alert),
+        bool(sub.sms_alert),
+        _now(),
+        sub.tenant_id
+    ]
+
+
+def _from_row(row) -> Subscription:
+    return Subscription(
+        subscription_id=row["SUBSCRIPTION_ID"],
+        levels=json.loads(row["LEVELS"] or "[]"),
+        recipients=json.loads(row["RECIPIENTS"] or "[]"),
+        email=row["EMAIL"] or "",
+        phone=row["PHONE"] or "",
+        email_alert=bool(row["EMAIL_ALERT"]),
+        sms_alert=bool(row["SMS_ALERT"]),
+        tenant_id=row["TENANT_ID"]
+    )
+
+
+def _state_from_frame(frame: pd.DataFrame) -> dict:
+    state = {}
+    for level, keys in frame.groupby("LEVEL")["ALERT_KEY"]:
+        state[level] = set(keys)
+    return state
+
+
+def _state_to_frame(state: dict) -> pd.DataFrame:
+    return pd.DataFrame(
+        [(level, key) for level, keys in state.items() for key in keys],
+        columns=["LEVEL", "ALERT_KEY"]
+    )
+
+
+# =================================================
+# SQLITE (LOCAL)
+# =================================================
+SQLITE_DDL = """
+CREATE TABLE IF NOT EXISTS ALERT_SUBSCRIPTIONS (
+    SUBSCRIPTION_ID TEXT PRIMARY KEY,
+    LEVELS TEXT,
+    RECIPIENTS TEXT,
+    EMAIL TEXT,
+    PHONE TEXT,
+    EMAIL_ALERT INTEGER,
+    SMS_ALERT INTEGER,
+    UPDATED_AT TEXT,
+    TENANT_ID TEXT
+);
+CREATE TABLE IF NOT EXISTS ALERT_STATE (
+    LEVEL TEXT,
+    ALERT_KEY TEXT,
+    PRIMARY KEY (LEVEL, ALERT_KEY)
+);
+CREATE TABLE IF NOT EXISTS ALERT_META (
+    META_KEY TEXT PRIMARY KEY,
+    META_VALUE TEXT
+);
+CREATE TABLE IF NOT EXISTS ALERT_RUN_LEDGER (
+    DIGEST_KEY TEXT PRIMARY KEY,
+    RUNNER_ID TEXT,
+    STATUS TEXT,
+    CLAIMED_AT TEXT,
+    FINISHED_AT TEXT
+);
+INSERT OR IGNORE INTO ALERT_META VALUES ('state_version', '0');
+"""
+
+
+class SqliteSubscriptionStore:
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # isolation_level=None: autocommit; transactions are explicit below
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(SQLITE_DDL)
+        columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(ALERT_SUBSCRIPTIONS)")}
+        if "TENANT_ID" not in columns:
+            # Tables from before tenancy: their subscriptions get no rows
+            # under a tenant directory until saved again
+            self._conn.execute("ALTER TABLE ALERT_SUBSCRIPTIONS ADD COLUMN TENANT_ID TEXT")
+
+    # Subscriptions
+    def save_subscription(self, sub: Subscription):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO ALERT_SUBSCRIPTIONS ({', '.join(SUBSCRIPTION_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(SUBSCRIPTION_COLUMNS))})",
+                _to_row(sub)
+            )
+
+    def get_subscription(self, subscription_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM ALERT_SUBSCRIPTIONS WHERE SUBSCRIPTION_ID = ?",
+                [subscription_id]
+            ).fetchone()
+        return None if row is None else _from_row(row)
+
+    def load_subscriptions(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM ALERT_SUBSCRIPTIONS").fetchall()
+        return [_from_row(r) for r in rows]
+
+    def delete_subscription(self, subscription_id: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM ALERT_SUBSCRIPTIONS WHERE SUBSCRIPTION_ID = ?",
+                [subscription_id]
+            )
+
+    # Alert state
+    def load_state(self):
+        """Return (state_version, state)."""
+        with self._lock:
+            version = int(self._conn.execute(
+                "SELECT META_VALUE FROM ALERT_META WHERE META_KEY = 'state_version'"
+            ).fetchone()[0])
+            frame = pd.read_sql_query("SELECT LEVEL, ALERT_KEY FROM ALERT_STATE", self._conn)
+        return version, _state_from_frame(frame)
+
+    def commit_state(self, expected_version: int, state: dict) -> bool:
+        """Replace the state if nobody committed since expected_version."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute(
+                    "UPDATE ALERT_META SET META_VALUE = ? "
+                    "WHERE META_KEY = 'state_version' AND META_VALUE = ?",
+                    [str(expected_version + 1), str(expected_version)]
+                )
+                if cur.rowcount != 1:
+                    cur.execute("ROLLBACK")
+                    return False
+                cur.execute("DELETE FROM ALERT_STATE")
+                cur.executemany(
+                    "INSERT INTO ALERT_STATE VALUES (?, ?)",
+                    _state_to_frame(state).itertuples(index=False, name=None)
+                )
+                cur.execute("COMMIT")
+                return True
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    # Run ledger
+    def claim(self, digest_key: str, runner_id: str, lease_seconds: float = CLAIM_LEASE_SECONDS) -> bool:
+        """Atomically claim a digest; False if another runner has it."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO ALERT_RUN_LEDGER (DIGEST_KEY, RUNNER_ID, STATUS, CLAIMED_AT) "
+                "VALUES (?, ?, 'CLAIMED', ?) "
+                "ON CONFLICT(DIGEST_KEY) DO UPDATE SET "
+                "RUNNER_ID = excluded.RUNNER_ID, STATUS = 'CLAIMED', CLAIMED_AT = excluded.CLAIMED_AT "
+                "WHERE ALERT_RUN_LEDGER.STATUS = 'FAILED' "
+                "OR (ALERT_RUN_LEDGER.STATUS = 'CLAIMED' AND ALERT_RUN_LEDGER.CLAIMED_AT < ?)",
+                [digest_key, runner_id, _now(), _lease_cutoff(lease_seconds)]
+            )
+            return cur.rowcount == 1
+
+    def ledger_status(self, digest_key: str):
+        """STATUS of a claimed digest (CLAIMED / SENT / FAILED), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT STATUS FROM ALERT_RUN_LEDGER WHERE DIGEST_KEY = ?", [digest_key]
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def finish(self, digest_key: str, status: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ALERT_RUN_LEDGER SET STATUS = ?, FINISHED_AT = ? WHERE DIGEST_KEY = ?",
+                [status, _now(), digest_key]
+            )
+
+
+# =================================================
+# SNOWFLAKE
+# =================================================
+SNOWFLAKE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS ALERT_SUBSCRIPTIONS (
+        SUBSCRIPTION_ID STRING,
+        LEVELS STRING,
+        RECIPIENTS STRING,
+        EMAIL STRING,
+        PHONE STRING,
+        EMAIL_ALERT BOOLEAN,
+        SMS_ALERT BOOLEAN,
+        UPDATED_AT STRING,
+        TENANT_ID STRING
+    )
+    """,
+    "ALTER TABLE ALERT_SUBSCRIPTIONS ADD COLUMN IF NOT EXISTS TENANT_ID STRING",
+    "CREATE TABLE IF NOT EXISTS ALERT_STATE (LEVEL STRING, ALERT_KEY STRING)",
+    "CREATE TABLE IF NOT EXISTS ALERT_META (META_KEY STRING, META_VALUE STRING)",
+    """
+    CREATE TABLE IF NOT EXISTS ALERT_RUN_LEDGER (
+        DIGEST_KEY STRING,
+        RUNNER_ID STRING,
+        STATUS STRING,
+        CLAIMED_AT STRING,
+        FINISHED_AT STRING
+    )
+    """,
+    """
+    MERGE INTO ALERT_META t
+    USING (SELECT 'state_version' AS META_KEY) s ON t.META_KEY = s.META_KEY
+    WHEN NOT MATCHED THEN INSERT (META_KEY, META_VALUE) VALUES ('state_version', '0')
+    """
+]
+
+
+class SnowflakeSubscriptionStore:
+    """
+    Same interface as SqliteSubscriptionStore.
+
+    Snowflake does not enforce primary keys, so claims and upserts use
+    MERGE: DML on one table is serialized, so of two overlapping MERGEs
+    for the same key only the first inserts.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        for ddl in SNOWFLAKE_DDL:
+            session.sql(ddl).collect()
+
+    def _sql(self, query, params=None):
+        return self.session.sql(query, params=params).collect()
+
+    # Subscriptions
+    def save_subscription(self, sub: Subscription):
+        cols = SUBSCRIPTION_COLUMNS
+        with self._lock:
+            self._sql(
+                f"""
+                MERGE INTO ALERT_SUBSCRIPTIONS t
+                USING (SELECT {', '.join(f'? AS {c}' for c in cols)}) s
+                ON t.SUBSCRIPTION_ID = s.SUBSCRIPTION_ID
+                WHEN MATCHED THEN UPDATE SET {', '.join(f't.{c} = s.{c}' for c in cols[1:])}
+                WHEN NOT MATCHED THEN INSERT ({', '.join(cols)})
+                    VALUES ({', '.join(f's.{c}' for c in cols)})
+                """,
+                _to_row(sub)
+            )
+
+    def get_subscription(self, subscription_id: str):
+        with self._lock:
+            rows = self._sql(
+                "SELECT * FROM ALERT_SUBSCRIPTIONS WHERE SUBSCRIPTION_ID = ?",
+                [subscription_id]
+            )
+        return _from_row(rows[0].as_dict()) if rows else None
+
+    def load_subscriptions(self):
+        with self._lock:
+            rows = self._sql("SELECT * FROM ALERT_SUBSCRIPTIONS")
+        return [_from_row(r.as_dict()) for r in rows]
+
+    def delete_subscription(self, subscription_id: str):
+        with self._lock:
+            self._sql("DELETE FROM ALERT_SUBSCRIPTIONS WHERE SUBSCRIPTION_ID = ?", [subscription_id])
+
+    # Alert state
+    def load_state(self):
+        with self._lock:
+            version = int(self._sql(
+                "SELECT META_VALUE FROM ALERT_META WHERE META_KEY = 'state_version'"
+            )[0][0])
+            frame = self.session.sql("SELECT LEVEL, ALERT_KEY FROM ALERT_STATE").to_pandas()
+        return version, _state_from_frame(frame)
+
+    STATE_STAGE = "ALERT_STATE_STAGE"
+
+    def commit_state(self, expected_version: int, state: dict) -> bool:
+        frame = _state_to_frame(state)
+        with self._lock:
+            # Staged before BEGIN: write_pandas creates a temporary stage
+            # and file format, and that DDL would commit the open
+            # transaction between the version bump and the insert
+            if not frame.empty:
+                self.session.write_pandas(
+                    frame, self.STATE_STAGE, auto_create_table=True, table_type="temporary", overwrite=True
+                )
+            self._sql("BEGIN")
+            try:
+                updated = self._sql(
+                    "UPDATE ALERT_META SET META_VALUE = ? "
+                    "WHERE META_KEY = 'state_version' AND META_VALUE = ?",
+                    [str(expected_version + 1), str(expected_version)]
+                )[0][0]
+                if updated != 1:
+                    self._sql("ROLLBACK")
+                    return False
+                self._sql("DELETE FROM ALERT_STATE")
+                if not frame.empty:
+                    self._sql(f"INSERT INTO ALERT_STATE (LEVEL, ALERT_KEY) SELECT LEVEL, ALERT_KEY FROM {self.STATE_STAGE}")
+                self._sql("COMMIT")
+                return True
+            except Exception:
+                self._sql("ROLLBACK")
+                raise
+
+    # Run ledger
+    def claim(self, digest_key: str, runner_id: str, lease_seconds: float = CLAIM_LEASE_SECONDS) -> bool:
+        with self._lock:
+            result = self._sql(
+                """
+                MERGE INTO ALERT_RUN_LEDGER t
+                USING (SELECT ? AS DIGEST_KEY, ? AS RUNNER_ID, ? AS CLAIMED_AT, ? AS LEASE_CUTOFF) s
+                ON t.DIGEST_KEY = s.DIGEST_KEY
+                WHEN MATCHED AND (t.STATUS = 'FAILED' OR (t.STATUS = 'CLAIMED' AND t.CLAIMED_AT < s.LEASE_CUTOFF))
+                    THEN UPDATE SET
+                    t.RUNNER_ID = s.RUNNER_ID, t.STATUS = 'CLAIMED', t.CLAIMED_AT = s.CLAIMED_AT
+                WHEN NOT MATCHED THEN INSERT (DIGEST_KEY, RUNNER_ID, STATUS, CLAIMED_AT)
+                    VALUES (s.DIGEST_KEY, s.RUNNER_ID, 'CLAIMED', s.CLAIMED_AT)
+                """,
+                [digest_key, runner_id, _now(), _lease_cutoff(lease_seconds)]
+            )
+        # Result row: (rows inserted, rows updated)
+        return sum(int(v) for v in result[0]) == 1
+
+    def ledger_status(self, digest_key: str):
+        with self._lock:
+            rows = self._sql("SELECT STATUS FROM ALERT_RUN_LEDGER WHERE DIGEST_KEY = ?", [digest_key])
+        return rows[0][0] if rows else None
+
+    def finish(self, digest_key: str, status: str):
+        with self._lock:
+            self._sql(
+                "UPDATE ALERT_RUN_LEDGER SET STATUS = ?, FINISHED_AT = ? WHERE DIGEST_KEY = ?",
+                [status, _now(), digest_key]
+            )
+
+
+def open_subscription_store(session=None, sqlite_path: str = DEFAULT_SQLITE_PATH):
+    """Snowflake-backed store when a session exists, SQLite otherwise."""
+    if session is not None:
+        return SnowflakeSubscriptionStore(session)
+    return SqliteSubscriptionStore(sqlite_path)
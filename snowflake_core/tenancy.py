@@ -0,0 +1,227 @@
+# tenancy.py
+"""
+Tenants: row-level scoping by location set and per-tenant cache partitions.
+
+Hospitals, PDS depots and NGOs share one deployment. A tenant owns a set
+of locations; a user belongs to one tenant.
+
+Directory (Snowflake tables, or a local JSON file):
+- TENANTS            TENANT_ID, QUOTA_MB
+- TENANT_USERS       USER_NAME, TENANT_ID
+- TENANT_LOCATIONS   TENANT_ID, LOCATION  ('*' = every location)
+
+Scoping happens where the rows are: scoped_sql() wraps a query with a
+semi-join on TENANT_LOCATIONS bound to the tenant id, so Snowflake only
+returns the tenant's rows. Local sources (snapshot, history, lots) go
+through scope_frame().
+
+TenantCache keeps one LRU partition per tenant with its own byte quota,
+so a national tenant reloading a large frame only evicts its own
+entries. Without a directory the deployment is single-tenant
+(ALL_TENANT sees everything); with one, unknown users get no rows.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pandas as pd
+
+
+ALL_LOCATIONS = "*"
+DEFAULT_QUOTA_MB = 256
+
+TENANTS_SQL = "SELECT TENANT_ID, QUOTA_MB FROM TENANTS"
+TENANT_USERS_SQL = "SELECT USER_NAME, TENANT_ID FROM TENANT_USERS"
+TENANT_LOCATIONS_SQL = "SELECT TENANT_ID, LOCATION FROM TENANT_LOCATIONS"
+
+
+@dataclass(frozen=True)
+class Tenant:
+    tenant_id: str
+    locations: frozenset = None   # None = every location
+    quota_bytes: int = DEFAULT_QUOTA_MB * 1024 ** 2
+
+    @property
+    def unrestricted(self) -> bool:
+        return self.locations is None
+
+
+ALL_TENANT = Tenant("all")
+NO_ACCESS = Tenant("none", locations=frozenset(), quota_bytes=0)
+
+
+class TenantDirectory:
+    def __init__(self, tenants: dict, users: dict):
+        self.tenants = tenants
+        self.users = users
+
+    def tenant_for(self, user_name: str) -> Tenant:
+        return self.tenant(self.users.get((user_name or "").lower()))
+
+    def tenant(self, tenant_id: str) -> Tenant:
+        return self.tenants.get(tenant_id, NO_ACCESS)
+
+    @classmethod
+    def from_frames(cls, tenants: pd.DataFrame, users: pd.DataFrame, locations: pd.DataFrame):
+        quotas = dict(zip(tenants["TENANT_ID"].astype(str), tenants["QUOTA_MB"]))
+        owned = locations.astype({"TENANT_ID": str}).groupby("TENANT_ID")["LOCATION"].agg(frozenset)
+        out = {}
+        for tenant_id in set(quotas) | set(owned.index):
+            locs = owned.get(tenant_id, frozenset())
+            quota = quotas.get(tenant_id)
+            out[tenant_id] = Tenant(
+                tenant_id,
+                None if ALL_LOCATIONS in locs else locs,
+                int((DEFAULT_QUOTA_MB if pd.isna(quota) else quota) * 1024 ** 2)
+            )
+        user_map = {str(u).lower(): str(t) for u, t in zip(users["USER_NAME"], users["TENANT_ID"])}
+        return cls(out, user_map)
+
+    @classmethod
+    def from_json(cls, path: str):
+        """{"tenants": {id: {"locations": [...], "quota_mb": n}}, "users": {name: id}}"""
+        with open(path, "r", encoding="utf-8") as fh:
+            spec = json.load(fh)
+        tenants = {}
+        for tenant_id, t in spec.get("tenants", {}).items():
+            locs = t.get("locations", [])
+            tenants[tenant_id] = Tenant(
+                tenant_id,
+                None if ALL_LOCATIONS in locs else frozenset(locs),
+                int(t.get("quota_mb", DEFAULT_QUOTA_MB) * 1024 ** 2)
+            )
+        users = {str(u).lower(): t for u, t in spec.get("users", {}).items()}
+        return cls(tenants, users)
+
+
+def load_directory(session=None, path: str = None):
+    """TenantDirectory from Snowflake or a JSON file; None = single tenant."""
+    try:
+        if session is not None:
+            return TenantDirectory.from_frames(
+                session.sql(TENANTS_SQL).to_pandas(),
+                session.sql(TENANT_USERS_SQL).to_pandas(),
+                session.sql(TENANT_LOCATIONS_SQL).to_pandas()
+            )
+        if path and os.path.exists(path):
+            return TenantDirectory.from_json(path)
+    except Exception:
+        pass
+    return None
+
+
+def resolve_tenant(directory, user_name: str) -> Tenant:
+    return ALL_TENANT if directory is None else directory.tenant_for(user_name)
+
+
+# =================================================
+# SCOPING
+# =================================================
+def scoped_sql(sql: str, tenant: Tenant):
+    """(sql, params) returning only the tenant's rows of `sql`."""
+    if tenant.unrestricted:
+        return sql, None
+    return (
+        f"""
+        SELECT q.* FROM ({sql}) q
+        WHERE q.LOCATION IN (
+            SELECT LOCATION FROM TENANT_LOCATIONS WHERE TENANT_ID = ?
+        )
+        """,
+        [tenant.tenant_id]
+    )
+
+
+def scope_frame(df, tenant: Tenant):
+    """Rows of a local frame the tenant may see."""
+    if df is None or tenant.unrestricted:
+        return df
+    return df[df["LOCATION"].isin(tenant.locations)]
+
+
+# =================================================
+# PER-TENANT CACHE PARTITIONS
+# =================================================
+def frame_bytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    return 0
+
+
+class TenantCache:
+    """
+    Per-tenant LRU partitions, each bounded by its tenant's quota.
+
+    ttl: seconds an entry is served (versioned keys make most entries
+    stale by key instead).
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._partitions = {}
+        self._inflight = {}
+
+    def _partition(self, tenant_id):
+        return self._partitions.setdefault(tenant_id, OrderedDict())
+
+    def get(self, tenant: Tenant, key, load, keep=None):
+        """
+        Cached value for (tenant, key); load() runs once per miss.
+        keep(value) returning False serves the value without caching it.
+        """
+        with self._lock:
+            part = self._partition(tenant.tenant_id)
+            entry = part.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                part.move_to_end(key)
+                return entry[0]
+            event = self._inflight.get((tenant.tenant_id, key))
+            owner = event is None
+            if owner:
+                event = self._inflight[(tenant.tenant_id, key)] = threading.Event()
+
+        if not owner:
+            event.wait()
+            # keep passes on: the owner may have served without caching
+            return self.get(tenant, key, load, keep)
+
+        try:
+            value = load()
+            if keep is None or keep(value):
+                self._store(tenant, key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop((tenant.tenant_id, key), None)
+            event.set()
+
+    def _store(self, tenant: Tenant, key, value):
+        size = frame_bytes(value)
+        with self._lock:
+            part = self._partition(tenant.tenant_id)
+            part.pop(key, None)
+            if size > tenant.quota_bytes:
+                # Larger than the whole quota: served, never cached
+                return
+            part[key] = (value, time.time(), size)
+            used = sum(e[2] for e in part.values())
+            while used > tenant.quota_bytes:
+                _, (_, _, evicted) = part.popitem(last=False)
+                used -= evicted
+
+    def usage(self) -> dict:
+        """Bytes held per tenant."""
+        with self._lock:
+            return {t: sum(e[2] for e in part.values()) for t, part in self._partitions.items()}
+
+    def clear(self, tenant_id=None):
+        with self._lock:
+            if tenant_id is None:
+                self._partitions.clear()
+            else:
+                self._partitions.pop(tenant_id, None)
@@ -0,0 +1,311 @@
+# transitions.py
+"""
+Change-data feed of stock status transitions.
+
+Consumers (alerts, Impact metrics, audit) read a compact stream of
+
+    (LOCATION, ITEM, OLD_STATUS, NEW_STATUS, TRANSITION_TS)
+
+instead of diffing full snapshots themselves. The diff runs once per
+STOCK_HEALTH_DT version:
+
+- Snowflake: a full outer (hash) join of STOCK_HEALTH_DT against
+  STOCK_STATUS_CURRENT inside the warehouse; no rows leave Snowflake.
+  The status is recomputed under the app's status policy (status.py)
+  rather than read from the dynamic table, whose thresholds are fixed
+- Local: the same join with pandas merge over the snapshot frame, which
+  the app already classifies under that policy
+
+TRANSITION_TS is naive UTC everywhere (SYSDATE() in Snowflake, not the
+session-time-zone CURRENT_TIMESTAMP()), the same clock as ACTION_LOG, so
+impact.py can merge both streams in time order.
+
+Each version is claimed in STOCK_STATUS_FEED_VERSIONS first, so with
+several app processes only one of them pays for the diff. Transitions
+are appended to STOCK_STATUS_TRANSITIONS and never updated.
+"""
+
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from status import status_case_sql
+from subscriptions import DEFAULT_SQLITE_PATH
+
+
+Transition = namedtuple(
+    "Transition",
+    ["LOCATION", "ITEM", "OLD_STATUS", "NEW_STATUS", "TRANSITION_TS"]
+)
+
+TRANSITION_COLUMNS = list(Transition._fields) + ["SNAPSHOT_VERSION"]
+KEY = ["LOCATION", "ITEM"]
+
+
+def _now():
+    # Microseconds: the impact watermark is a strict > on this string, so
+    # two refreshes within one second must not share a timestamp
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(sep=" ", timespec="microseconds")
+
+
+def diff_snapshots(previous: pd.DataFrame, current: pd.DataFrame, ts: str = None) -> pd.DataFrame:
+    """
+    Status transitions between two snapshots (hash-join on LOCATION, ITEM).
+
+    New keys appear with OLD_STATUS = None, removed keys with
+    NEW_STATUS = None. Unchanged rows are dropped.
+    """
+    def statuses(frame):
+        out = frame[KEY + ["STOCK_STATUS"]].copy()
+        for col in out.columns:
+            out[col] = out[col].astype("object")
+        return out.drop_duplicates(KEY, keep="last")
+
+    prev = statuses(previous).rename(columns={"STOCK_STATUS": "OLD_STATUS"})
+    curr = statuses(current).rename(columns={"STOCK_STATUS": "NEW_STATUS"})
+
+    joined = prev.merge(curr, on=KEY, how="outer")
+    old = joined["OLD_STATUS"]
+    new = joined["NEW_STATUS"]
+    changed = (old != new) & ~(old.isna() & new.isna())
+
+    out = joined.loc[changed, KEY + ["OLD_STATUS", "NEW_STATUS"]].reset_index(drop=True)
+    out = out.astype("object").where(out.notna(), None)
+    out["TRANSITION_TS"] = ts or _now()
+    return out
+
+
+def iter_transitions(frame: pd.DataFrame):
+    """Yield Transition tuples from a transitions frame."""
+    for row in frame[list(Transition._fields)].itertuples(index=False, name=None):
+        yield Transition(*row)
+
+
+# =================================================
+# SQLITE (LOCAL)
+# =================================================
+SQLITE_DDL = """
+CREATE TABLE IF NOT EXISTS STOCK_STATUS_TRANSITIONS (
+    LOCATION TEXT,
+    ITEM TEXT,
+    OLD_STATUS TEXT,
+    NEW_STATUS TEXT,
+    TRANSITION_TS TEXT,
+    SNAPSHOT_VERSION TEXT
+);
+CREATE INDEX IF NOT EXISTS STOCK_STATUS_TRANSITIONS_TS
+    ON STOCK_STATUS_TRANSITIONS (TRANSITION_TS);
+CREATE TABLE IF NOT EXISTS STOCK_STATUS_CURRENT (
+    LOCATION TEXT,
+    ITEM TEXT,
+    STOCK_STATUS TEXT,
+    PRIMARY KEY (LOCATION, ITEM)
+);
+CREATE TABLE IF NOT EXISTS STOCK_STATUS_FEED_VERSIONS (
+    SNAPSHOT_VERSION TEXT PRIMARY KEY,
+    PROCESSED_AT TEXT
+);
+"""
+
+
+class SqliteTransitionStore:
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.executescript(SQLITE_DDL)
+
+    def _claim(self, cur, version) -> bool:
+        cur.execute(
+            "INSERT OR IGNORE INTO STOCK_STATUS_FEED_VERSIONS VALUES (?, ?)",
+            [str(version), _now()]
+        )
+        return cur.rowcount == 1
+
+    def refresh(self, version, snapshot: pd.DataFrame) -> int:
+        """Diff `snapshot` against the last one and append transitions.
+
+        Returns the number of transitions written, or -1 when this
+        version was already processed.
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if not self._claim(cur, version):
+                    cur.execute("ROLLBACK")
+                    return -1
+
+                previous = pd.read_sql_query(
+                    "SELECT LOCATION, ITEM, STOCK_STATUS FROM STOCK_STATUS_CURRENT", self._conn
+                )
+                # Strictly after every stored transition, even if the clock
+                # steps back or two refreshes land in the same microsecond
+                ts = _now()
+                last = cur.execute("SELECT MAX(TRANSITION_TS) FROM STOCK_STATUS_TRANSITIONS").fetchone()[0]
+                if last is not None and ts <= last:
+                    ts = (pd.Timestamp(last) + pd.Timedelta(microseconds=1)).isoformat(sep=" ", timespec="microseconds")
+                changes = diff_snapshots(previous, snapshot, ts)
+                changes["SNAPSHOT_VERSION"] = str(version)
+
+                cur.executemany(
+                    f"INSERT INTO STOCK_STATUS_TRANSITIONS VALUES ({', '.join('?' * len(TRANSITION_COLUMNS))})",
+                    changes[TRANSITION_COLUMNS].itertuples(index=False, name=None)
+                )
+                # Only changed keys touch the current-status table
+                gone = changes[changes["NEW_STATUS"].isna()]
+                cur.executemany(
+                    "DELETE FROM STOCK_STATUS_CURRENT WHERE LOCATION = ? AND ITEM = ?",
+                    gone[KEY].itertuples(index=False, name=None)
+                )
+                upserts = changes[changes["NEW_STATUS"].notna()]
+                cur.executemany(
+                    "INSERT OR REPLACE INTO STOCK_STATUS_CURRENT VALUES (?, ?, ?)",
+                    upserts[KEY + ["NEW_STATUS"]].itertuples(index=False, name=None)
+                )
+                cur.execute("COMMIT")
+                return len(changes)
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def read(self, since: str = None, chunksize: int = 10_000):
+        """Iterate transitions (oldest first), optionally after `since`."""
+        # One keyset-paginated query per chunk: the lock is held while a
+        # chunk is fetched, never across a yield, so a consumer that stops
+        # early cannot block refresh()
+        query = f"SELECT {', '.join(Transition._fields)}, rowid FROM STOCK_STATUS_TRANSITIONS"
+        order = " ORDER BY TRANSITION_TS, rowid LIMIT ?"
+        cursor = None
+        while True:
+            if cursor is not None:
+                where = " WHERE TRANSITION_TS > ? OR (TRANSITION_TS = ? AND rowid > ?)"
+                params = [cursor[0], cursor[0], cursor[1]]
+            elif since is not None:
+                where, params = " WHERE TRANSITION_TS > ?", [str(since)]
+            else:
+                where, params = "", []
+            with self._lock:
+                rows = self._conn.execute(query + where + order, params + [chunksize]).fetchall()
+            for row in rows:
+                yield Transition(*row[:-1])
+            if len(rows) < chunksize:
+                return
+            cursor = (rows[-1][4], rows[-1][-1])
+
+
+# =================================================
+# SNOWFLAKE
+# =================================================
+SNOWFLAKE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS STOCK_STATUS_TRANSITIONS (
+        LOCATION STRING,
+        ITEM STRING,
+        OLD_STATUS STRING,
+        NEW_STATUS STRING,
+        TRANSITION_TS TIMESTAMP_NTZ,
+        SNAPSHOT_VERSION STRING
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS STOCK_STATUS_CURRENT (LOCATION STRING, ITEM STRING, STOCK_STATUS STRING)",
+    "CREATE TABLE IF NOT EXISTS STOCK_STATUS_FEED_VERSIONS (SNAPSHOT_VERSION STRING, PROCESSED_AT TIMESTAMP_NTZ)"
+]
+
+# {status} is the status CASE from status.py, so transitions follow the
+# same thresholds as the app
+SNOWFLAKE_DIFF_SQL = """
+    INSERT INTO STOCK_STATUS_TRANSITIONS
+    SELECT
+        COALESCE(c.LOCATION, p.LOCATION),
+        COALESCE(c.ITEM, p.ITEM),
+        p.STOCK_STATUS,
+        c.STOCK_STATUS,
+        SYSDATE(),
+        ?
+    FROM (
+        SELECT
+            LOCATION,
+            ITEM,
+            {status} AS STOCK_STATUS
+        FROM STOCK_HEALTH_DT
+    ) c
+    FULL OUTER JOIN STOCK_STATUS_CURRENT p
+        ON c.LOCATION = p.LOCATION AND c.ITEM = p.ITEM
+    WHERE p.STOCK_STATUS IS DISTINCT FROM c.STOCK_STATUS
+"""
+
+SNOWFLAKE_SYNC_CURRENT_SQL = """
+    MERGE INTO STOCK_STATUS_CURRENT t
+    USING (
+        SELECT LOCATION, ITEM, NEW_STATUS
+        FROM STOCK_STATUS_TRANSITIONS
+        WHERE SNAPSHOT_VERSION = ?
+    ) s
+    ON t.LOCATION = s.LOCATION AND t.ITEM = s.ITEM
+    WHEN MATCHED AND s.NEW_STATUS IS NULL THEN DELETE
+    WHEN MATCHED THEN UPDATE SET t.STOCK_STATUS = s.NEW_STATUS
+    WHEN NOT MATCHED AND s.NEW_STATUS IS NOT NULL THEN
+        INSERT (LOCATION, ITEM, STOCK_STATUS) VALUES (s.LOCATION, s.ITEM, s.NEW_STATUS)
+"""
+
+
+class SnowflakeTransitionStore:
+    """Runs the diff as warehouse SQL; the snapshot argument is unused."""
+
+    def __init__(self, session, policy=None):
+        self.session = session
+        self._lock = threading.Lock()
+        self._diff_sql = SNOWFLAKE_DIFF_SQL.format(
+            status=status_case_sql("CLOSING_STOCK / NULLIF(AVG_DAILY_DEMAND, 0)", "ITEM", policy, indent="            ")
+        )
+        for ddl in SNOWFLAKE_DDL:
+            session.sql(ddl).collect()
+
+    def _sql(self, query, params=None):
+        return self.session.sql(query, params=params).collect()
+
+    def refresh(self, version, snapshot: pd.DataFrame = None) -> int:
+        version = str(version)
+        with self._lock:
+            self._sql("BEGIN")
+            try:
+                claimed = self._sql(
+                    """
+                    MERGE INTO STOCK_STATUS_FEED_VERSIONS t
+                    USING (SELECT ? AS SNAPSHOT_VERSION) s
+                    ON t.SNAPSHOT_VERSION = s.SNAPSHOT_VERSION
+                    WHEN NOT MATCHED THEN INSERT (SNAPSHOT_VERSION, PROCESSED_AT)
+                        VALUES (s.SNAPSHOT_VERSION, SYSDATE())
+                    """,
+                    [version]
+                )[0][0]
+                if int(claimed) != 1:
+                    self._sql("ROLLBACK")
+                    return -1
+                written = self._sql(self._diff_sql, [version])[0][0]
+                self._sql(SNOWFLAKE_SYNC_CURRENT_SQL, [version])
+                self._sql("COMMIT")
+                return int(written)
+            except Exception:
+                self._sql("ROLLBACK")
+                raise
+
+    def read(self, since=None, chunksize: int = 10_000):
+        query = f"SELECT {', '.join(Transition._fields)} FROM STOCK_STATUS_TRANSITIONS"
+        params = None
+        if since is not None:
+            query += " WHERE TRANSITION_TS > ?"
+            params = [str(since)]
+        query += " ORDER BY TRANSITION_TS"
+
+        for batch in self.session.sql(query, params=params).to_pandas_batches():
+            yield from iter_transitions(batch)
+
+
+def open_transition_store(session=None, sqlite_path: str = DEFAULT_SQLITE_PATH, policy=None):
+    if session is not None:
+        return SnowflakeTransitionStore(session, policy)
+    return SqliteTransitionStore(sqlite_path)